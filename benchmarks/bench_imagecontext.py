@@ -0,0 +1,105 @@
+"""
+Counts the file opens and bytes read of one verify trial (read the image,
+solve it with the native star finder, compute the center and rotation of the
+solution) when each step opens the files itself, and when they share an
+ImageContext.
+
+    python benchmarks/bench_imagecontext.py --size 2048 --repeat 5
+
+Opens are counted with an audit hook on the files of the trial, bytes with
+the read() calls of this thread (rchar in /proc/thread-self/io) and the
+pages it touched (minor page faults, mostly memory-mapped pixels), Linux
+only. The solve-field run (or its stand-in, see run_benchmarks.py) is a
+separate process and is the same in both cases.
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from chimera.util.image import Image
+from run_benchmarks import install_fake_solve_field
+from synthetic import write_star_field
+
+from chimera_pverify.util.astrometrynet import AstrometryNet
+from chimera_pverify.util.imagecontext import ImageContext
+
+_opens = []
+_watch = None
+
+
+def _audit(event, args):
+    if event == "open" and _watch is not None and isinstance(args[0], str) and args[0].startswith(_watch):
+        _opens.append(args[0])
+
+
+def rchar():
+    try:
+        with open("/proc/thread-self/io") as f:
+            return int(next(line for line in f if line.startswith("rchar")).split()[1])
+    except (OSError, StopIteration):
+        return 0
+
+
+def page_faults():
+    return resource.getrusage(resource.RUSAGE_THREAD).ru_minflt
+
+
+def separate(path):
+    image = Image.from_file(path)
+    wcs_image = Image.from_file(AstrometryNet.solve_field(path, find_star_method="native"))
+    wcs_image.world_at((image["NAXIS1"] / 2.0, image["NAXIS2"] / 2.0))
+    wcs_image.get_rotation()
+
+
+def shared(path):
+    image = ImageContext.from_file(path)
+    AstrometryNet.solve_field(path, find_star_method="native", context=image)
+    image.solution.world_at((image["NAXIS1"] / 2.0, image["NAXIS2"] / 2.0))
+    image.solution.get_rotation()
+
+
+def measure(func, path, repeat):
+    func(path)  # warm up lazy imports
+    del _opens[:]
+    read0, faults0 = rchar(), page_faults()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        func(path)
+    elapsed = (time.perf_counter() - t0) / repeat
+    touched = (page_faults() - faults0) * resource.getpagesize()
+    return len(_opens) / repeat, (rchar() - read0) / repeat, touched / repeat, elapsed
+
+
+def main():
+    global _watch
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="image size in pixels")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pverify-bench-")
+    if shutil.which("solve-field") is None:
+        install_fake_solve_field(workdir)
+    try:
+        path = os.path.join(workdir, "field.fits")
+        write_star_field(path, width=args.size, height=args.size)
+        sys.addaudithook(_audit)
+        _watch = workdir
+        for name, func in (("separate", separate), ("shared", shared)):
+            opens, nbytes, touched, elapsed = measure(func, path, args.repeat)
+            print(
+                f"{name:>9s}: {opens:5.1f} opens  {nbytes / 2**20:8.2f} MiB read  {touched / 2**20:8.2f} MiB paged in  "
+                f"{1000 * elapsed:8.1f} ms per trial"
+            )
+    finally:
+        _watch = None
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
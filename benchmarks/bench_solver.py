@@ -0,0 +1,55 @@
+"""
+Compares per-solve latency of the one-shot solve-field subprocess with a
+running SolverServer.
+
+    python -m chimera_pverify.util.solverserver --index-dir /usr/share/astrometry &
+    python benchmarks/bench_solver.py image1.fits image2.fits ... --repeat 3
+"""
+
+import argparse
+import statistics
+import time
+
+from chimera_pverify.util.astrometrynet import (
+    AstrometryNet,
+    NoSolutionAstrometryNetException,
+)
+from chimera_pverify.util.solverserver import DEFAULT_ADDRESS
+
+
+def time_solves(files, repeat, find_star_method, server):
+    latencies = []
+    failures = 0
+    for _ in range(repeat):
+        for f in files:
+            t0 = time.perf_counter()
+            try:
+                AstrometryNet.solve_field(f, find_star_method=find_star_method, server=server)
+            except NoSolutionAstrometryNetException:
+                failures += 1
+            latencies.append(time.perf_counter() - t0)
+    return latencies, failures
+
+
+def report(name, latencies, failures):
+    print(
+        f"{name:>12s}: n={len(latencies):d} failed={failures:d} "
+        f"mean={statistics.mean(latencies):6.3f}s median={statistics.median(latencies):6.3f}s "
+        f"min={min(latencies):6.3f}s max={max(latencies):6.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="FITS images with CRVAL1/CRVAL2 pointing hints")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--method", default="sex", choices=["sex", "astrometry.net"])
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="SolverServer address")
+    args = parser.parse_args()
+
+    report("subprocess", *time_solves(args.files, args.repeat, args.method, None))
+    report("server", *time_solves(args.files, args.repeat, args.method, args.address))
+
+
+if __name__ == "__main__":
+    main()
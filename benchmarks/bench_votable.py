@@ -0,0 +1,80 @@
+"""
+Compares the VOTable DOM parser with the streaming parse_table on a
+synthetic Vizier-like result.
+
+    python benchmarks/bench_votable.py --rows 9999
+"""
+
+import argparse
+import base64
+import io
+import struct
+import time
+import tracemalloc
+
+from chimera_pverify.util.votable import VOTable, parse_table
+
+HEADER = """<?xml version="1.0"?>
+<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">
+<RESOURCE><TABLE>
+<FIELD name="RAJ2000" datatype="double"/>
+<FIELD name="DEJ2000" datatype="double"/>
+<FIELD name="ID" datatype="char" arraysize="12"/>
+<FIELD name="Vmag" datatype="float"/>
+<FIELD name="_r" datatype="float"/>
+<DATA>
+"""
+FOOTER = "</DATA></TABLE></RESOURCE></VOTABLE>\n"
+
+
+def make_rows(n):
+    return [(i * 360.0 / n, -30.0 + i * 60.0 / n, f"SA {i % 120} {i}", 8.0 + (i % 70) / 10.0, i / 100.0) for i in range(n)]
+
+
+def make_tabledata(rows):
+    body = "".join(f"<TR><TD>{r[0]}</TD><TD>{r[1]}</TD><TD>{r[2]}</TD><TD>{r[3]}</TD><TD>{r[4]}</TD></TR>\n" for r in rows)
+    return (HEADER + "<TABLEDATA>\n" + body + "</TABLEDATA>" + FOOTER).encode()
+
+
+def make_binary(rows):
+    data = b"".join(struct.pack(">dd12sff", r[0], r[1], r[2].encode(), r[3], r[4]) for r in rows)
+    return (HEADER + "<BINARY><STREAM encoding='base64'>" + base64.b64encode(data).decode() + "</STREAM></BINARY>" + FOOTER).encode()
+
+
+def parse_dom(data):
+    votable = VOTable(io.BytesIO(data))
+    rows = votable.root.VOTABLE.RESOURCE.TABLE.DATA.TABLEDATA.TR
+    return [[c.getContent() for c in row.getNodeList()] for row in rows]
+
+
+def measure(func, data, repeat):
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        func(data)
+    return (time.perf_counter() - t0) / repeat, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=9999)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    tabledata = make_tabledata(rows)
+    binary = make_binary(rows)
+    for name, func, data in (
+        ("dom tabledata", parse_dom, tabledata),
+        ("stream tabledata", lambda d: parse_table(io.BytesIO(d)), tabledata),
+        ("stream binary", lambda d: parse_table(io.BytesIO(d)), binary),
+    ):
+        elapsed, peak = measure(func, data, args.repeat)
+        print(f"{name:>18s}: {1000 * elapsed:8.2f} ms  peak memory {peak / 2**20:7.2f} MiB  ({len(data) / 2**20:.2f} MiB input)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Stand-in for astrometry.net's solve-field, for benchmarking where the real
+binary is not installed.
+
+It accepts the solve-field options solve_field uses and writes <out>.solved
+and a TAN <out>.wcs centered on the --ra/--dec hint (or on TRUE_RA/TRUE_DEC
+of synthetic images), so the rest of the pipeline runs unchanged.
+PVERIFY_FAKE_SOLVE_CENTER="ra,dec" overrides the center, e.g. for star
+lists of synthetic images. The solve itself takes PVERIFY_FAKE_SOLVE_SECONDS
+(default 0).
+"""
+
+import argparse
+import os
+import time
+
+from astropy.io import fits
+from synthetic import make_wcs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input")
+    parser.add_argument("-o", "--out")
+    parser.add_argument("-D", "--dir")
+    parser.add_argument("--ra", type=float)
+    parser.add_argument("--dec", type=float)
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--scale-low", type=float)
+    parser.add_argument("--scale-high", type=float)
+    args, _ = parser.parse_known_args()
+
+    ra, dec, width, height, scale = args.ra, args.dec, args.width, args.height, None
+    if args.scale_low is not None and args.scale_high is not None:
+        scale = (args.scale_low + args.scale_high) / 2.0
+    if not args.input.endswith(".xyls"):
+        header = fits.getheader(args.input)
+        ra, dec = header.get("TRUE_RA", ra), header.get("TRUE_DEC", dec)
+        width, height = header["NAXIS1"], header["NAXIS2"]
+        if scale is None and "CD2_2" in header:
+            scale = abs(header["CD2_2"]) * 3600.0
+
+    if os.environ.get("PVERIFY_FAKE_SOLVE_CENTER"):
+        ra, dec = (float(x) for x in os.environ["PVERIFY_FAKE_SOLVE_CENTER"].split(","))
+
+    time.sleep(float(os.environ.get("PVERIFY_FAKE_SOLVE_SECONDS", 0)))
+
+    directory = args.dir or os.path.dirname(args.input)
+    out = args.out or os.path.splitext(os.path.basename(args.input))[0]
+    outbase = os.path.join(directory, out)
+    wcs = make_wcs(width or 2048, height or 2048, ra, dec, scale or 1.0)
+    fits.PrimaryHDU(header=wcs.to_header()).writeto(outbase + ".wcs", overwrite=True)
+    open(outbase + ".solved", "wb").close()
+
+
+if __name__ == "__main__":
+    main()
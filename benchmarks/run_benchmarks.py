@@ -0,0 +1,244 @@
+"""
+Offline benchmark suite on synthetic star fields.
+
+Times source extraction, solve_field, VOTable parsing and the WCS center
+computation across image sizes, and appends the results to a JSON lines
+file so runs can be compared over time. Where solve-field is not installed
+a local stand-in (fake_solve_field.py) is put on the PATH, so only the
+plugin's own overhead around the solver is measured.
+
+    python benchmarks/run_benchmarks.py --sizes 1024 2048 4096 --label baseline
+    python benchmarks/run_benchmarks.py --label mychange --compare baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS, FITSFixedWarning
+from bench_votable import make_binary, make_rows, make_tabledata
+from synthetic import write_star_field
+
+from chimera_pverify.util.starfinder import find_stars
+from chimera_pverify.util.votable import parse_table
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(HERE, "results.jsonl")
+
+
+def timeit(func, repeat):
+    """
+    Returns the durations of repeat calls of func and the last result.
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - t0)
+    return durations, result
+
+
+def summary(durations, **extra):
+    return dict(
+        n=len(durations),
+        median=statistics.median(durations),
+        min=min(durations),
+        max=max(durations),
+        stdev=statistics.stdev(durations) if len(durations) > 1 else 0.0,
+        **extra,
+    )
+
+
+def install_fake_solve_field(directory):
+    """
+    Puts a solve-field wrapper around fake_solve_field.py on the PATH.
+    """
+    wrapper = os.path.join(directory, "solve-field")
+    with open(wrapper, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(HERE, "fake_solve_field.py")}" "$@"\n')
+    os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = directory + os.pathsep + os.environ["PATH"]
+    os.environ["PYTHONPATH"] = HERE + os.pathsep + os.environ.get("PYTHONPATH", "")
+
+
+def bench_extraction(filename, repeat):
+    results = {}
+    data = fits.getdata(filename).astype(np.float32)
+    durations, stars = timeit(lambda: find_stars(data), repeat)
+    results["native"] = summary(durations, stars=len(stars))
+    if shutil.which("sex") or shutil.which("source-extractor"):
+        from chimera.util.sextractor import SExtractor
+
+        def run_sex():
+            sex = SExtractor()
+            sex.config["VERBOSE_TYPE"] = "QUIET"
+            sex.config["CATALOG_TYPE"] = "FITS_1.0"
+            sex.config["CATALOG_NAME"] = filename + ".sex.xyls"
+            sex.config["PARAMETERS_LIST"] = ["X_IMAGE", "Y_IMAGE", "MAG_ISO"]
+            sex.run(filename)
+
+        results["sex"] = summary(timeit(run_sex, repeat)[0])
+    return results
+
+
+def bench_solve(filename, repeat, methods):
+    try:
+        from chimera_pverify.util.astrometrynet import AstrometryNet
+    except ImportError as e:
+        return dict(skipped=f"solve_field not importable: {e}")
+    results = {}
+    for method in methods:
+        durations, wcs_filename = timeit(lambda: AstrometryNet.solve_field(filename, find_star_method=method), repeat)
+        results[method] = summary(durations)
+    return results
+
+
+def bench_wcs_center(filename, wcs_filename, repeat):
+    """
+    Times reading a solution and computing the image center from it, and
+    reports how far the center is from the true one.
+    """
+    image_header = fits.getheader(filename)
+    center = (image_header["NAXIS1"] / 2.0, image_header["NAXIS2"] / 2.0)
+
+    def compute():
+        with warnings.catch_warnings():
+            # solve-field writes the WCS in a header without data
+            warnings.simplefilter("ignore", FITSFixedWarning)
+            wcs = WCS(fits.getheader(wcs_filename))
+        return wcs.all_pix2world([center], 1)[0]
+
+    durations, (ra, dec) = timeit(compute, repeat)
+    error = np.hypot((ra - image_header["TRUE_RA"]) * np.cos(np.radians(dec)), dec - image_header["TRUE_DEC"]) * 3600.0
+    return summary(durations, error_arcsec=float(error))
+
+
+def bench_votable(rows, repeat):
+    table_rows = make_rows(rows)
+    results = {}
+    for name, data in (("tabledata", make_tabledata(table_rows)), ("binary", make_binary(table_rows))):
+        results[name] = summary(timeit(lambda: parse_table(io.BytesIO(data)), repeat)[0], rows=rows, bytes=len(data))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_runs(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def flatten(results, prefix=""):
+    """
+    Yields (name, median) of every timed benchmark in results.
+    """
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "median" in value:
+                yield prefix + key, value["median"]
+            else:
+                yield from flatten(value, prefix + key + "/")
+
+
+def compare(run, reference):
+    ref = dict(flatten(reference["results"]))
+    print(f"\nCompared with {reference['label']} ({reference['revision']}, {reference['date']}):")
+    for name, median in flatten(run["results"]):
+        if name in ref:
+            print(f"  {name:50s} {1000 * ref[name]:10.2f} ms -> {1000 * median:10.2f} ms  x{ref[name] / median:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048, 4096], help="image sizes in pixels")
+    parser.add_argument("--density", type=float, default=200.0, help="stars per million pixels")
+    parser.add_argument("--noise", type=float, default=20.0, help="sky noise in ADU")
+    parser.add_argument("--fwhm", type=float, default=3.0, help="PSF FWHM in pixels")
+    parser.add_argument("--psf", default="gaussian", choices=["gaussian", "moffat"])
+    parser.add_argument("--offset", type=float, nargs=2, default=[30.0, -20.0], help="pointing error (dra, ddec) in arcsec")
+    parser.add_argument("--methods", nargs="+", default=["native"], help="solve_field star finding methods")
+    parser.add_argument("--votable-rows", type=int, default=9999)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--label", default=None, help="name of this run, defaults to the git revision")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON lines file the runs are appended to")
+    parser.add_argument("--compare", default=None, help="label of a previous run, or 'last'")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pverify-bench-")
+    fake_solver = shutil.which("solve-field") is None
+    if fake_solver:
+        install_fake_solve_field(workdir)
+
+    results = {}
+    try:
+        for size in args.sizes:
+            filename = os.path.join(workdir, f"field{size:d}.fits")
+            write_star_field(
+                filename, width=size, height=size, density=args.density, noise=args.noise,
+                fwhm=args.fwhm, psf=args.psf, offset=tuple(args.offset),
+            )
+            # the stand-in solver only sees star lists, tell it where the field really is
+            header = fits.getheader(filename)
+            os.environ["PVERIFY_FAKE_SOLVE_CENTER"] = f"{header['TRUE_RA']},{header['TRUE_DEC']}"
+            r = results[f"{size:d}px"] = {}
+            r["source_extraction"] = bench_extraction(filename, args.repeat)
+            r["solve_field"] = bench_solve(filename, args.repeat, args.methods)
+            wcs_filename = os.path.join(workdir, f"field{size:d}-out.wcs")
+            if os.path.exists(wcs_filename):
+                r["wcs_center"] = bench_wcs_center(filename, wcs_filename, args.repeat)
+            print(f"{size:d}px: " + json.dumps(r))
+        results["votable"] = bench_votable(args.votable_rows, args.repeat)
+        print("votable: " + json.dumps(results["votable"]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    revision = git_revision()
+    run = dict(
+        label=args.label or revision,
+        revision=revision,
+        date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        host=socket.gethostname(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        fake_solve_field=fake_solver,
+        params=dict(vars(args), results=None, compare=None),
+        results=results,
+    )
+
+    previous = load_runs(args.results)
+    if args.compare is not None:
+        matches = previous if args.compare == "last" else [p for p in previous if p["label"] == args.compare]
+        if matches:
+            compare(run, matches[-1])
+        else:
+            print(f"No previous run {args.compare} in {args.results}")
+
+    if not args.no_save:
+        with open(args.results, "a") as f:
+            f.write(json.dumps(run) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Synthetic star-field FITS images for the benchmarks.
+
+make_star_field draws Gaussian (or Moffat) stars with a power-law flux
+distribution on a noisy sky, with a TAN WCS. CRVAL1/CRVAL2 in the header
+are offset from the true field center to simulate a pointing error, like
+the telescope-written headers solve_field gets.
+"""
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+
+def make_wcs(width, height, ra, dec, scale, rotation=0.0):
+    """
+    @param scale: plate scale in arcsec/pixel
+    @param rotation: position angle in degrees
+    """
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.wcs.crval = [ra, dec]
+    wcs.wcs.crpix = [width / 2.0, height / 2.0]
+    theta = np.radians(rotation)
+    s = scale / 3600.0
+    wcs.wcs.cd = [[-s * np.cos(theta), s * np.sin(theta)], [s * np.sin(theta), s * np.cos(theta)]]
+    return wcs
+
+
+def make_star_field(
+    width=2048,
+    height=2048,
+    density=200.0,
+    sky=1000.0,
+    noise=20.0,
+    fwhm=3.0,
+    psf="gaussian",
+    ra=150.0,
+    dec=-30.0,
+    scale=1.0,
+    rotation=0.0,
+    offset=(30.0, -20.0),
+    seed=0,
+):
+    """
+    @param density: stars per million pixels
+    @param fwhm: PSF full width at half maximum in pixels
+    @param psf: gaussian or moffat
+    @param offset: pointing error (dra, ddec) in arcsec written to CRVAL1/CRVAL2
+
+    Returns (data, header, stars) where stars is a structured array with the
+    true X, Y (FITS 1-based) and FLUX of each star, brightest first.
+    """
+    rng = np.random.default_rng(seed)
+    n_stars = max(int(density * width * height / 1e6), 1)
+
+    x = rng.uniform(10, width - 10, n_stars)
+    y = rng.uniform(10, height - 10, n_stars)
+    # power law flux distribution, many faint stars and a few bright ones
+    flux = 200.0 * noise * fwhm**2 * (1.0 - rng.random(n_stars)) ** (-1.0 / 1.5)
+
+    data = rng.normal(sky, noise, (height, width)).astype(np.float32)
+    sigma = fwhm / 2.3548
+    half = int(np.ceil(5 * fwhm))
+    yy, xx = np.mgrid[-half : half + 1, -half : half + 1]
+    for xi, yi, fi in zip(x, y, flux):
+        ix, iy = int(round(xi)), int(round(yi))
+        dx, dy = xx + ix - xi, yy + iy - yi
+        r2 = dx**2 + dy**2
+        if psf == "moffat":
+            beta = 2.5
+            alpha = fwhm / (2.0 * np.sqrt(2 ** (1.0 / beta) - 1.0))
+            stamp = (beta - 1) / (np.pi * alpha**2) * (1 + r2 / alpha**2) ** -beta
+        else:
+            stamp = np.exp(-r2 / (2 * sigma**2)) / (2 * np.pi * sigma**2)
+        y0, y1 = max(iy - half, 0), min(iy + half + 1, height)
+        x0, x1 = max(ix - half, 0), min(ix + half + 1, width)
+        data[y0:y1, x0:x1] += (fi * stamp)[y0 - (iy - half) : y1 - (iy - half), x0 - (ix - half) : x1 - (ix - half)]
+
+    wcs = make_wcs(width, height, ra, dec, scale, rotation)
+    header = wcs.to_header()
+    # the telescope thinks it is pointing somewhere else
+    header["CRVAL1"] = ra + offset[0] / 3600.0 / np.cos(np.radians(dec))
+    header["CRVAL2"] = dec + offset[1] / 3600.0
+    header["TRUE_RA"] = (ra, "true field center")
+    header["TRUE_DEC"] = (dec, "true field center")
+    header["DATE-OBS"] = "2025-12-08T03:00:00.000"
+    header["EXPTIME"] = 1.0
+
+    stars = np.zeros(n_stars, dtype=[("X", "f8"), ("Y", "f8"), ("FLUX", "f8")])
+    stars["X"], stars["Y"], stars["FLUX"] = x + 1.0, y + 1.0, flux
+    stars = stars[np.argsort(flux)[::-1]]
+    return data, header, stars
+
+
+def write_star_field(filename, **kwargs):
+    """
+    Writes a synthetic star field to filename and returns its true star list.
+    """
+    data, header, stars = make_star_field(**kwargs)
+    fits.PrimaryHDU(data, header=header).writeto(filename, overwrite=True)
+    return stars
@@ -1,65 +1,155 @@
+import argparse
 import datetime
-from chimera_pverify.util.astrometrynet import AstrometryNet, NoSolutionAstrometryNetException
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+
 from astropy.io import fits
-from chimera.util.position import Position, Coord
 from chimera.core.site import Site
 
+from chimera_pverify.util.astrometrynet import AstrometryNet, NoSolutionAstrometryNetException
+from chimera_pverify.util.framemanifest import FrameManifest
+from chimera_pverify.util.pointingmodel import DEFAULT_TERMS, PointingData, fit_model
+from chimera_pverify.util.solutioncache import SolutionCache
+from chimera_pverify.util.transfer import scratch_directory
+from chimera_pverify.util.workspace import SolveWorkspace
+
 data_folder = "/Users/william/Downloads/swope_data/20251208/"
-output_fname = "pmodel_astrometry_results.csv"
-
-data_path = Path(data_folder)
-fits_files = list(data_path.glob("*.fits")) + list(data_path.glob("*.fit"))
-
-site = Site()
-site["name"] = "Swope"
-site["latitude"] = "-29:00:43"
-site["longitude"] = "-70:42:01"
-site["altitude"] = 2187
-
-pmhelper_files = []
-for fits_file in fits_files:
-    with fits.open(fits_file) as hdul:
-        header = hdul[0].header
-        if "OBJECT" in header and header["OBJECT"] is not None and header["OBJECT"].endswith("_pmhelper"):
-            pmhelper_files.append(fits_file)
-pmhelper_files.sort()
-
-print(f"Found {len(pmhelper_files)} files with '_pmhelper' in OBJECT keyword")
-
-fout = open(output_fname, "w")
-fout.write("Star RA,Star Dec,Scope RA,Scope Dec,LST,Date_Obs,Filename\n")
-for f in pmhelper_files:
-    print(f"Solving astrometry for file: {f}")
+output_fname = "pmodel_astrometry_results.npz"
+manifest_fname = "pmodel_manifest.json"
+
+# per-worker scratch directory and solution cache, set by _init_worker
+_scratch_dir = None
+_cache = None
+
+
+def _init_worker(scratch_root, cache_dir=None):
+    global _scratch_dir, _cache
+    _scratch_dir = tempfile.mkdtemp(prefix=f"worker-{os.getpid()}-", dir=scratch_root)
+    if cache_dir is not None:
+        _cache = SolutionCache(cache_dir)
+
+
+def solve_frame(f, scope_ra, scope_dec, find_star_method="sex"):
+    """
+    Solves a single frame in a workspace inside this worker's scratch directory.
+    Returns (status, values) where status is "ok", "nosolution" or "error".
+    Never raises, so one bad frame does not stop the batch.
+    """
     try:
-        # initial image
-        h = fits.getheader(f)
-        ra_img_center = h["CRVAL1"]  # expects to see this in image
-        dec_img_center = h["CRVAL2"]
-        initial_image_center = Position.from_ra_dec(Coord.from_d(ra_img_center), Coord.from_d(dec_img_center))
-        date_obs = datetime.datetime.strptime(h["DATE-OBS"], "%Y-%m-%dT%H:%M:%S.%f")
-        lst = site.lst(date_obs)
-        print(f"Site {site['latitude']}, {site['longitude']}, LST: {lst}")
-        st = h["ST"]  # in seconds
-
-        # solved image
-        wcs_name = AstrometryNet.solve_field(str(f), find_star_method="sex")
-        h = fits.getheader(wcs_name)
-        ra_img_center = h["CRVAL1"]  # expects to see this in image
-        dec_img_center = h["CRVAL2"]
-        solved_image_center = Position.from_ra_dec(Coord.from_d(ra_img_center), Coord.from_d(dec_img_center))
-        print(f"Pointing model: {initial_image_center}, Solved center: {solved_image_center}")
-        fout.write(
-            f"{str(solved_image_center).replace(' ', ',')},{str(initial_image_center).replace(' ', ',')},{lst},{date_obs},{f}\n"
+        # solve a link to the frame inside a private workspace, the outputs
+        # of workers solving frames with the same name never meet
+        with SolveWorkspace(_scratch_dir) as workspace:
+            ext = ".fits"  # solve_field only accepts .fits
+            link = workspace.path(Path(f).stem + ext)
+            os.symlink(os.path.abspath(f), link)
+            wcs_name = AstrometryNet.solve_field(
+                link, find_star_method=find_star_method, cache=_cache, workspace=workspace
+            )
+            h = fits.getheader(wcs_name)
+
+        return "ok", dict(
+            scope_ra=scope_ra,
+            scope_dec=scope_dec,
+            star_ra=h["CRVAL1"],
+            star_dec=h["CRVAL2"],
         )
-        print(f"st: {lst}, {Coord.from_h(st/3600).to_hms()}")
-        fout.flush()
-        print(f"Successfully solved astrometry for {f}")
     except NoSolutionAstrometryNetException:
-        print(f"No solution found for {f}")
-        fout.write(f"# {f}: No solution found\n")
+        return "nosolution", None
     except Exception as e:
-        print(f"Error solving astrometry for {f}: {e}")
-    # break  # --- REMOVE THIS LINE TO PROCESS ALL FILES ---
+        return "error", f"{type(e).__name__}: {e}"
+
+
+def lst_degrees(site, date_obs):
+    date_obs = datetime.datetime.strptime(date_obs, "%Y-%m-%dT%H:%M:%S.%f")
+    return site.lst(date_obs).deg
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solves _pmhelper frames for pointing model data")
+    parser.add_argument("data_folder", nargs="?", default=data_folder)
+    parser.add_argument("-o", "--output", default=output_fname, help="Results of the solved frames (.npz)")
+    parser.add_argument("--manifest", default=None, help=f"Frame manifest, default {manifest_fname} in data_folder")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of parallel solves")
+    parser.add_argument("--method", default="sex", choices=["sex", "astrometry.net", "native"], help="Star finder method")
+    parser.add_argument("--scratch", default=None, help="Directory for per-worker scratch directories, tmpfs by default")
+    parser.add_argument("--cache", default=None, help="Plate solution cache directory")
+    parser.add_argument("--no-retry", action="store_true", help="Do not retry frames that failed in earlier runs")
+    parser.add_argument(
+        "--fit", nargs="*", default=None, metavar="TERM",
+        help=f"Fit a pointing model to the results, default terms {' '.join(DEFAULT_TERMS)}",
+    )
+    args = parser.parse_args()
+
+    site = Site()
+    site["name"] = "Swope"
+    site["latitude"] = "-29:00:43"
+    site["longitude"] = "-70:42:01"
+    site["altitude"] = 2187
+
+    data_path = Path(args.data_folder)
+    manifest = FrameManifest(args.manifest or str(data_path / manifest_fname))
+    t0 = time.time()
+    fits_files = list(data_path.glob("*.fits")) + list(data_path.glob("*.fit"))
+    n_scanned = manifest.scan(fits_files, max_workers=args.workers * 2)
+    manifest.save()
+    pmhelper_files = manifest.select(retry_failed=not args.no_retry)
+    n_files = len(pmhelper_files)
+    print(
+        f"Scanned {n_scanned} new or modified of {len(fits_files)} files in {time.time() - t0:.1f} s, "
+        f"{n_files} '_pmhelper' frames to solve"
+    )
+
+    scratch_root = tempfile.mkdtemp(prefix="pmodel-", dir=args.scratch or scratch_directory())
+    n_done = n_failed = 0
+    t0 = time.time()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=_init_worker, initargs=(scratch_root, args.cache)
+        ) as pool:
+            futures = {
+                pool.submit(solve_frame, f, manifest.frames[f]["CRVAL1"], manifest.frames[f]["CRVAL2"], args.method): f
+                for f in pmhelper_files
+            }
+            for future in as_completed(futures):
+                f = futures[future]
+                status, values = future.result()
+                if status == "ok":
+                    values["lst"] = lst_degrees(site, manifest.frames[f]["DATE-OBS"])
+                    manifest.set_result(f, status, values)
+                    print(f"Successfully solved astrometry for {f}")
+                elif status == "nosolution":
+                    n_failed += 1
+                    manifest.set_result(f, status)
+                    print(f"No solution found for {f}")
+                else:
+                    n_failed += 1
+                    manifest.set_result(f, status, error=values)
+                    print(f"Error solving astrometry for {f}: {values}")
+
+                n_done += 1
+                # keep the manifest current, an interrupted run resumes from here
+                if n_done % 10 == 0:
+                    manifest.save()
+                elapsed = time.time() - t0
+                rate = 60.0 * n_done / elapsed if elapsed > 0 else 0.0
+                print(f"[{n_done}/{n_files}] {n_failed} failed, {rate:.1f} frames/min")
+    finally:
+        manifest.save()
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+    elapsed = time.time() - t0
+    print(f"Solved {n_done - n_failed}/{n_files} frames in {elapsed:.1f} s ({60.0 * n_done / max(elapsed, 1e-9):.1f} frames/min)")
+    n_solved = manifest.save_results(args.output)
+    print(f"Wrote {n_solved} solved frames to {args.output}")
+
+    if args.fit is not None and n_solved:
+        data = PointingData.from_pmodel_npz(args.output, str(site["latitude"]))
+        print(fit_model(data, args.fit or DEFAULT_TERMS).summary())
+
 
-fout.close()
+if __name__ == "__main__":
+    main()
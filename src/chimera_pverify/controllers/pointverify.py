@@ -1,12 +1,31 @@
 import os
 import time
-from math import fabs
+from concurrent.futures import Future, ThreadPoolExecutor
+from math import cos, fabs, hypot, radians
+
+import numpy as np
 
 from chimera.core.chimeraobject import ChimeraObject
 from chimera.core.exceptions import CantPointScopeException, ChimeraException
 from chimera.interfaces.camera import Shutter
 from chimera.interfaces.pointverify import PointVerify
-from util.astrometrynet import AstrometryNet, NoSolutionAstrometryNetException
+from chimera_pverify.util.astrometrynet import AstrometryNet, NoSolutionAstrometryNetException
+from chimera_pverify.util.exposure import ExposureCalibration, binning_from_request, galactic_band
+from chimera_pverify.util.catalogs.landolt import Landolt
+from chimera_pverify.util.fieldselect import SIDEREAL_RATE, field_star_counts, select_fields
+from chimera_pverify.util.imagecontext import ImageContext
+from chimera_pverify.util.jobs import JobCancelledException, JobQueue
+from chimera_pverify.util.platescale import PlateScaleCalibration, header_binning, plate_scale, scale_from_header
+from chimera_pverify.util.pmodelplan import plan_run
+from chimera_pverify.util.pointingmodel import DEFAULT_TERMS, PointingData, fit_model
+from chimera_pverify.util.querycache import QueryCache
+from chimera_pverify.util.solutioncache import SolutionCache
+from chimera_pverify.util.solverpool import shared_pool
+from chimera_pverify.util.starmatch import bright_stars, match_stars, relative_solution
+from chimera_pverify.util.subframe import PixelMap, relative_transform, retry_window, window_string
+from chimera_pverify.util.timing import NullTimer, TimingRecorder, VerificationTimer
+from chimera_pverify.util.transfer import fetch_image
+from chimera_pverify.util.vizquery import VizQuery
 from chimera.util.coord import Coord
 from chimera.util.image import ImageUtil, Image
 from chimera.util.position import Position
@@ -20,6 +39,43 @@ class PointVerify(ChimeraObject, PointVerify):
        - choose a field (from a list of certified fields) and try verification
     """
 
+    __config__ = dict(
+        solver_address=None,  # SolverServer socket path or host:port. None runs solve-field each time.
+        find_star_method="sex",  # sex, astrometry.net, native (in-process, no SExtractor needed) or race (sex and astrometry.net in parallel)
+        solve_timeout=120.0,  # Wall-clock seconds before a solve is killed. None waits forever.
+        solve_cpu_limit=None,  # CPU seconds a solve may use.
+        solution_cache_dir=None,  # Directory to cache plate solutions of identical frames. None disables it.
+        plate_scale_file="~/.chimera/pverify_platescale.json",  # Plate scales learned from solves. None disables it.
+        scale_tolerance=0.05,  # Relative width of the plate scale search band.
+        vizier_cache_dir=None,  # Directory to cache Vizier catalog queries. None disables it.
+        settle_timeout=30.0,  # Maximum seconds to wait for the mount to stop after an offset.
+        stream_transfer=False,  # Stream images from remote cameras to memory instead of downloading them to images_dir. Streamed frames are not kept.
+        scratch_dir=None,  # Where streamed images are written for solve-field. None uses tmpfs when available.
+        timing_jsonl=None,  # Append per-phase timings of each verification to this JSON lines file.
+        timing_prometheus=None,  # Write phase timing metrics in Prometheus text format to this file.
+        solver_workers=None,  # Solves at a time on the pool shared by all PointVerify instances of this process. None solves inline.
+        solver_priority=0,  # Priority of this telescope's solves on the shared pool, lower runs first.
+        relative_verify=True,  # After the first trial, match stars with the previous frame instead of a full solve.
+        subframe_retries=True,  # Read retries out binned and windowed around the detector center, sized from the pointing error.
+        retry_binning=2,  # Binning of the retry frames.
+        subframe_margin=3.0,  # Half-size of the retry window in units of the pointing error.
+        subframe_min_size=512,  # Smallest side of the retry window in unbinned pixels.
+        adaptive_exptime=True,  # Learn the exposure time from the star counts of previous frames instead of always using exptime.
+        min_exptime=0.5,  # Shortest adaptive exposure time in seconds.
+        max_exptime=60.0,  # Longest adaptive exposure time in seconds.
+        min_stars=15,  # Stars a frame needs to be solved, until solves tell otherwise.
+        exptime_file="~/.chimera/pverify_exptime.json",  # Star count rates learned per filter, binning and sky region.
+        min_altitude=30.0,  # Lowest altitude (degrees) of a standard field for check_pointing.
+        min_time_up=0.5,  # Hours a standard field must stay above min_altitude.
+        slew_rate=2.0,  # Mount slew rate in degrees per second, used to rank fields by slew time.
+        field_radius=0.2,  # Radius (degrees) in which catalog stars are counted as one field.
+        pmodel_points=40,  # Number of points of a pointing model run.
+        pmodel_grid="equal_area",  # equal_area (Fibonacci spiral) or altaz (rings of constant altitude).
+        pmodel_max_altitude=85.0,  # Highest altitude (degrees) of a pointing model point.
+        pmodel_workers=2,  # Frames of a pointing model run solved at the same time while the mount slews.
+        pmodel_dir="~/.chimera/pmodel",  # Where the results of pointing model runs are written.
+    )
+
     # normal constructor
     # initialize the relevant variables
     def __init__(self):
@@ -28,6 +84,21 @@ class PointVerify(ChimeraObject, PointVerify):
         self.nfields = 0  # number of fields we try to center on
         self.checkedpointing = False  # True = Standard field is verified
         self.current_field = 0  # counts fields tried to verify
+        self._solution_cache = None
+        self._plate_scale_calibration = None
+        self._exposure_calibration = None
+        self._background = ThreadPoolExecutor(max_workers=2)
+        self.last_verify_time = None  # seconds the last successful point_verify took to converge
+        self._timings = None
+        self._jobs = JobQueue(name="point_verify")
+
+    def __start__(self):
+        if self["vizier_cache_dir"] is not None:
+            VizQuery.set_cache(QueryCache(self["vizier_cache_dir"]))
+
+    def __stop__(self):
+        self._jobs.shutdown()
+        self._background.shutdown(wait=False)
 
     def get_tel(self):
         return self.get_proxy(self["telescope"])
@@ -41,28 +112,127 @@ class PointVerify(ChimeraObject, PointVerify):
     def get_site(self):
         return self.get_proxy("/Site/0")
 
+    def get_solution_cache(self):
+        if self["solution_cache_dir"] is None:
+            return None
+        if self._solution_cache is None:
+            self._solution_cache = SolutionCache(self["solution_cache_dir"])
+        return self._solution_cache
+
+    def get_plate_scale_calibration(self):
+        if self["plate_scale_file"] is None:
+            return None
+        if self._plate_scale_calibration is None:
+            self._plate_scale_calibration = PlateScaleCalibration(self["plate_scale_file"])
+        return self._plate_scale_calibration
+
+    def get_exposure_calibration(self):
+        if self._exposure_calibration is None:
+            self._exposure_calibration = ExposureCalibration(
+                self["exptime_file"], min_stars=self["min_stars"], min_exptime=self["min_exptime"],
+                max_exptime=self["max_exptime"],
+            )
+        return self._exposure_calibration
+
+    def _exposure_setup(self, tel, image_request):
+        """
+        Returns (filter, binning, galactic latitude band) of the next frame,
+        the band is None if the telescope position is not known.
+        """
+        try:
+            position = tel.get_position_ra_dec()
+            band = galactic_band(position.ra.deg, position.dec.deg)
+        except Exception as e:
+            self.log.debug(f"Can't get the galactic latitude of the telescope position: {e}")
+            band = None
+        return image_request.get("filter", self["filter"]), binning_from_request(image_request), band
+
+    @staticmethod
+    def _binning(image):
+        return image.pixel_map.binning if image.pixel_map is not None else header_binning(image)
+
+    def _plate_scale(self, image):
+        """
+        Returns the expected plate scale of image in arcsec/pixel, from the
+        calibration of previous solves or from the camera optics.
+        """
+        binning = self._binning(image)
+        calibration = self.get_plate_scale_calibration()
+        if calibration is not None:
+            if calibration.get(self["camera"], binning) is not None:
+                return calibration.get(self["camera"], binning)
+            if calibration.get(self["camera"], 1) is not None:
+                return calibration.get(self["camera"], 1) * binning
+        try:
+            cam = self.get_cam()
+            pixel_size = cam.get_pixel_size()[0]
+            return plate_scale(cam["telescope_focal_length"], pixel_size, binning)
+        except Exception as e:
+            self.log.debug(f"Could not compute plate scale from camera: {e}")
+            return None
+
+    def get_timing_recorder(self):
+        if self._timings is None:
+            self._timings = TimingRecorder(
+                jsonl_filename=self["timing_jsonl"],
+                prometheus_filename=self["timing_prometheus"],
+                labels=dict(telescope=self["telescope"]),
+            )
+        return self._timings
+
+    def get_timings(self, n=None):
+        """
+        Returns the per-phase timings of the last n verifications (all kept if
+        n is None) as a list of dicts with the verification duration, success
+        and the spans of each trial.
+        """
+        return self.get_timing_recorder().last(n)
+
     def get_rotator(self):
         if self["rotator"] is not None:
             return self.get_proxy(self["rotator"])
         else:
             return None
 
-    def _take_image(self, image_request):
+    def _set_filter(self, timer=None):
+        if self["filterwheel"] is not None:
+            fw = self.get_filter_wheel()
+            with (timer or NullTimer()).span("filter_change"):
+                fw.set_filter(self["filter"])
+
+    def _take_image(self, image_request, timer=None, exptime=None):
+        """
+        Takes an image and returns it as an ImageContext, so its header is
+        parsed and its pixels read only once along the trial. exptime
+        overrides the exptime config, an exptime in image_request both.
+        """
+        timer = timer or NullTimer()
 
         cam = self.get_cam()
         if cam["telescope_focal_length"] is None:
             raise ChimeraException("telescope_focal_length parameter must be set on camera instrument configuration")
-        if self["filterwheel"] is not None:
-            fw = self.get_filter_wheel()
-            fw.set_filter(self["filter"])
 
-        request = dict(exptime=self["exptime"], frames=1, shutter=Shutter.OPEN,
+        request = dict(exptime=self["exptime"] if exptime is None else exptime, frames=1, shutter=Shutter.OPEN,
                        filename=os.path.basename(ImageUtil.make_filename("pointverify-$DATE")))
         request.update(image_request)
+        t0 = time.time()
         frames = cam.expose(**request)
+        # expose blocks until readout is done, split it at the exposure time
+        exposure = min(request["exptime"], time.time() - t0)
+        timer.add("exposure", t0, exposure)
+        timer.add("readout", t0 + exposure, time.time() - t0 - exposure)
 
         if frames:
             image = Image.from_url(frames[0])
+            if not os.path.exists(image.filename) and self["stream_transfer"]:
+                # If image is on a remote server, stream it to memory.
+                with timer.span("download", mode="stream"):
+                    transfer = fetch_image(image.http(), filename=os.path.basename(image.filename))
+                self.log.debug(
+                    f"Transferred {image.filename} in {transfer.elapsed:3.2f} seconds ({transfer.throughput:.1f} MB/s)"
+                )
+                # kept in memory, written to scratch_dir only if the solver needs a file
+                return ImageContext.from_transfer(transfer)
             if not os.path.exists(image.filename):  # If image is on a remote server, donwload it.
 
                 # #  If remote is windows, image_path will be c:\...\image.fits, so use ntpath instead of os.path.
@@ -73,40 +243,38 @@ class PointVerify(ChimeraObject, PointVerify):
                 # image_path = ImageUtil.make_filename(os.path.join(self["images_dir"], "$LAST_NOON_DATE", modpath.basename(image_path)))
                 t0 = time.time()
                 self.log.debug(f'Downloading image from server to {image.filename}')
-                if not image.download():
-                    raise ChimeraException(f'Error downloading image {image.filename} from {image.http()}')
+                with timer.span("download", mode="file"):
+                    if not image.download():
+                        raise ChimeraException(f'Error downloading image {image.filename} from {image.http()}')
                 self.log.debug(f'Finished download. Took {time.time() - t0:3.2f} seconds')
-            return image.filename, image
+            return ImageContext.from_file(image.filename)
         else:
             raise Exception("Could not take an image")
 
-    def point_verify(self, image_request={}):
+    def _solve(self, image, timer=None, priority=None):
         """
-        Checks telescope pointing.
-        If abs ( telescope coordinates - image coordinates ) > tolerance
-           move the scope
-           take a new image
-           test again
-           do this while ntrials < max_tries
+        Solves image (an ImageContext) and returns its WCSSolution.
 
-        Returns True if centering was succesful
-                False if not
+        With solver_workers set, the solve waits for its turn on the pool
+        shared with the other telescopes, at priority (solver_priority by
+        default).
         """
+        if self["solver_workers"] is None:
+            return self._solve_inline(image, timer)
+        priority = self["solver_priority"] if priority is None else priority
+        pool = shared_pool(self["solver_workers"])
+        return pool.submit(self["telescope"], self._solve_inline, image, timer, priority=priority).result()
 
-        # take an image and read its coordinates off the header
-
-        try:
-            image_path, image = self._take_image(image_request)
-            self.log.debug(f"Taking image: image name {image_path}")
-        except:
-            self.log.error("Can't take image")
-            raise
-
-        tel = self.get_tel()
+    def _solve_inline(self, image, timer=None):
         # analyze the previous image using
         # AstrometryNet defined in util
         try:
-            wcs_name = AstrometryNet.solve_field(image_path, find_star_method="sex")
+            AstrometryNet.solve_field(
+                image.path(self["scratch_dir"]), find_star_method=self["find_star_method"],
+                server=self["solver_address"], cache=self.get_solution_cache(), scale=self._plate_scale(image),
+                scale_tolerance=self["scale_tolerance"], timeout=self["solve_timeout"],
+                cpu_limit=self["solve_cpu_limit"], timer=timer, context=image,
+            )
         except NoSolutionAstrometryNetException as e:
             raise e
             # why can't I select this exception?
@@ -136,56 +304,324 @@ class PointVerify(ChimeraObject, PointVerify):
             # else:
             #    self.checkedpointing = False
             #    raise CanSetScopeButNotThisField(f"Able to set scope, but unable to verify this field {currentImageCenter}")
-        wcs_image = Image.from_file(wcs_name)
-        ra_wcs_center, dec_wcs_center = wcs_image.world_at((image["NAXIS1"] / 2., image["NAXIS2"] / 2.))
-        rotation = wcs_image.get_rotation()
-        self.log.debug(f"WCS rotation: {rotation:f} degrees")
-        current_wcs = Position.from_ra_dec(Coord.from_d(ra_wcs_center), Coord.from_d(dec_wcs_center))
-
-        # save the position of first trial:
-        if self.ntrials == 0:
-            ra_img_center = image["CRVAL1"]  # expects to see this in image
-            dec_img_center = image["CRVAL2"]
-            current_image_center = Position.from_ra_dec(Coord.from_d(ra_img_center),
-                                                    Coord.from_d(dec_img_center))
-            self._original_center = current_image_center
-            self._original_ra = ra_img_center
-            self._original_dec = dec_img_center
-            self.log.debug(f"Setting ra, dec for {ra_img_center}, {dec_img_center}")
-
-            initial_position = Position.from_ra_dec(
-                Coord.from_d(ra_img_center), Coord.from_d(dec_img_center))
-        else:
-            current_image_center = self._original_center
-            ra_img_center = self._original_ra
-            dec_img_center = self._original_dec
-            self.log.debug("Using previous ra, dec.")
-
-        # write down the two positions for later use in mount models
-        if self.ntrials == 0:
-            site = self.get_site()
-            logstr = f"Pointing Info for Mount Model: {site.lst()} {site.mjd()} {image['DATE-OBS']} {initial_position} {current_wcs}"
-            self.log.info(logstr)
-
-        delta_ra = ra_img_center - ra_wcs_center
-        delta_dec = dec_img_center - dec_wcs_center
+        return image.solution
 
-        # *** need to do real logging here
-        logstr = f"{image['DATE-OBS']} ra_tel = {ra_img_center} dec_tel = {dec_img_center} ra_img = {ra_wcs_center} dec_img = {dec_wcs_center} delta_ra = {delta_ra} delta_dec = {delta_dec}"
-        self.log.debug(logstr)
+    def _match_reference(self, reference, image, rotated=0.0, timer=None, stars=None):
+        """
+        Solves image relative to reference, a previous solved frame of the
+        same field given as (bright stars future, WCSSolution, PixelMap), by
+        matching their stars. The frames may have different readouts, stars
+        are matched in unbinned detector pixels. rotated is how much the
+        rotator moved in between. stars are the bright stars of image, if
+        already found.
+        Returns the WCSSolution, None if the stars could not be matched.
+        """
+        reference_stars, reference_solution, reference_map = reference
+        with (timer or NullTimer()).span("star_match"):
+            try:
+                rotations = (0.0, rotated, -rotated) if rotated else (0.0,)
+                if stars is None:
+                    stars = bright_stars(image.data)
+                match = match_stars(
+                    reference_map.to_physical(reference_stars.result()), image.pixel_map.to_physical(stars),
+                    rotations=rotations,
+                )
+            except Exception as e:
+                self.log.debug(f"Star matching failed: {e}")
+                return None
+            if match is None:
+                return None
+            a, t, nmatch, rms = match
+            self.log.debug(f"Matched {nmatch} stars with the previous frame, rms {rms:.2f} pixels")
+            a, t = relative_transform(a, t, reference_map, image.pixel_map)
+            image.solution = relative_solution(reference_solution, a, t)
+        return image.solution
+
+    def _record_solution(self, image, wcs_image):
+        """
+        Bookkeeping of a solved frame that the next trial does not depend on.
+        Runs in the background while the next frame is taken.
+        """
+        calibration = self.get_plate_scale_calibration()
+        measured_scale = scale_from_header(wcs_image)
+        if calibration is not None and measured_scale is not None:
+            calibration.update(self["camera"], self._binning(image), measured_scale)
 
-        if (fabs(delta_ra) > self["ra_tolerance"]) or (fabs(delta_dec) > self["dec_tolerance"]):
-            self.log.debug("Telescope not there yet. Trying again")
-            self.ntrials += 1
-            if self.ntrials > self["max_tries"]:
-                self.ntrials = 0
-                raise CantPointScopeException(
-                    f"Scope does not point with a precision of {self['ra_tolerance']} (RA) or {self['dec_tolerance']} (DEC) after {self['max_tries']:d} trials\n")
+    def _retry_readout(self, detector, wcs_image, image, error_x, error_y):
+        """
+        Returns (image request options, window origin) of a retry: binned
+        by retry_binning and windowed around the detector center to still
+        contain the target when off by subframe_margin times the current
+        error (degrees on the sky).
+        """
+        binning = self["retry_binning"]
+        request = dict(binning=f"{binning:d}x{binning:d}")
+        scale = scale_from_header(wcs_image)
+        if scale is None:
+            return request, (0, 0)
+        window = retry_window(
+            detector, hypot(error_x, error_y), scale / image.pixel_map.binning, binning,
+            self["subframe_margin"], self["subframe_min_size"],
+        )
+        if window is None:
+            return request, (0, 0)
+        request["window"] = window_string(*window)
+        self.log.debug(f"Retry readout {request['binning']} window {request['window']}")
+        return request, window[:2]
+
+    def _count_trial(self):
+        self.ntrials += 1
+        if self.ntrials > self["max_tries"]:
+            raise CantPointScopeException(
+                f"Scope does not point with a precision of {self['ra_tolerance']} (RA) or {self['dec_tolerance']} (DEC) after {self['max_tries']:d} trials\n")
+
+    def _offset(self, tel, delta_ra, delta_dec, rotation, timer=None):
+        """
+        Moves the mount and the rotator at the same time and returns as soon
+        as the mount reports it is not moving anymore.
+        """
+        timer = timer or NullTimer()
+        rotator_move = None
+        if self["rotator"] is not None:
+            self.log.info(f"Field rotation is {rotation:f} degrees, moving rotator.")
+            rotator_move = self._background.submit(self._move_rotator, -rotation, timer)
+        with timer.span("mount_offset"):
             tel.move_offset(Coord.from_d(delta_ra).arcsec, Coord.from_d(delta_dec).arcsec)
-            self.point_verify()
-        else:
-            # if we got here, we were succesfull, reset trials counter
-            self.ntrials = 0
+
+            t0 = time.time()
+            while tel.is_slewing() and time.time() - t0 < self["settle_timeout"]:
+                time.sleep(0.1)
+        if rotator_move is not None:
+            rotator_move.result()
+
+    def _move_rotator(self, angle, timer=None):
+        with (timer or NullTimer()).span("rotator_move"):
+            self.get_rotator().move_by(angle)
+
+    def point_verify(self, image_request={}, priority=None):
+        """
+        Checks telescope pointing and blocks until done, see _point_verify.
+        Runs in the same queue as point_verify_async, so it waits for
+        verifications already in flight.
+        """
+        return self._jobs.submit("point_verify", self._point_verify, image_request, priority).wait()
+
+    def point_verify_async(self, image_request={}, priority=None):
+        """
+        Queues a pointing verification and returns its job ID right away.
+        Verifications run one at a time, in the order they were queued.
+
+        Follow the job with get_job_status and get_job_events, stop it with
+        cancel_job or block on it with wait_job. priority overrides
+        solver_priority for the solves of this verification.
+        """
+        return self._jobs.submit("point_verify", self._point_verify, image_request, priority).id
+
+    def get_job_status(self, job_id):
+        """
+        Returns a dict with the state (queued, running, done, failed or
+        cancelled), result, error and last progress event of a job.
+        """
+        return self._jobs.get(job_id).status()
+
+    def get_job_events(self, job_id, since=0):
+        """
+        Returns the progress events of a job from index since on, as dicts
+        with index, time, kind (trial, image, escalate, solved, offset, and
+        field or point for check_pointing and acquire_pointing_model) and
+        its data.
+        """
+        return self._jobs.get(job_id).get_events(since)
+
+    def cancel_job(self, job_id):
+        """
+        Cancels a queued job, or stops a running one before its next step.
+        Returns False if the job already finished.
+        """
+        return self._jobs.get(job_id).cancel()
+
+    def wait_job(self, job_id, timeout=None):
+        """
+        Waits for a job and returns its result. Raises the error of a failed
+        or cancelled job, TimeoutError if it is still running after timeout
+        seconds.
+        """
+        return self._jobs.get(job_id).wait(timeout)
+
+    def _point_verify(self, job=None, image_request={}, priority=None):
+        """
+        Checks telescope pointing.
+        If abs ( telescope coordinates - image coordinates ) > tolerance
+           move the scope
+           take a new image
+           test again
+           do this while ntrials < max_tries
+
+        Bookkeeping of each trial runs in the background while the mount
+        moves and the next frame is taken. The time spent in each phase is
+        recorded, see get_timings. With relative_verify, trials after the
+        first are solved by matching their stars with the previous frame,
+        and only fall back to a full solve when that fails. With
+        adaptive_exptime, the exposure time is chosen from the star counts
+        of previous frames, and a frame with too few stars to solve is
+        taken again with a longer exposure.
+
+        With job (a jobs.Job), progress events are recorded along the way
+        and a cancelled job stops before the next exposure or offset.
+
+        Returns True if centering was succesful
+                False if not
+        """
+
+        progress = job.progress if job is not None else (lambda kind, **data: None)
+        t_start = time.time()
+        timer = VerificationTimer()
+        success = False
+        tel = self.get_tel()
+        self.ntrials = 0
+        bookkeeping = []
+        reference = None  # previous solved frame, to match the next one against
+        rotated = 0.0
+        current_image_center = None
+        image = None
+
+        # readout of the retries, set once the pointing error is known
+        subframe = self["subframe_retries"] and "window" not in image_request and "binning" not in image_request
+        retry = None
+        detector = None
+
+        adaptive = self["adaptive_exptime"] and "exptime" not in image_request
+        exptime = None
+        if adaptive:
+            calibration = self.get_exposure_calibration()
+            setup = (self["camera"],) + self._exposure_setup(tel, image_request)
+            exptime = calibration.choose(*setup, default=self["exptime"])
+            needed = calibration.needed(*setup[:3])
+            self.log.debug(f"Exposure time {exptime:.1f} s, expecting at least {needed:d} stars")
+
+        try:
+            self._set_filter(timer)
+            while True:
+                if image is not None:
+                    # scratch files of the previous trial
+                    image.cleanup()
+                timer.new_trial()
+                progress("trial", trial=self.ntrials + 1)
+                # take an image and read its coordinates off the header
+                try:
+                    image = self._take_image(dict(image_request, **retry[0]) if retry else image_request, timer, exptime)
+                    self.log.debug(f"Taking image: image name {image.name}")
+                    progress("image", filename=image.name, exptime=exptime, **(retry[0] if retry else {}))
+                except JobCancelledException:
+                    raise
+                except:
+                    self.log.error("Can't take image")
+                    raise
+                if retry:
+                    image.pixel_map = PixelMap.from_header(image, self["retry_binning"], retry[1])
+                else:
+                    image.pixel_map = PixelMap.from_header(image)
+                if detector is None:
+                    detector = (image["NAXIS1"] * image.pixel_map.binning, image["NAXIS2"] * image.pixel_map.binning)
+
+                stars = None
+                if adaptive and not retry:
+                    with timer.span("star_count"):
+                        # all of them: a capped count would teach too low a star rate
+                        stars = bright_stars(image.data, n=None)
+                    if len(stars) < needed:
+                        calibration.update(*setup, exptime, len(stars))
+                        longer = calibration.escalate(exptime, len(stars), needed)
+                        if longer is not None:
+                            self.log.info(f"Only {len(stars):d} stars in {exptime:.1f} s, exposing {longer:.1f} s")
+                            progress("escalate", stars=len(stars), exptime=longer)
+                            exptime = longer
+                            self._count_trial()
+                            continue
+
+                wcs_image = None
+                if reference is not None and self["relative_verify"]:
+                    wcs_image = self._match_reference(
+                        reference, image, rotated, timer, stars=stars[:60] if stars is not None else None
+                    )
+                    if wcs_image is None:
+                        self.log.debug("Could not match stars with the previous frame, solving")
+                if wcs_image is None:
+                    try:
+                        wcs_image = self._solve(image, timer, priority)
+                    except NoSolutionAstrometryNetException:
+                        if retry:
+                            self.log.info("No solution on the retry window, going back to full frames")
+                            retry = None
+                            subframe = False
+                            self._count_trial()
+                            continue
+                        if not adaptive:
+                            raise
+                        calibration.update(*setup, exptime, len(stars), solved=False)
+                        longer = calibration.escalate(exptime, len(stars), calibration.needed(*setup[:3]))
+                        if longer is None:
+                            raise
+                        self.log.info(f"No solution with {len(stars):d} stars in {exptime:.1f} s, exposing {longer:.1f} s")
+                        progress("escalate", stars=len(stars), exptime=longer)
+                        exptime = longer
+                        self._count_trial()
+                        continue
+                    bookkeeping.append(self._background.submit(self._record_solution, image, wcs_image))
+                if stars is not None:
+                    calibration.update(*setup, exptime, len(stars), solved=True)
+                if self["relative_verify"]:
+                    if stars is not None:
+                        reference_stars = Future()
+                        reference_stars.set_result(stars[:60])
+                    else:
+                        # found while the mount moves to the next position
+                        reference_stars = self._background.submit(bright_stars, image.data)
+                    reference = (reference_stars, wcs_image, image.pixel_map)
+
+                with timer.span("wcs_read"):
+                    # the detector center, wherever the window of this frame is
+                    center = image.pixel_map.to_pixel((detector[0] / 2., detector[1] / 2.))
+                    ra_wcs_center, dec_wcs_center = wcs_image.world_at(center)
+                    rotation = wcs_image.get_rotation()
+                self.log.debug(f"WCS rotation: {rotation:f} degrees")
+                current_wcs = Position.from_ra_dec(Coord.from_d(ra_wcs_center), Coord.from_d(dec_wcs_center))
+
+                # save the position of first solved trial:
+                if current_image_center is None:
+                    ra_img_center = image["CRVAL1"]  # expects to see this in image
+                    dec_img_center = image["CRVAL2"]
+                    current_image_center = Position.from_ra_dec(Coord.from_d(ra_img_center),
+                                                                Coord.from_d(dec_img_center))
+                    self.log.debug(f"Setting ra, dec for {ra_img_center}, {dec_img_center}")
+
+                    # write down the two positions for later use in mount models
+                    site = self.get_site()
+                    logstr = f"Pointing Info for Mount Model: {site.lst()} {site.mjd()} {image['DATE-OBS']} {current_image_center} {current_wcs}"
+                    self.log.info(logstr)
+                else:
+                    self.log.debug("Using previous ra, dec.")
+
+                delta_ra = ra_img_center - ra_wcs_center
+                delta_dec = dec_img_center - dec_wcs_center
+
+                # *** need to do real logging here
+                logstr = f"{image['DATE-OBS']} ra_tel = {ra_img_center} dec_tel = {dec_img_center} ra_img = {ra_wcs_center} dec_img = {dec_wcs_center} delta_ra = {delta_ra} delta_dec = {delta_dec}"
+                self.log.debug(logstr)
+                progress("solved", ra=ra_wcs_center, dec=dec_wcs_center, delta_ra=delta_ra, delta_dec=delta_dec)
+
+                if (fabs(delta_ra) <= self["ra_tolerance"]) and (fabs(delta_dec) <= self["dec_tolerance"]):
+                    break
+
+                self.log.debug("Telescope not there yet. Trying again")
+                self._count_trial()
+                if subframe:
+                    retry = self._retry_readout(detector, wcs_image, image, delta_ra * cos(radians(dec_img_center)), delta_dec)
+                progress("offset", delta_ra=delta_ra, delta_dec=delta_dec, rotation=rotation)
+                self._offset(tel, delta_ra, delta_dec, rotation, timer)
+                rotated = -rotation if self["rotator"] is not None else 0.0
+
+            # if we got here, we were succesfull
             self.current_field = 0
             # and save final position
             # write down the two positions for later use in mount models
@@ -201,58 +637,226 @@ class PointVerify(ChimeraObject, PointVerify):
             # larger than some value
             self.log.info(logstr)
 
-        if self["rotator"] is not None:
-            self.log.info(f"Field rotation is {rotation:f} degrees, moving rotator.")
-            self.get_rotator().move_by(-rotation)
-
+            if self["rotator"] is not None:
+                self.log.info(f"Field rotation is {rotation:f} degrees, moving rotator.")
+                self._move_rotator(-rotation, timer)
+            success = True
+        finally:
+            if image is not None:
+                image.cleanup()
+            trials = self.ntrials + 1
+            # reset trials counter
+            self.ntrials = 0
+            for task in bookkeeping:
+                try:
+                    task.result()
+                except Exception as e:
+                    self.log.warning(f"Error recording solution: {e}")
+            timer.finish(success)
+            try:
+                self.get_timing_recorder().record(timer)
+            except Exception as e:
+                self.log.warning(f"Error recording timings: {e}")
+
+        self.last_verify_time = time.time() - t_start
+        self.log.info(f"Pointing verified in {self.last_verify_time:.1f} seconds, {trials:d} trials")
         return True
 
     # def set_current_field(self, f):
     #     self.current_field = f
     #     return True
 
-    # def check_pointing(self, nfields=1):
-    #     """
-    #     This method *chooses* a field to verify the telescope pointing.
-    #     Then it does the pointing and verifies it.
-    #     If unsuccesfull e-mail the operator for help
+    def select_fields(self, n=5):
+        """
+        Chooses the standard fields to verify the pointing on now.
 
-    #     Choice is based on some catalog (Landolt here)
-    #     We choose the field closest to zenith
-    #     """
-    #     # find where the zenith is
-    #     site = self.getManager().getProxy("/Site/0")
-    #     lst = site.LST()
-    #     lat = site["latitude"]
-    #     coords = Position.fromRaDec(lst, lat)
-
-    #     self.log.info(f"Check pointing - Zenith coordinates: {lst:f} {lat:f}")
-
-    #     tel = self.get_tel()
-
-    #     # use the Vizier catalogs to see what Landolt field is closest to
-    #     # zenith
-    #     self.log.debug("Calling landolt")
-    #     fld = Landolt()
-    #     fld.useTarget(coords, radius=45)
-    #     obj = fld.find(limit=self["max_fields"])
-
-    #     self.log.debug(f"Objects returned from Landolt: {obj}")
-    #     # get ra, dec to call pointVerify
-    #     ra = obj[self.current_field]["RA"]
-    #     dec = obj[self.current_field]["DEC"]
-    #     name = obj[self.current_field]["ID"]
-    #     self.log.debug(f"Current object: {ra}, {dec}, {name}")
-
-    #     self.log.info(f"Chose {name} {ra:f} {dec:f}")
-    #     tel.slewToRaDec(Position.fromRaDec(ra, dec))
-    #     try:
-    #         self.point_verify()
-    #     except Exception as e:
-    #         print_exception(e)
-    #         raise CantSetScopeException(
-    #             f"Can't set scope on field {name} {ra:f} {dec:f} we are in trouble, call for help")
-    #     return True
+        Landolt fields above min_altitude are ranked by the slew time from the
+        current mount position, their airmass, how long they stay up and how
+        many catalog stars they have.
+
+        @param n: number of fields to return, at most max_fields
+        @type n: int
+
+        Returns a list of dicts with ID, RA, DEC (degrees), alt, airmass,
+        hours_up, slew_time and stars, the best field first.
+        """
+        site = self.get_site()
+        lst = site.lst().deg
+        latitude = site["latitude"].deg
+        zenith = Position.from_ra_dec(Coord.from_d(lst), Coord.from_d(latitude))
+
+        # every field above min_altitude, ranked below; max_fields only bounds how many are tried
+        candidates = Landolt().find(near=zenith, radius=90.0 - self["min_altitude"])
+        if not candidates:
+            return []
+        ra = np.array([c["RA"].deg for c in candidates])
+        dec = np.array([c["DEC"].deg for c in candidates])
+
+        try:
+            current = self.get_tel().get_position_ra_dec()
+            current = (current.ra.deg, current.dec.deg)
+        except Exception as e:
+            self.log.warning(f"Can't get the telescope position, ranking fields without slew time: {e}")
+            current = None
+
+        fields = select_fields(
+            ra, dec, lst, latitude, current=current, n=min(n, self["max_fields"]),
+            stars=field_star_counts(ra, dec, self["field_radius"]),
+            min_alt=self["min_altitude"], min_hours=self["min_time_up"], slew_rate=self["slew_rate"],
+            min_separation=self["field_radius"],
+        )
+        return [
+            dict(
+                ID=candidates[f["index"]]["ID"], RA=float(f["ra"]), DEC=float(f["dec"]), alt=float(f["alt"]),
+                airmass=float(f["airmass"]), hours_up=float(f["hours_up"]), slew_time=float(f["slew_time"]),
+                stars=int(f["stars"]),
+            )
+            for f in fields
+        ]
+
+    def check_pointing(self, nfields=1):
+        """
+        This method *chooses* a field to verify the telescope pointing.
+        Then it does the pointing and verifies it.
+
+        The field is the cheapest to reach of those select_fields returns. If
+        the verification fails there, the next best field is tried, up to
+        nfields fields.
+
+        @param nfields: number of fields to try
+        @type nfields: int
+
+        Runs in the verification queue, so it never moves the mount while a
+        verification is in flight.
+        """
+        return self._jobs.submit("check_pointing", self._check_pointing, nfields).wait()
+
+    def _check_pointing(self, job, nfields=1):
+        fields = self.select_fields(max(1, nfields))
+        if not fields:
+            raise CantPointScopeException("No standard field above the altitude limit")
+
+        tel = self.get_tel()
+        for field in fields:
+            self.log.info(
+                f"Chose {field['ID']} {field['RA']:.4f} {field['DEC']:.4f}: alt {field['alt']:.1f}, "
+                f"{field['stars']:d} stars, {field['slew_time']:.0f} s slew"
+            )
+            job.progress("field", id=field["ID"], ra=field["RA"], dec=field["DEC"])
+            tel.slew_to_ra_dec(Position.from_ra_dec(Coord.from_d(field["RA"]), Coord.from_d(field["DEC"])))
+            try:
+                # already in the queue, point_verify would wait for this job
+                return self._point_verify(job)
+            except JobCancelledException:
+                raise
+            except Exception as e:
+                self.log.warning(f"Can't verify pointing on field {field['ID']}: {e}")
+        raise CantPointScopeException(
+            f"Can't set scope on any of {len(fields):d} standard fields, we are in trouble, call for help"
+        )
+
+    def acquire_pointing_model(self, npoints=None, grid=None, image_request={}):
+        """
+        Takes the frames of a pointing model run and solves them.
+
+        The points are laid on the sky above min_altitude and visited in the
+        order that minimizes the slew time, see pmodelplan.plan_run. Each
+        frame is solved in the background while the mount slews to the next
+        point, so the results are ready as soon as the last frame is solved.
+
+        @param npoints: number of points, pmodel_points by default
+        @type npoints: int
+
+        @param grid: equal_area or altaz, pmodel_grid by default
+        @type grid: str
+
+        Returns the name of the .npz file with the star and scope coordinates
+        of the solved frames, see PointingData.from_pmodel_npz. Runs in the
+        verification queue, like check_pointing.
+        """
+        return self._jobs.submit(
+            "acquire_pointing_model", self._acquire_pointing_model, npoints, grid, image_request
+        ).wait()
+
+    def _acquire_pointing_model(self, job, npoints=None, grid=None, image_request={}):
+        site = self.get_site()
+        latitude = site["latitude"].deg
+        tel = self.get_tel()
+        try:
+            current = tel.get_position_ra_dec()
+            current = (current.ra.deg, current.dec.deg)
+        except Exception as e:
+            self.log.warning(f"Can't get the telescope position, planning from the first point: {e}")
+            current = None
+
+        points, total_slew = plan_run(
+            npoints or self["pmodel_points"], site.lst().deg, latitude, current=current,
+            min_alt=self["min_altitude"], max_alt=self["pmodel_max_altitude"], kind=grid or self["pmodel_grid"],
+            rate=self["slew_rate"],
+        )
+        self.log.info(f"Pointing model run of {len(points):d} points, {total_slew / 60.0:.1f} minutes of slews")
+
+        exptime = image_request.get("exptime", self["exptime"])
+        self._set_filter()
+        frames = []
+        t0 = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self["pmodel_workers"]) as pool:
+                for i, point in enumerate(points):
+                    # points are fixed in hour angle, so late points stay where they were planned
+                    ra = (site.lst().deg - point["ha"]) % 360.0
+                    job.progress("point", index=i + 1, alt=point["alt"], az=point["az"])
+                    tel.slew_to_ra_dec(Position.from_ra_dec(Coord.from_d(ra), Coord.from_d(point["dec"])))
+                    lst = site.lst().deg + 15.0 * SIDEREAL_RATE * exptime / 2.0 / 3600.0
+                    try:
+                        image = self._take_image(image_request)
+                    except Exception as e:
+                        self.log.warning(f"Can't take image of point {i + 1:d}: {e}")
+                        continue
+                    # behind the verifications of other telescopes on the shared solver pool
+                    frames.append((image, lst, pool.submit(self._solve, image, None, self["solver_priority"] + 1)))
+                    self.log.debug(f"[{i + 1:d}/{len(points):d}] {image.name} at alt {point['alt']:.1f} az {point['az']:.1f}")
+
+                results = dict(star_ra=[], star_dec=[], scope_ra=[], scope_dec=[], lst=[], date_obs=[], filename=[])
+                for image, lst, solve in frames:
+                    try:
+                        solution = solve.result()
+                    except Exception as e:
+                        self.log.warning(f"Can't solve {image.name}: {e}")
+                        continue
+                    finally:
+                        image.cleanup()
+                    star_ra, star_dec = solution.world_at((image["NAXIS1"] / 2., image["NAXIS2"] / 2.))
+                    for column, value in (
+                        ("star_ra", star_ra), ("star_dec", star_dec), ("scope_ra", image["CRVAL1"]),
+                        ("scope_dec", image["CRVAL2"]), ("lst", lst), ("date_obs", image["DATE-OBS"]),
+                        ("filename", image.name),
+                    ):
+                        results[column].append(value)
+        finally:
+            # frames of a cancelled run that were not collected above
+            for image, _, _ in frames:
+                image.cleanup()
+
+        n_solved = len(results["lst"])
+        self.log.info(
+            f"Pointing model run done in {(time.time() - t0) / 60.0:.1f} minutes, {n_solved:d}/{len(points):d} frames solved"
+        )
+        directory = os.path.expanduser(self["pmodel_dir"])
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, time.strftime("pmodel-%Y%m%d-%H%M%S.npz"))
+        np.savez_compressed(
+            filename,
+            **{c: np.array(v, dtype=str if c in ("date_obs", "filename") else float) for c, v in results.items()},
+        )
+        self.log.info(f"Wrote pointing model data to {filename}")
+
+        if n_solved > len(DEFAULT_TERMS):
+            try:
+                self.log.info(fit_model(PointingData.from_pmodel_npz(filename, latitude), DEFAULT_TERMS).summary())
+            except Exception as e:
+                self.log.warning(f"Can't fit pointing model: {e}")
+        return filename
 
     # def findStandards(self):
     #     """
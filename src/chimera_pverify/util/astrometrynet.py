@@ -1,30 +1,111 @@
-from subprocess import Popen
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import ExitStack
+from subprocess import Popen, TimeoutExpired
 import os
 import logging
+import resource
+import shutil
+import signal
+import threading
 import time
 
+from astropy.io import fits
 from chimera.util.sextractor import SExtractor
 from chimera.core.exceptions import ChimeraException
 from chimera.util.image import Image
 
+from chimera_pverify.util.imagecontext import WCSSolution
+from chimera_pverify.util.platescale import scale_bounds, scale_from_header
+from chimera_pverify.util.solverserver import SolverClient
+from chimera_pverify.util.starfinder import find_stars
+from chimera_pverify.util.timing import NullTimer
+from chimera_pverify.util.workspace import SolveWorkspace
+
 log = logging.getLogger(__name__)
 
 
 class AstrometryNet:
     # staticmethod allows to use a single method of a class
     @staticmethod
-    def solve_field(full_filename, find_star_method="astrometry.net"):
+    def solve_field(
+        full_filename, find_star_method="astrometry.net", server=None, cache=None,
+        scale=None, scale_tolerance=0.05, radius=None,
+        timeout=None, cpu_limit=None, cancel=None, out_suffix="-out", data=None, timer=None, context=None,
+        workspace=None,
+    ):
         """
         @param: full_filename entire path to image
         @type: str
 
-        @param: find_star_method (astrometry.net, sex)
+        @param: find_star_method (astrometry.net, sex, native or race).
+                race runs sex and astrometry.net in parallel, see solve_field_race
+        @type: str
+
+        @param: server address of a running SolverServer. If None or if the
+                server is not reachable, solve-field is run as a subprocess.
+        @type: str
+
+        @param: cache solutions of previously solved identical frames
+        @type: L{SolutionCache}
+
+        @param: scale expected plate scale in arcsec/pixel. If None it is
+                derived from the header, when possible (see util.platescale)
+        @type: float
+
+        @param: scale_tolerance relative width of the scale search band
+        @type: float
+
+        @param: radius search radius around CRVAL1/CRVAL2 in degrees. If None,
+                two field diagonals when the scale is known.
+        @type: float
+
+        @param: timeout wall-clock seconds solve-field may run before it is killed
+        @type: float
+
+        @param: cpu_limit CPU seconds solve-field may use
+        @type: float
+
+        @param: cancel solve-field is killed when this event is set
+        @type: threading.Event
+
+        @param: out_suffix appended to the image name for the solve-field outputs
         @type: str
 
+        @param: data pixels of full_filename already in memory, to avoid reading them again
+        @type: numpy.ndarray
+
+        @param: timer records the source extraction and solve spans
+        @type: L{VerificationTimer}
+
+        @param: context full_filename already parsed. Its header and pixels
+                are used instead of opening the file again, and the solution
+                is attached to it as context.solution
+        @type: L{ImageContext}
+
+        @param: workspace directory for the solver outputs, left for the
+                caller to remove. If None, each solve runs in a private
+                directory (tmpfs when available) that is removed afterwards,
+                and only the WCS is kept, next to the image, unless context
+                is given
+        @type: L{SolveWorkspace}
+
+        Returns the name of the WCS file, None if it was only read into
+        context.solution.
+
         Does astrometry to image=full_filename
-        Uses either astrometry.net or sex(tractor) as its star finder
+        Uses either astrometry.net, sex(tractor) or the in-process native
+        star finder (see util.starfinder)
         """
 
+        if find_star_method == "race":
+            return AstrometryNet.solve_field_race(
+                full_filename, server=server, cache=cache, scale=scale, scale_tolerance=scale_tolerance,
+                radius=radius, timeout=timeout, cpu_limit=cpu_limit, data=data, timer=timer, context=context,
+                workspace=workspace,
+            )
+
+        timer = timer or NullTimer()
         pathname, filename = os.path.split(full_filename)
         pathname = pathname + "/"
         basefilename, file_xtn = os.path.splitext(filename)
@@ -38,9 +119,12 @@ class AstrometryNet:
 
         # version 0.23 changed behavior of --overwrite
         # I need to specify an output filename with -o
-        outfilename = basefilename + "-out"
+        outfilename = basefilename + out_suffix
 
-        image = Image.from_file(full_filename)
+        image = context if context is not None else Image.from_file(full_filename)
+        if data is None and context is not None:
+            # memory mapped, only read if the pixels are needed
+            data = context.data
         try:
             ra = image["CRVAL1"]  # expects to see this in image
         except:
@@ -51,38 +135,224 @@ class AstrometryNet:
             raise AstrometryNetException("Need CRVAL2 on header")
         width = image["NAXIS1"]
         height = image["NAXIS2"]
-        if "CD1_1" in image:
-            radius = 10.0 * abs(image["CD1_1"]) * width
-        else:
-            radius = 1.0  # default radius if no CD1_1 found (degrees)
+        if scale is None:
+            scale = scale_from_header(image)
+        if radius is None:
+            if scale is not None:
+                radius = 2.0 * scale * (width**2 + height**2) ** 0.5 / 3600.0
+            elif "CD1_1" in image:
+                radius = 10.0 * abs(image["CD1_1"]) * width
+            else:
+                radius = 1.0  # default radius if no CD1_1 found (degrees)
 
-        wcs_filename = pathname + outfilename + ".wcs"
+        hint_args = f"--ra {ra:f} --dec {dec:f} --radius {radius:f}"
+        scale_low = scale_high = None
+        if scale is not None:
+            # only the index files of this scale band will be searched
+            scale_low, scale_high = scale_bounds(scale, scale_tolerance)
+            hint_args += f" --scale-units arcsecperpix --scale-low {scale_low:f} --scale-high {scale_high:f}"
+        if cpu_limit is not None:
+            hint_args += f" --cpulimit {int(cpu_limit):d}"
 
-        if find_star_method == "astrometry.net":
-            line = f"solve-field {full_filename} --no-plots --overwrite -o {outfilename} --ra {ra:f} --dec {dec:f} --radius {radius:f}"
-        elif find_star_method == "sex":
-            sexoutfilename = pathname + outfilename + ".xyls"
-            line = (
-                f"solve-field {sexoutfilename} --no-plots --overwrite -o {outfilename} --x-column X_IMAGE --y-column Y_IMAGE "
-                f"--sort-column MAG_ISO --sort-ascending --width {width:d} --height {height:d} --ra {ra:f} --dec {dec:f} --radius {radius:f}"
-            )
+        with ExitStack() as stack:
+            own_workspace = workspace is None
+            if own_workspace:
+                workspace = stack.enter_context(SolveWorkspace())
+            outbase = workspace.path(outfilename)
+            # read before anything leaves the workspace, where another
+            # solve of a frame with the same name can not overwrite it
+            solved_wcs = outbase + ".wcs"
+            if not own_workspace:
+                wcs_filename = solved_wcs
+            elif context is None:
+                wcs_filename = pathname + outfilename + ".wcs"
+            else:
+                # the solution is all the caller needs
+                wcs_filename = None
+
+            if cache is not None:
+                if data is None:
+                    data = fits.getdata(full_filename)
+                hints = dict(ra=ra, dec=dec, radius=radius, scale=scale, find_star_method=find_star_method)
+                cache_key = cache.key(data, **hints)
+                if cache.get(cache_key, solved_wcs) is not None:
+                    log.debug(f"Using cached solution for {full_filename}")
+                    if context is not None:
+                        context.solution = WCSSolution.from_file(solved_wcs)
+                    if own_workspace and wcs_filename is not None:
+                        workspace.collect(outfilename + ".wcs", wcs_filename)
+                    return wcs_filename
+            # the .corr file is only read to count matches for the cache
+            solve_args = workspace.solve_field_args(outfilename, corr=cache is not None)
 
-            sex = SExtractor()
-            sex.config["BACK_TYPE"] = "AUTO"
-            sex.config["DETECT_THRESH"] = 3.0
-            sex.config["DETECT_MINAREA"] = 18.0
-            sex.config["VERBOSE_TYPE"] = "QUIET"
-            sex.config["CATALOG_TYPE"] = "FITS_1.0"
-            sex.config["CATALOG_NAME"] = sexoutfilename
-            sex.config["PARAMETERS_LIST"] = ["X_IMAGE", "Y_IMAGE", "MAG_ISO"]
-            sex.run(full_filename)
+            if find_star_method == "astrometry.net":
+                line = f"solve-field {full_filename} --overwrite -o {outfilename} {solve_args} {hint_args}"
+            elif find_star_method == "sex":
+                sexoutfilename = outbase + ".xyls"
+                line = (
+                    f"solve-field {sexoutfilename} --overwrite -o {outfilename} {solve_args} --x-column X_IMAGE --y-column Y_IMAGE "
+                    f"--sort-column MAG_ISO --sort-ascending --width {width:d} --height {height:d} {hint_args}"
+                )
 
+                sex = SExtractor()
+                sex.config["BACK_TYPE"] = "AUTO"
+                sex.config["DETECT_THRESH"] = 3.0
+                sex.config["DETECT_MINAREA"] = 18.0
+                sex.config["VERBOSE_TYPE"] = "QUIET"
+                sex.config["CATALOG_TYPE"] = "FITS_1.0"
+                sex.config["CATALOG_NAME"] = sexoutfilename
+                sex.config["PARAMETERS_LIST"] = ["X_IMAGE", "Y_IMAGE", "MAG_ISO"]
+                with timer.span("source_extraction", method=find_star_method):
+                    sex.run(full_filename)
+
+            elif find_star_method == "native":
+                xylsfilename = outbase + ".xyls"
+                line = (
+                    f"solve-field {xylsfilename} --overwrite -o {outfilename} {solve_args} --x-column X --y-column Y "
+                    f"--sort-column FLUX --width {width:d} --height {height:d} {hint_args}"
+                )
+                t0 = time.time()
+                with timer.span("source_extraction", method=find_star_method):
+                    stars = find_stars(data if data is not None else fits.getdata(full_filename))
+                log.debug(f"Native star finder found {len(stars)} stars. Took {time.time() - t0:3.2f} sec")
+                if server is None:
+                    fits.BinTableHDU(stars).writeto(xylsfilename, overwrite=True)
+
+            else:
+                log.error("Unknown option used in astrometry.net")
+
+            solved = False
+            solution = None
+            if server is not None:
+                t0 = time.time()
+                # the server solves on one core, so its CPU time is about the wall-clock time
+                limits = [limit for limit in (timeout, cpu_limit) if limit is not None]
+                try:
+                    with timer.span("solve", method=find_star_method, backend="server"):
+                        nmatch, solution = AstrometryNet._solve_on_server(
+                            server, full_filename, find_star_method, outbase,
+                            ra, dec, radius, scale_low, scale_high,
+                            stars=[(s["X"], s["Y"]) for s in stars] if find_star_method == "native" else None,
+                            timeout=min(limits) if limits else None, cancel=cancel,
+                        )
+                    solved = True
+                except NoSolutionAstrometryNetException:
+                    # including timeouts and cancels, solve-field would not do better
+                    raise
+                except Exception as e:
+                    log.warning(f"Solver server {server} not available ({e}), running solve-field")
+                    if timeout is not None:
+                        timeout = max(0.0, timeout - (time.time() - t0))
+                    if find_star_method == "native":
+                        fits.BinTableHDU(stars).writeto(outbase + ".xyls", overwrite=True)
+
+            if not solved:
+                with timer.span("solve", method=find_star_method, backend="solve-field"):
+                    AstrometryNet._run_solve_field(
+                        line, full_filename, outbase, timeout=timeout, cpu_limit=cpu_limit, cancel=cancel
+                    )
+                nmatch = AstrometryNet._count_matches(outbase + ".corr")
+
+            if cache is not None:
+                cache.put(cache_key, solved_wcs, nmatch=nmatch, hints=hints)
+
+            if context is not None:
+                context.solution = solution or WCSSolution.from_file(solved_wcs)
+
+            if own_workspace and wcs_filename is not None:
+                workspace.collect(outfilename + ".wcs", wcs_filename)
+
+        return wcs_filename
+
+    @staticmethod
+    def solve_field_race(full_filename, methods=("sex", "astrometry.net"), timeout=None, **kwargs):
+        """
+        Runs solve_field with each star finder in methods in parallel and
+        returns the first solution, killing the other solve-field processes.
+        The solution is written to the usual <image>-out.wcs, or to workspace
+        when one is given. With a context, the solution is only attached to
+        it and None is returned, as in solve_field.
+
+        @param: timeout wall-clock seconds for the whole race
+        @type: float
+        """
+        t0 = time.time()
+        cancel = threading.Event()
+        pathname, filename = os.path.split(full_filename)
+        basefilename = os.path.splitext(filename)[0]
+
+        stack = ExitStack()
+        workspace = kwargs.pop("workspace", None)
+        if workspace is None:
+            # all pipelines share one private workspace, they write under different names
+            workspace = stack.enter_context(SolveWorkspace())
+            if kwargs.get("context") is None:
+                wcs_filename = os.path.join(pathname, basefilename + "-out.wcs")
+            else:
+                wcs_filename = None
         else:
-            log.error("Unknown option used in astrometry.net")
+            wcs_filename = workspace.path(basefilename + "-out.wcs")
+
+        errors = []
+        executor = ThreadPoolExecutor(max_workers=len(methods))
+        futures = {
+            executor.submit(
+                AstrometryNet.solve_field, full_filename, find_star_method=method, timeout=timeout,
+                cancel=cancel, out_suffix="-out-" + method.replace(".", ""), workspace=workspace, **kwargs,
+            ): method
+            for method in methods
+        }
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                try:
+                    winner_wcs = future.result()
+                except Exception as e:
+                    # e.g. no solution or the star finder is not installed,
+                    # the other pipelines may still succeed
+                    log.debug(f"{futures[future]} failed in the solve race: {e}")
+                    errors.append(f"{futures[future]}: {e}")
+                    continue
+                log.debug(f"{futures[future]} won the solve race in {time.time() - t0:3.2f} sec")
+                if wcs_filename is not None:
+                    shutil.copyfile(winner_wcs, wcs_filename)
+                return wcs_filename
+        except FuturesTimeoutError:
+            raise SolveTimeoutAstrometryNetException(
+                f"No solution for image {full_filename} within {timeout} sec"
+            )
+        finally:
+            # stops the losers, or everyone on timeout: each kills its
+            # solve-field process group within 0.1 s of the cancel. Only
+            # the shared workspace waits for them, not the caller.
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            remaining = [len(futures)]
+            lock = threading.Lock()
+
+            def release(_):
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    stack.close()
 
+            for future in futures:
+                future.add_done_callback(release)
+
+        raise NoSolutionAstrometryNetException(
+            f"Astrometry.net could not find a solution for image: {full_filename} ({'; '.join(errors)})"
+        )
+
+    @staticmethod
+    def _run_solve_field(line, full_filename, outbase, timeout=None, cpu_limit=None, cancel=None):
+        """
+        Runs solve-field and raises NoSolutionAstrometryNetException if it
+        did not produce outbase.solved. solve-field and its children are
+        killed if they run longer than timeout seconds or cancel is set.
+        """
         # when there is a solution astrometry.net creates a file with .solved
         # added as extension.
-        is_solved = pathname + outfilename + ".solved"
+        is_solved = outbase + ".solved"
         # if it is already there, make sure to delete it
         if os.path.exists(is_solved):
             os.remove(is_solved)
@@ -92,8 +362,9 @@ class AstrometryNet:
         # like AstrometryNetInstallProblem
         log.debug("Starting solve-field...")
         t0 = time.time()
-        solve = Popen(line.split())  # ,env=os.environ)
-        solve.wait()
+        AstrometryNet._run_process(
+            line.split(), full_filename, timeout=timeout, cpu_limit=cpu_limit, cancel=cancel
+        )
         log.debug(f"Solve field finished. Took {time.time() - t0:3.2f} sec")
         # if solution failed, there will be no file .solved
         if os.path.exists(is_solved) == False:
@@ -101,7 +372,134 @@ class AstrometryNet:
                 f"Astrometry.net could not find a solution for image: {full_filename} {is_solved}"
             )
 
-        return wcs_filename
+    @staticmethod
+    def _run_process(args, full_filename, timeout=None, cpu_limit=None, cancel=None):
+        """
+        Runs args (solve-field, image2xy) on full_filename and returns its
+        exit code. The process and its children are killed if they run
+        longer than timeout seconds or cancel is set.
+        """
+        name = args[0]
+        t0 = time.time()
+        # new session, so the whole process group can be killed at once
+        process = Popen(args, start_new_session=True)  # ,env=os.environ)
+        try:
+            if cpu_limit is not None:
+                AstrometryNet._limit_cpu(process.pid, cpu_limit)
+            while True:
+                try:
+                    return process.wait(timeout=0.1)
+                except TimeoutExpired:
+                    pass
+                if cancel is not None and cancel.is_set():
+                    raise NoSolutionAstrometryNetException(f"Solve of {full_filename} cancelled")
+                if timeout is not None and time.time() - t0 > timeout:
+                    raise SolveTimeoutAstrometryNetException(
+                        f"{name} did not finish on image {full_filename} within {timeout} sec"
+                    )
+        finally:
+            if process.poll() is None:
+                log.debug(f"Killing {name} on {full_filename}")
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+
+    @staticmethod
+    def _limit_cpu(pid, cpu_limit):
+        """
+        Hard CPU time limit of process pid, in case --cpulimit is not
+        honored. Set from outside after the start, as a preexec_fn is not
+        safe in a threaded process; children forked later inherit it.
+        """
+        seconds = int(cpu_limit) + 5
+        try:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (seconds, seconds))
+        except (AttributeError, OSError) as e:
+            # no prlimit outside Linux, or the process already exited
+            log.debug(f"Can't set the CPU limit of solve-field: {e}")
+
+    @staticmethod
+    def _count_matches(corr_filename):
+        """
+        Returns the number of matched stars in a solve-field .corr file,
+        None if it is not available.
+        """
+        try:
+            return len(fits.getdata(corr_filename, 1))
+        except (OSError, IndexError):
+            return None
+
+    @staticmethod
+    def _solve_on_server(
+        server, full_filename, find_star_method, outbase, ra, dec, radius, scale_low, scale_high, stars=None,
+        timeout=None, cancel=None,
+    ):
+        """
+        Sends the star list of full_filename to a SolverServer and writes
+        the returned solution to outbase.wcs, like solve-field would.
+        stars, if given, is the list of (x, y) already found, brightest first.
+        Gives up after timeout seconds, or when cancel is set.
+        Returns the number of matched stars and the solution.
+        """
+        t0 = time.time()
+        if stars is None:
+            xyls_filename = outbase + ".xyls"
+            if find_star_method == "sex":
+                x_col, y_col, sort_col, ascending = "X_IMAGE", "Y_IMAGE", "MAG_ISO", True
+            else:
+                # same star finder solve-field uses internally
+                code = AstrometryNet._run_process(
+                    ["image2xy", "-O", "-o", xyls_filename, full_filename], full_filename,
+                    timeout=timeout, cancel=cancel,
+                )
+                if code != 0:
+                    raise AstrometryNetException(f"image2xy failed on {full_filename}")
+                x_col, y_col, sort_col, ascending = "X", "Y", "FLUX", False
+            stars = AstrometryNet._read_xyls(xyls_filename, x_col, y_col, sort_col, ascending)
+
+        log.debug(f"Sending {len(stars)} stars to solver server {server}")
+        client = SolverClient(server)
+        try:
+            reply = client.solve(
+                stars, ra, dec, radius, scale_low=scale_low, scale_high=scale_high,
+                timeout=max(0.0, timeout - (time.time() - t0)) if timeout is not None else None, cancel=cancel,
+            )
+        except TimeoutError:
+            raise SolveTimeoutAstrometryNetException(
+                f"Solver server did not solve image {full_filename} within {timeout} sec"
+            )
+        except InterruptedError:
+            raise NoSolutionAstrometryNetException(f"Solve of {full_filename} cancelled")
+        finally:
+            client.close()
+        log.debug(f"Solver server finished. Took {time.time() - t0:3.2f} sec")
+
+        if reply.get("timeout"):
+            raise SolveTimeoutAstrometryNetException(
+                f"Solver server stopped the solve of image {full_filename}: {reply.get('error', '')}"
+            )
+        if reply.get("error"):
+            # the server failed, not the solve
+            raise AstrometryNetException(f"Solver server failed on {full_filename}: {reply['error']}")
+        if not reply.get("solved"):
+            raise NoSolutionAstrometryNetException(
+                f"Astrometry.net could not find a solution for image: {full_filename} {reply.get('error', '')}"
+            )
+
+        wcs_filename = outbase + ".wcs"
+        header = fits.Header()
+        for key, value in reply["wcs"].items():
+            header[key] = value
+        fits.PrimaryHDU(header=header).writeto(wcs_filename, overwrite=True)
+        return reply.get("nmatch"), WCSSolution(header)
+
+    @staticmethod
+    def _read_xyls(filename, x_col, y_col, sort_col, ascending):
+        """
+        Returns a list of (x, y) from a star list table, brightest first.
+        """
+        data = fits.getdata(filename, 1)
+        rows = sorted(zip(data[sort_col], data[x_col], data[y_col]), reverse=not ascending)
+        return [(x, y) for _, x, y in rows]
 
 
 class AstrometryNetException(ChimeraException):
@@ -110,3 +508,7 @@ class AstrometryNetException(ChimeraException):
 
 class NoSolutionAstrometryNetException(ChimeraException):
     pass
+
+
+class SolveTimeoutAstrometryNetException(NoSolutionAstrometryNetException):
+    pass
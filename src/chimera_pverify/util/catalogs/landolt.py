@@ -2,11 +2,35 @@
 # -*- coding: iso-8859-1 -*-
 
 
+import logging
+import os
+import re
+
+import numpy as np
 from chimera.util.position import Position
 from chimera.util.coord import Coord
 from chimera.util.catalog import Catalog
+from chimera_pverify.util.catalogs.localcatalog import LocalCatalog
 from chimera_pverify.util.vizquery import VizQuery
 
+log = logging.getLogger(__name__)
+
+# local copy of II/183A, created with Landolt.import_local()
+LOCAL_CATALOG = "~/.chimera/landolt_II_183A.npz"
+
+# Vizier column -> local catalog column, for the constraints we can apply locally
+LOCAL_COLUMNS = {"Vmag": "vmag"}
+
+
+def _magnitude(value):
+    """
+    Returns value as a float, None for a missing (empty or NaN) magnitude.
+    """
+    if value is None or value == "":
+        return None
+    value = float(value)
+    return None if np.isnan(value) else value
+
 
 class Landolt (VizQuery, Catalog):
 
@@ -17,27 +41,116 @@ class Landolt (VizQuery, Catalog):
     # Landolt inherited VizQuery, its init should be the same as the
     # parent class.  to do that I call VizQuery.__init__(self)
 
-    def __init__(self):
+    _local = {}
+
+    def __init__(self, local_catalog=LOCAL_CATALOG):
         VizQuery.__init__(self)
+        self.local_catalog = local_catalog
 
     def get_name(self):
         return "Landolt"
 
+    @classmethod
+    def import_local(cls, filename=LOCAL_CATALOG):
+        """
+        Downloads the whole II/183A catalog from Vizier once and saves it to
+        filename, to be used by find instead of querying Vizier.
+        """
+        query = VizQuery()
+        query.use_cat("II/183A/")
+        query.use_columns("_RAJ2000,_DEJ2000,*ID_MAIN,Vmag", sort_by="_RAJ2000")
+        query.use_target(Position.from_ra_dec("00:00:00", "+00:00:00"), radius=180)
+        rows = query.find(limit=99999)
+        LocalCatalog(
+            dict(
+                ra=np.array([float(r["_RAJ2000"]) for r in rows]),
+                dec=np.array([float(r["_DEJ2000"]) for r in rows]),
+                id=np.array([str(r["*ID_MAIN"]) for r in rows]),
+                vmag=np.array([float(r["Vmag"]) if r["Vmag"] else np.nan for r in rows]),
+            )
+        ).save(filename)
+        cls._local.pop(os.path.expanduser(filename), None)
+        log.info(f"Saved {len(rows)} Landolt stars to {filename}")
+
+    def _get_local(self):
+        if self.local_catalog is None:
+            return None
+        filename = os.path.expanduser(self.local_catalog)
+        if filename not in self._local:
+            if not os.path.exists(filename):
+                return None
+            self._local[filename] = LocalCatalog.load(filename)
+        return self._local[filename]
+
+    def _local_mask(self, catalog):
+        """
+        Returns a boolean mask with the column constraints applied to the local
+        catalog. Raises ValueError for constraints that can't be done locally.
+        """
+        mask = np.ones(len(catalog), dtype=bool)
+        for column, condition in self.args.items():
+            if column.startswith("-"):
+                continue
+            if column not in LOCAL_COLUMNS:
+                raise ValueError(f"Column {column} not in local catalog")
+            values = catalog.columns[LOCAL_COLUMNS[column]]
+            condition = str(condition).strip()
+            match = re.fullmatch(r"([<>]=?|=)?\s*([-+]?\d*\.?\d+)(?:\s*\.\.\s*([-+]?\d*\.?\d+))?", condition)
+            if match is None:
+                raise ValueError(f"Unsupported constraint {column}{condition}")
+            op, a, b = match.groups()
+            a = float(a)
+            with np.errstate(invalid="ignore"):
+                if b is not None:
+                    mask &= (values >= a) & (values <= float(b))
+                elif op == "<":
+                    mask &= values < a
+                elif op == "<=":
+                    mask &= values <= a
+                elif op == ">":
+                    mask &= values > a
+                elif op == ">=":
+                    mask &= values >= a
+                else:
+                    mask &= values == a
+        return mask
+
+    def _find_local(self, catalog, limit, closest):
+        sort_by = "_r" if closest else "ra"
+        index, _ = catalog.cone(
+            self.center.ra.deg, self.center.dec.deg, float(self.radius),
+            sort_by=sort_by, limit=limit, mask=self._local_mask(catalog),
+        )
+        c = catalog.columns
+        return [
+            dict(RA=Coord.from_d(c["ra"][i]), DEC=Coord.from_d(c["dec"][i]), ID=str(c["id"][i]), V=_magnitude(c["vmag"][i]))
+            for i in index
+        ]
+
     def find(self, near=None, limit=9999, **conditions):
 
+        if conditions.get("closest", False):
+            limit = 1
+
+        if near:
+            self.use_target(near, radius=conditions.get("radius", 45))
+
+        catalog = self._get_local()
+        if catalog is not None and self.center is not None and self.radius:
+            try:
+                return self._find_local(catalog, limit, conditions.get("closest", False))
+            except ValueError as e:
+                log.debug(f"Can't use local Landolt catalog ({e}), querying Vizier")
+
         self.use_cat("II/183A/")
 
         if conditions.get("closest", False):
-            limit = 1
             self.use_columns(
                 "*POS_EQ_RA_MAIN,*POS_EQ_DEC_MAIN,*ID_MAIN,Vmag,_r", sort_by="_r")
         else:
             self.use_columns(
                 "*POS_EQ_RA_MAIN,*POS_EQ_DEC_MAIN,*ID_MAIN,Vmag,_r", sort_by="*POS_EQ_RA_MAIN")
 
-        if near:
-            self.use_target(near, radius=conditions.get("radius", 45))
-
         x = super(Landolt, self).find(limit)
 
         for i in x:
@@ -47,8 +160,7 @@ class Landolt (VizQuery, Catalog):
             i["DEC"] = Coord.fromDMS(str(DEC))
             ID = i.pop("*ID_MAIN")
             i["ID"] = str(ID)
-            V = i.pop("Vmag")
-            i["V"] = str(V)
+            i["V"] = _magnitude(i.pop("Vmag"))
             i.pop("_r")
 
         return x
@@ -0,0 +1,78 @@
+"""
+Local copy of a small catalog with a spatial index.
+
+Stars are kept as numpy arrays in a .npz file and indexed with a KD-tree on
+unit vectors, so cone searches are answered locally, without network access.
+"""
+
+import logging
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+log = logging.getLogger(__name__)
+
+
+def unit_vectors(ra, dec):
+    """
+    Returns an (N, 3) array of unit vectors for ra, dec in degrees.
+    """
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)))
+
+
+class LocalCatalog:
+    """
+    @param columns: catalog columns, must have "ra" and "dec" in degrees
+    @type columns: dict of numpy.ndarray
+    """
+
+    def __init__(self, columns):
+        self.columns = {k: np.asarray(v) for k, v in columns.items()}
+        self._xyz = unit_vectors(self.columns["ra"], self.columns["dec"])
+        self._tree = cKDTree(self._xyz)
+
+    def __len__(self):
+        return len(self.columns["ra"])
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(os.path.expanduser(filename), allow_pickle=False) as npz:
+            return cls({k: npz[k] for k in npz.files})
+
+    def save(self, filename):
+        filename = os.path.expanduser(filename)
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        np.savez_compressed(filename, **self.columns)
+
+    def cone(self, ra, dec, radius, sort_by="_r", limit=None, mask=None):
+        """
+        @param ra, dec: center of the search in degrees
+        @param radius: search radius in degrees
+
+        @param sort_by: "_r" to sort by distance to the center or a column name
+        @type sort_by: str
+
+        @param mask: boolean array selecting which catalog rows may be returned
+        @type mask: numpy.ndarray
+
+        Returns (index, distance) arrays: the catalog rows inside the cone and
+        their distance to the center in degrees.
+        """
+        center = unit_vectors([ra], [dec])[0]
+        # radius on the sphere -> chord length between unit vectors
+        chord = 2.0 * np.sin(np.radians(min(radius, 180.0)) / 2.0)
+        index = np.asarray(self._tree.query_ball_point(center, chord + 1e-12), dtype=int)
+        if mask is not None:
+            index = index[mask[index]]
+        distance = np.degrees(np.arccos(np.clip(self._xyz[index] @ center, -1.0, 1.0)))
+        inside = distance <= radius
+        index, distance = index[inside], distance[inside]
+
+        order = np.argsort(distance if sort_by == "_r" else self.columns[sort_by][index], kind="stable")
+        if limit is not None:
+            order = order[:limit]
+        return index[order], distance[order]
@@ -0,0 +1,178 @@
+"""
+Exposure times for pointing verification frames.
+
+The number of stars detected on a frame grows with the exposure time as
+N = k t^alpha: the limiting magnitude deepens by 1.25 log10(t) on a sky
+limited frame and source counts grow as 10^(0.6 m), so alpha is about
+0.75. ExposureCalibration learns k for each camera, filter, binning and
+galactic latitude band from the frames taken, and how many stars a frame
+needs to be solved, and picks the shortest exposure expected to give
+enough stars.
+"""
+
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+STAR_COUNT_INDEX = 0.75
+
+# fewer stars than this can not be solved, however lucky the previous solves were
+MIN_STARS_FLOOR = 5
+
+
+def galactic_band(ra, dec, width=15.0):
+    """
+    Returns the index of the galactic latitude band of (ra, dec) in degrees,
+    0 on the plane, where star counts are highest.
+    """
+    from astropy import units
+    from astropy.coordinates import SkyCoord
+
+    b = SkyCoord(ra * units.deg, dec * units.deg).galactic.b.deg
+    return int(abs(b) // width)
+
+
+def binning_from_request(image_request):
+    """
+    Returns the binning asked for in a chimera image request ("2x2", 2 or
+    None), 1 if not given.
+    """
+    binning = image_request.get("binning")
+    if binning is None:
+        return 1
+    try:
+        return int(str(binning).lower().split("x")[0])
+    except ValueError:
+        return 1
+
+
+class ExposureCalibration:
+    """
+    Persistent star count rates and stars needed per setup.
+
+    @param filename: JSON file to keep the calibration, None keeps it in memory
+    @type filename: str
+
+    @param min_stars: stars needed to solve until solves tell otherwise
+    @type min_stars: int
+
+    @param margin: the exposure is chosen to give this many times the stars needed
+    @type margin: float
+
+    @param max_weight: number of frames after which older ones are gradually
+                       forgotten, so the rates follow the sky and the seeing
+    @type max_weight: int
+    """
+
+    def __init__(
+        self, filename=None, min_stars=15, min_exptime=0.5, max_exptime=60.0, margin=1.5,
+        index=STAR_COUNT_INDEX, max_weight=10,
+    ):
+        self.filename = os.path.expanduser(filename) if filename is not None else None
+        self.min_stars = min_stars
+        self.min_exptime = min_exptime
+        self.max_exptime = max_exptime
+        self.margin = margin
+        self.index = index
+        self.max_weight = max_weight
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self.filename is not None:
+            try:
+                with open(self.filename) as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                log.warning(f"Ignoring invalid exposure calibration file {self.filename}")
+
+    @staticmethod
+    def _setup(camera, filter, binning):
+        return f"{camera}|{filter}|{binning}"
+
+    def clip(self, exptime):
+        return min(self.max_exptime, max(self.min_exptime, round(exptime, 1)))
+
+    def needed(self, camera, filter, binning=1):
+        """
+        Returns the number of stars a frame of this setup needs to be solved.
+        """
+        entry = self._entries.get(self._setup(camera, filter, binning))
+        return entry["needed"] if entry else self.min_stars
+
+    def rate(self, camera, filter, binning=1, band=None):
+        """
+        Returns the expected stars in a 1 s frame, from the frames in the
+        same galactic latitude band or, if there are none, from all bands.
+        None if this setup has no frames yet.
+        """
+        setup = self._entries.get(self._setup(camera, filter, binning))
+        if not setup or not setup["bands"]:
+            return None
+        bands = setup["bands"]
+        if band is not None and str(band) in bands:
+            return math.exp(bands[str(band)]["log_rate"])
+        # geometric mean, weighted by number of frames
+        n = sum(b["n"] for b in bands.values())
+        return math.exp(sum(b["log_rate"] * b["n"] for b in bands.values()) / n)
+
+    def choose(self, camera, filter, binning=1, band=None, default=10.0):
+        """
+        Returns the shortest exposure time expected to give margin times the
+        stars needed, or default if nothing was learned for this setup.
+        """
+        rate = self.rate(camera, filter, binning, band)
+        if rate is None:
+            return self.clip(default)
+        target = self.margin * self.needed(camera, filter, binning)
+        return self.clip((target / rate) ** (1.0 / self.index))
+
+    def escalate(self, exptime, stars, needed, factor=2.0):
+        """
+        Returns the exposure time of the next trial after a frame of exptime
+        seconds gave only stars stars: at least factor times longer, longer
+        still if the count says so. None if already at max_exptime.
+        """
+        if exptime >= self.max_exptime:
+            return None
+        wanted = (self.margin * needed / max(stars, 1)) ** (1.0 / self.index)
+        return self.clip(exptime * max(factor, wanted))
+
+    def update(self, camera, filter, binning, band, exptime, stars, solved=None):
+        """
+        Adds a frame of exptime seconds with stars detected to the
+        calibration and saves it. solved is the outcome of its solve, None
+        if it was not solved.
+        """
+        key = self._setup(camera, filter, binning)
+        with self._lock:
+            setup = self._entries.setdefault(key, dict(needed=self.min_stars, bands={}))
+            # an empty frame (clouds, closed dome) says nothing about the sky
+            if stars > 0 and exptime > 0:
+                log_rate = math.log(stars) - self.index * math.log(exptime)
+                entry = setup["bands"].get(str(band), dict(log_rate=log_rate, n=0))
+                n = min(entry["n"], self.max_weight - 1)
+                entry["log_rate"] = (entry["log_rate"] * n + log_rate) / (n + 1)
+                entry["n"] = entry["n"] + 1
+                setup["bands"][str(band)] = entry
+            if solved is False and stars >= setup["needed"]:
+                setup["needed"] = int(math.ceil(stars * 1.25))
+            elif solved and stars < setup["needed"]:
+                setup["needed"] = max(MIN_STARS_FLOOR, stars, int(setup["needed"] * 0.9))
+            self._save()
+        log.debug(f"Exposure calibration {key} band {band}: {stars:d} stars in {exptime:.1f} s, solved {solved}")
+
+    def _save(self):
+        if self.filename is None:
+            return
+        directory = os.path.dirname(self.filename) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.filename)
@@ -0,0 +1,156 @@
+"""
+Choice of standard fields to verify the pointing on.
+
+Candidate fields are scored all at once with numpy: altitude and airmass
+now, how long they stay above the altitude limit, the slew time from the
+current mount position and how many catalog stars fall in the camera
+field. The cheapest fields that will still give a solvable image are
+returned first.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from chimera_pverify.util.catalogs.localcatalog import unit_vectors
+
+# sidereal hours per solar hour
+SIDEREAL_RATE = 1.0027379
+
+FIELD_DTYPE = [
+    ("index", "i8"),
+    ("ra", "f8"),
+    ("dec", "f8"),
+    ("alt", "f8"),
+    ("az", "f8"),
+    ("airmass", "f8"),
+    ("hours_up", "f8"),
+    ("slew_time", "f8"),
+    ("stars", "i8"),
+    ("score", "f8"),
+]
+
+
+def wrap180(angle):
+    return (np.asarray(angle) + 180.0) % 360.0 - 180.0
+
+
+def alt_az(ha, dec, latitude):
+    """
+    Returns (alt, az) in degrees, azimuth from north through east, for hour
+    angles and declinations in degrees.
+    """
+    h, d, phi = np.radians(ha), np.radians(dec), np.radians(latitude)
+    sin_alt = np.sin(d) * np.sin(phi) + np.cos(d) * np.cos(phi) * np.cos(h)
+    alt = np.arcsin(np.clip(sin_alt, -1.0, 1.0))
+    az = np.arctan2(-np.cos(d) * np.sin(h), np.sin(d) * np.cos(phi) - np.cos(d) * np.sin(phi) * np.cos(h))
+    return np.degrees(alt), np.degrees(az) % 360.0
+
+
+def airmass(alt):
+    """
+    Airmass at altitude alt (degrees), Kasten & Young (1989).
+    """
+    alt = np.asarray(alt, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = 1.0 / (np.sin(np.radians(alt)) + 0.50572 * (alt + 6.07995) ** -1.6364)
+    return np.where(alt > 0, x, np.inf)
+
+
+def hours_above(ha, dec, latitude, min_alt):
+    """
+    Returns how many hours each object stays above min_alt (degrees), 0 if
+    it is below now and 24 if it never sets.
+    """
+    h, d, phi = np.radians(ha), np.radians(dec), np.radians(latitude)
+    cos_set = (np.sin(np.radians(min_alt)) - np.sin(phi) * np.sin(d)) / (np.cos(phi) * np.cos(d))
+    ha_set = np.degrees(np.arccos(np.clip(cos_set, -1.0, 1.0)))
+    hours = (ha_set - wrap180(np.degrees(h))) / 15.0 / SIDEREAL_RATE
+    alt, _ = alt_az(ha, dec, latitude)
+    hours = np.where(alt < min_alt, 0.0, hours)
+    return np.where(cos_set <= -1.0, 24.0, np.clip(hours, 0.0, 24.0))
+
+
+def slew_time(ha0, dec0, ha, dec, rate=2.0, settle=5.0):
+    """
+    Seconds for an equatorial mount to slew from (ha0, dec0) to (ha, dec),
+    both axes moving at the same time at rate degrees per second.
+    """
+    return np.maximum(np.abs(wrap180(np.asarray(ha) - ha0)), np.abs(np.asarray(dec) - dec0)) / rate + settle
+
+
+def field_star_counts(ra, dec, radius, catalog_ra=None, catalog_dec=None):
+    """
+    Returns the number of catalog stars (the candidates themselves by
+    default) within radius degrees of each position.
+    """
+    catalog_ra = ra if catalog_ra is None else catalog_ra
+    catalog_dec = dec if catalog_dec is None else catalog_dec
+    tree = cKDTree(unit_vectors(catalog_ra, catalog_dec))
+    chord = 2.0 * np.sin(np.radians(radius) / 2.0)
+    return tree.query_ball_point(unit_vectors(ra, dec), chord, return_length=True)
+
+
+def select_fields(
+    ra, dec, lst, latitude, current=None, n=5, stars=None, min_alt=30.0, min_hours=0.5,
+    min_stars=1, slew_rate=2.0, settle=5.0, airmass_cost=60.0, star_bonus=5.0, min_separation=None,
+):
+    """
+    @param ra, dec: candidate field centers in degrees
+    @type ra, dec: numpy.ndarray
+
+    @param lst: local sidereal time in degrees
+    @param latitude: site latitude in degrees
+
+    @param current: (ra, dec) where the mount points now, in degrees. None
+                    scores all fields as if the slew was free
+    @type current: tuple
+
+    @param stars: expected number of stars in each field, see field_star_counts
+    @type stars: numpy.ndarray
+
+    @param min_hours: fields that set below min_alt sooner are left out
+    @type min_hours: float
+
+    @param airmass_cost: seconds of slew an airmass unit is worth
+    @param star_bonus: seconds of slew a doubling of the star count is worth
+
+    @param min_separation: candidates closer than this (degrees) to a better
+                           one are the same field and are left out
+    @type min_separation: float
+
+    Returns a structured array (FIELD_DTYPE) of the n best fields, the
+    lowest score (in seconds) first.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    stars = np.ones(len(ra), dtype=int) if stars is None else np.asarray(stars)
+    ha = wrap180(lst - ra)
+
+    fields = np.zeros(len(ra), dtype=FIELD_DTYPE)
+    fields["index"] = np.arange(len(ra))
+    fields["ra"], fields["dec"] = ra, dec
+    fields["alt"], fields["az"] = alt_az(ha, dec, latitude)
+    fields["airmass"] = airmass(fields["alt"])
+    fields["hours_up"] = hours_above(ha, dec, latitude, min_alt)
+    if current is not None:
+        fields["slew_time"] = slew_time(wrap180(lst - current[0]), current[1], ha, dec, slew_rate, settle)
+    fields["stars"] = stars
+
+    usable = (fields["alt"] >= min_alt) & (fields["hours_up"] >= min_hours) & (stars >= min_stars)
+    fields = fields[usable]
+    fields["score"] = (
+        fields["slew_time"] + airmass_cost * (fields["airmass"] - 1.0) - star_bonus * np.log2(np.maximum(fields["stars"], 1))
+    )
+    order = np.argsort(fields["score"], kind="stable")
+    if min_separation is None:
+        return fields[order[:n]]
+
+    xyz = unit_vectors(fields["ra"], fields["dec"])
+    max_dot = np.cos(np.radians(min_separation))
+    kept = []
+    for i in order:
+        if len(kept) == n:
+            break
+        if not kept or np.max(xyz[kept] @ xyz[i]) < max_dot:
+            kept.append(i)
+    return fields[kept]
@@ -0,0 +1,150 @@
+"""
+Resumable manifest of the frames of a pointing model run.
+
+Frames are scanned by reading only the blocks of their primary header, in
+parallel. The manifest keeps each frame's mtime, size, header values and
+solve status, so a rerun only scans changed files and only solves new or
+failed frames. Solved frames are exported as columns to a .npz file.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+
+log = logging.getLogger(__name__)
+
+FITS_BLOCK = 2880
+
+# header keywords kept in the manifest
+KEYWORDS = ("OBJECT", "CRVAL1", "CRVAL2", "DATE-OBS")
+
+# columns of the results file, in degrees
+RESULT_COLUMNS = ("star_ra", "star_dec", "scope_ra", "scope_dec", "lst")
+
+
+def read_header_blocks(filename):
+    """
+    Returns the primary header of a FITS file, reading only its blocks, and
+    the number of bytes it takes (the offset of the data).
+    """
+    blocks = []
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(FITS_BLOCK)
+            if len(block) < FITS_BLOCK:
+                raise ValueError(f"No END card in FITS header of {filename}")
+            blocks.append(block)
+            if any(block[card : card + 8] == b"END     " for card in range(0, FITS_BLOCK, 80)):
+                return fits.Header.fromstring(b"".join(blocks).decode("ascii")), len(blocks) * FITS_BLOCK
+
+
+def read_primary_header(filename):
+    """
+    Returns the primary header of a FITS file, reading only its blocks.
+    """
+    return read_header_blocks(filename)[0]
+
+
+def _scan_one(filename):
+    stat = os.stat(filename)
+    entry = dict(mtime=stat.st_mtime, size=stat.st_size, status=None)
+    try:
+        header = read_primary_header(filename)
+        entry.update({k: header.get(k) for k in KEYWORDS})
+    except (OSError, ValueError) as e:
+        entry.update(status="error", error=f"{type(e).__name__}: {e}")
+    return filename, entry
+
+
+class FrameManifest:
+    """
+    @param filename: JSON file to keep the manifest
+    @type filename: str
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self._lock = threading.Lock()
+        self.frames = {}
+        try:
+            with open(self.filename) as f:
+                self.frames = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            log.warning(f"Ignoring invalid frame manifest {self.filename}")
+
+    def scan(self, filenames, max_workers=8):
+        """
+        Reads the headers of new or modified files. Returns the number of
+        files scanned.
+        """
+        changed = []
+        for filename in map(str, filenames):
+            stat = os.stat(filename)
+            entry = self.frames.get(filename)
+            if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                changed.append(filename)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for filename, entry in pool.map(_scan_one, changed):
+                self.frames[filename] = entry
+        return len(changed)
+
+    def select(self, object_suffix="_pmhelper", retry_failed=True):
+        """
+        Returns the sorted frames whose OBJECT ends with object_suffix and
+        that still have to be solved.
+        """
+        statuses = (None, "nosolution", "error") if retry_failed else (None,)
+        return sorted(
+            filename
+            for filename, entry in self.frames.items()
+            if (entry.get("OBJECT") or "").endswith(object_suffix)
+            and entry["status"] in statuses
+            and entry.get("CRVAL1") is not None
+            and entry.get("CRVAL2") is not None
+        )
+
+    def set_result(self, filename, status, values=None, error=None):
+        """
+        @param status: "ok", "nosolution" or "error"
+        @param values: RESULT_COLUMNS of a solved frame
+        """
+        with self._lock:
+            entry = self.frames[filename]
+            entry["status"] = status
+            entry["error"] = error
+            entry.update(values or {})
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.filename) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.frames, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.filename)
+
+    def counts(self):
+        counts = {}
+        for entry in self.frames.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def save_results(self, filename):
+        """
+        Writes the solved frames as columns to a .npz file and returns the
+        number of frames written.
+        """
+        solved = sorted(f for f, entry in self.frames.items() if entry["status"] == "ok")
+        columns = {c: np.array([self.frames[f][c] for f in solved], dtype=float) for c in RESULT_COLUMNS}
+        columns["date_obs"] = np.array([self.frames[f]["DATE-OBS"] for f in solved], dtype=str)
+        columns["filename"] = np.array(solved, dtype=str)
+        np.savez_compressed(filename, **columns)
+        return len(solved)
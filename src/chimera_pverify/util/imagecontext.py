@@ -0,0 +1,180 @@
+"""
+Single-parse view of an image along the verify pipeline.
+
+An ImageContext parses the primary header once and maps the pixels only
+when they are first used, either from a file on disk or from an image
+already transferred to memory. The controller, the star finder and the
+solver share it, and the solver attaches the WCS solution to it, so a trial
+does not open the image or the solution more than once.
+"""
+
+import glob
+import os
+import threading
+import warnings
+
+import numpy as np
+from astropy.wcs import WCS, FITSFixedWarning
+
+from chimera_pverify.util.framemanifest import read_header_blocks
+from chimera_pverify.util.transfer import BITPIX_DTYPES, scale_pixels
+
+# file opens and header bytes read through ImageContext and WCSSolution
+io_stats = dict(opens=0, bytes_read=0)
+_stats_lock = threading.Lock()
+
+
+def _count(opens=0, bytes_read=0):
+    with _stats_lock:
+        io_stats["opens"] += opens
+        io_stats["bytes_read"] += bytes_read
+
+
+class WCSSolution:
+    """
+    Plate solution held in memory.
+
+    @param header: FITS header with the WCS keywords
+    @type header: astropy.io.fits.Header
+    """
+
+    def __init__(self, header):
+        self.header = header
+        with warnings.catch_warnings():
+            # solve-field writes the WCS in a header without data
+            warnings.simplefilter("ignore", FITSFixedWarning)
+            self.wcs = WCS(header, naxis=2, relax=True)
+
+    @classmethod
+    def from_file(cls, filename):
+        header, size = read_header_blocks(filename)
+        _count(opens=1, bytes_read=size)
+        return cls(header)
+
+    def __getitem__(self, key):
+        return self.header[key]
+
+    def __contains__(self, key):
+        return key in self.header
+
+    def world_at(self, pixel):
+        """
+        Returns (ra, dec) in degrees of pixel (x, y), in FITS 1-based pixels.
+        """
+        ra, dec = self.wcs.all_pix2world([pixel], 1)[0]
+        return float(ra), float(dec)
+
+    def get_rotation(self):
+        """
+        Returns the position angle of the image +Y axis in degrees, east of north.
+        """
+        cd = self.wcs.wcs.get_cdelt()[:, None] * self.wcs.wcs.get_pc()
+        return float(np.degrees(np.arctan2(cd[0, 1], cd[1, 1])))
+
+
+class ImageContext:
+    """
+    @param filename: path of the image on disk, if any
+    @type filename: str
+
+    @param transfer: image already in memory
+    @type transfer: L{TransferredImage}
+    """
+
+    def __init__(self, filename=None, transfer=None):
+        if filename is None and transfer is None:
+            raise ValueError("ImageContext needs a filename or a transferred image")
+        self.filename = filename
+        self.transfer = transfer
+        self.solution = None
+        self.pixel_map = None  # readout of a binned or windowed frame, see util.subframe
+        self._header = None
+        self._data = None
+        self._data_offset = None
+        self._scratch = None  # file written by path(), removed by cleanup()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, filename):
+        return cls(filename=filename)
+
+    @classmethod
+    def from_transfer(cls, transfer, filename=None):
+        """
+        @param filename: where the transferred image was written, if it was
+        """
+        return cls(filename=filename, transfer=transfer)
+
+    @property
+    def header(self):
+        with self._lock:
+            if self._header is None:
+                if self.transfer is not None:
+                    self._header, self._data_offset = self.transfer.header, self.transfer.data_offset
+                else:
+                    self._header, self._data_offset = read_header_blocks(self.filename)
+                    _count(opens=1, bytes_read=self._data_offset)
+            return self._header
+
+    @property
+    def data(self):
+        """
+        The pixels with BZERO/BSCALE applied, memory mapped from the file
+        (or a view of the transferred image) on first use.
+        """
+        header = self.header
+        with self._lock:
+            if self._data is None:
+                if self.transfer is not None:
+                    self._data = self.transfer.data()
+                else:
+                    shape = tuple(header[f"NAXIS{i}"] for i in range(header["NAXIS"], 0, -1))
+                    raw = np.memmap(
+                        self.filename, dtype=BITPIX_DTYPES[header["BITPIX"]], mode="r",
+                        offset=self._data_offset, shape=shape,
+                    )
+                    _count(opens=1)
+                    self._data = scale_pixels(raw, header)
+            return self._data
+
+    def path(self, directory=None):
+        """
+        Returns a path to the image on disk, writing the transferred image
+        to directory (tmpfs by default) the first time it is needed.
+        """
+        with self._lock:
+            if self.filename is None or not os.path.exists(self.filename):
+                self.filename = self._scratch = self.transfer.to_file(directory)
+            return self.filename
+
+    @property
+    def name(self):
+        """
+        The name of the image as taken, for logs.
+        """
+        return self.transfer.filename if self.transfer is not None else self.filename
+
+    def cleanup(self):
+        """
+        Removes the file path() wrote, and the solver outputs next to it.
+        Images that were files to begin with are left alone.
+        """
+        with self._lock:
+            if self._scratch is None:
+                return
+            root = os.path.splitext(self._scratch)[0]
+            for path in [self._scratch] + glob.glob(glob.escape(root) + "-out*"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.filename = self._scratch = None
+
+    def __getitem__(self, key):
+        return self.header[key]
+
+    def __contains__(self, key):
+        return key in self.header
+
+    def get(self, key, default=None):
+        return self.header.get(key, default)
@@ -0,0 +1,186 @@
+"""
+Background jobs with progress events and cooperative cancellation.
+
+A JobQueue runs jobs one at a time on its own worker thread, in the order
+they were submitted, and keeps their state so callers (over a Chimera
+proxy, say) can poll a job by its ID, read its progress events, cancel it
+or wait for its result instead of blocking for the whole run.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from chimera.core.exceptions import ChimeraException
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelledException(ChimeraException):
+    pass
+
+
+class UnknownJobException(ChimeraException):
+    pass
+
+
+class Job:
+    """
+    State of one job. The function it runs gets the job as its first
+    argument and calls progress() between steps, which records an event and
+    is where a cancelled job stops.
+    """
+
+    def __init__(self, job_id, name):
+        self.id = job_id
+        self.name = name
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """
+        Asks the job to stop at its next progress() call. Returns False if
+        it already finished.
+        """
+        with self._lock:
+            if self.state in FINISHED:
+                return False
+            self._cancel.set()
+            if self.state == QUEUED:
+                self._finish(CANCELLED, error=JobCancelledException(f"Job {self.id} cancelled before it started"))
+            return True
+
+    def progress(self, kind, **data):
+        """
+        Records an event of this job and raises JobCancelledException if it
+        was cancelled.
+        """
+        event = dict(index=len(self.events), time=time.time(), kind=kind)
+        event.update(data)
+        with self._lock:
+            self.events.append(event)
+        if self._cancel.is_set():
+            raise JobCancelledException(f"Job {self.id} cancelled")
+
+    def get_events(self, since=0):
+        with self._lock:
+            return [dict(e) for e in self.events[since:]]
+
+    def wait(self, timeout=None):
+        """
+        Waits for the job to finish and returns its result, raises its error
+        if it failed or was cancelled and TimeoutError if it did not finish
+        within timeout seconds.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job {self.id} still {self.state} after {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def status(self):
+        with self._lock:
+            return dict(
+                id=self.id, name=self.name, state=self.state, created=self.created, started=self.started,
+                finished=self.finished, result=self.result,
+                error=None if self.error is None else f"{type(self.error).__name__}: {self.error}",
+                events=len(self.events), last_event=dict(self.events[-1]) if self.events else None,
+            )
+
+    def _start(self):
+        with self._lock:
+            if self.state != QUEUED:
+                return False
+            self.state = RUNNING
+            self.started = time.time()
+            return True
+
+    def _finish(self, state, result=None, error=None):
+        self.state = state
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self._done.set()
+
+
+class JobQueue:
+    """
+    @param max_finished: finished jobs kept for status queries, the oldest
+                         are forgotten first
+    @type max_finished: int
+    """
+
+    def __init__(self, max_finished=100, name="job"):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        Queues fn(job, *args, **kwargs) and returns the Job right away.
+        """
+        with self._lock:
+            job = Job(f"{name}-{next(self._ids):d}", name)
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise UnknownJobException(f"Unknown job {job_id}") from None
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            for job in self.jobs():
+                job.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job, fn, args, kwargs):
+        if not job._start():
+            return
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelledException as e:
+            with job._lock:
+                job._finish(CANCELLED, error=e)
+        except Exception as e:
+            with job._lock:
+                job._finish(FAILED, error=e)
+        else:
+            with job._lock:
+                job._finish(DONE, result=result)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,138 @@
+"""
+Plate scale hints for solve-field.
+
+Knowing the pixel scale lets astrometry.net search only the index files of
+the right scale band instead of all of them. The scale comes from the
+optics (focal length, pixel size and binning), from header keywords or
+from PlateScaleCalibration, which learns the true scale of each camera
+and binning from successful solves.
+"""
+
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+ARCSEC_PER_RADIAN = 206264.806
+
+
+def plate_scale(focal_length, pixel_size, binning=1):
+    """
+    @param focal_length: telescope focal length in mm
+    @type focal_length: float
+
+    @param pixel_size: unbinned pixel size in microns
+    @type pixel_size: float
+
+    @param binning: detector binning
+    @type binning: int
+
+    Returns the plate scale in arcsec/pixel.
+    """
+    return ARCSEC_PER_RADIAN * pixel_size * 1e-3 * binning / focal_length
+
+
+def header_binning(header, default=1):
+    """
+    Returns the binning of an image from its header, default if not present.
+    """
+    for key in ("XBINNING", "CCDXBIN", "BINX"):
+        if key in header:
+            return int(header[key])
+    return default
+
+
+def scale_from_header(header):
+    """
+    @param header: FITS header (or anything with "in" and [] like chimera's Image)
+
+    Returns the plate scale in arcsec/pixel from the WCS or instrument
+    keywords of header, None if it can not be derived.
+    """
+    if "CD1_1" in header:
+        cd12 = header["CD1_2"] if "CD1_2" in header else 0.0
+        cd21 = header["CD2_1"] if "CD2_1" in header else 0.0
+        cd22 = header["CD2_2"] if "CD2_2" in header else header["CD1_1"]
+        det = abs(header["CD1_1"] * cd22 - cd12 * cd21)
+        if det > 0:
+            return math.sqrt(det) * 3600.0
+    if "CDELT1" in header and header["CDELT1"]:
+        return abs(header["CDELT1"]) * 3600.0
+    for key in ("PIXSCALE", "SECPIX", "SECPIX1"):
+        if key in header and header[key]:
+            return float(header[key])
+    if "FOCALLEN" in header and "XPIXSZ" in header and header["FOCALLEN"]:
+        # XPIXSZ already includes binning (MaxIm DL convention)
+        return plate_scale(header["FOCALLEN"], header["XPIXSZ"])
+    return None
+
+
+def scale_bounds(scale, tolerance=0.05):
+    """
+    Returns (scale_low, scale_high) around scale with a relative tolerance.
+    """
+    return scale * (1.0 - tolerance), scale * (1.0 + tolerance)
+
+
+class PlateScaleCalibration:
+    """
+    Persistent plate scale per camera and binning, measured on solved frames.
+
+    @param filename: JSON file to keep the calibration
+    @type filename: str
+
+    @param max_weight: number of solves after which older measurements are
+                       gradually forgotten, so the calibration follows focus
+                       or optics changes
+    @type max_weight: int
+    """
+
+    def __init__(self, filename, max_weight=20):
+        self.filename = os.path.expanduser(filename)
+        self.max_weight = max_weight
+        self._lock = threading.Lock()
+        self._scales = {}
+        try:
+            with open(self.filename) as f:
+                self._scales = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            log.warning(f"Ignoring invalid plate scale calibration file {self.filename}")
+
+    @staticmethod
+    def _key(camera, binning):
+        return f"{camera}|{binning}"
+
+    def get(self, camera, binning=1):
+        """
+        Returns the calibrated scale in arcsec/pixel, None if unknown.
+        """
+        entry = self._scales.get(self._key(camera, binning))
+        return entry["scale"] if entry else None
+
+    def update(self, camera, binning, scale):
+        """
+        Adds a measured scale (arcsec/pixel) to the calibration and saves it.
+        """
+        key = self._key(camera, binning)
+        with self._lock:
+            entry = self._scales.get(key, dict(scale=scale, n=0))
+            n = min(entry["n"], self.max_weight - 1)
+            entry["scale"] = (entry["scale"] * n + scale) / (n + 1)
+            entry["n"] = entry["n"] + 1
+            self._scales[key] = entry
+            self._save()
+        log.debug(f"Plate scale for {key}: {entry['scale']:.4f} arcsec/pixel ({entry['n']} solves)")
+
+    def _save(self):
+        directory = os.path.dirname(self.filename) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._scales, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.filename)
@@ -0,0 +1,182 @@
+"""
+Planning of pointing model acquisition runs.
+
+A grid of alt/az points is laid on the sky above the altitude limit and
+ordered so the mount spends as little time as possible slewing between
+them: a nearest neighbour tour from the current mount position, improved
+with 2-opt moves evaluated for all segment ends at once with numpy.
+"""
+
+import numpy as np
+
+from chimera_pverify.util.fieldselect import slew_time, wrap180
+
+GRIDS = ("equal_area", "altaz")
+
+# golden angle in degrees, spreads points of a spiral evenly in azimuth
+_GOLDEN_ANGLE = 180.0 * (3.0 - np.sqrt(5.0))
+
+
+def sky_grid(n, min_alt=30.0, max_alt=85.0, kind="equal_area"):
+    """
+    Returns (alt, az) in degrees of n points between min_alt and max_alt.
+
+    equal_area is a Fibonacci spiral, every point covers the same solid
+    angle. altaz puts the points on rings of constant altitude, with fewer
+    points on the rings closer to the zenith.
+    """
+    if kind not in GRIDS:
+        raise ValueError(f"Unknown grid {kind}, use one of {', '.join(GRIDS)}")
+    if n < 1:
+        return np.zeros(0), np.zeros(0)
+
+    if kind == "equal_area":
+        # uniform in sin(alt) is uniform in solid angle
+        z0, z1 = np.sin(np.radians(min_alt)), np.sin(np.radians(max_alt))
+        z = z0 + (z1 - z0) * (np.arange(n) + 0.5) / n
+        return np.degrees(np.arcsin(z)), (np.arange(n) * _GOLDEN_ANGLE) % 360.0
+
+    n_rings = max(1, int(round(np.sqrt(n / 2.0))))
+    ring_alt = np.linspace(min_alt, max_alt, n_rings)
+    weight = np.cos(np.radians(ring_alt))
+    per_ring = np.maximum(1, np.floor(n * weight / weight.sum())).astype(int)
+    if n > per_ring.sum():
+        # hand out what rounding left over to the lowest rings
+        per_ring[: n - per_ring.sum()] += 1
+    else:
+        # the one point floor of the top rings overshot, take it back from the fullest rings
+        for _ in range(per_ring.sum() - n):
+            per_ring[np.argmax(per_ring)] -= 1
+    alt = np.repeat(ring_alt, per_ring)
+    # stagger alternate rings by half a step
+    az = np.concatenate([(np.arange(k) + 0.5 * (i % 2)) * 360.0 / k for i, k in enumerate(per_ring)])
+    return alt, az % 360.0
+
+
+def hadec(alt, az, latitude):
+    """
+    Returns (ha, dec) in degrees of alt/az positions, azimuth from north
+    through east.
+    """
+    a, z, phi = np.radians(alt), np.radians(az), np.radians(latitude)
+    sin_dec = np.sin(a) * np.sin(phi) + np.cos(a) * np.cos(phi) * np.cos(z)
+    dec = np.arcsin(np.clip(sin_dec, -1.0, 1.0))
+    ha = np.arctan2(-np.cos(a) * np.sin(z), np.sin(a) * np.cos(phi) - np.cos(a) * np.sin(phi) * np.cos(z))
+    return np.degrees(ha), np.degrees(dec)
+
+
+def slew_matrix(ha, dec, rate=2.0, settle=5.0):
+    """
+    Returns the (N, N) matrix of slew times in seconds between positions.
+    """
+    ha, dec = np.asarray(ha, dtype=float), np.asarray(dec, dtype=float)
+    return slew_time(ha[:, None], dec[:, None], ha[None, :], dec[None, :], rate, settle)
+
+
+def tour_cost(cost, order, start=None):
+    """
+    Total cost of visiting order, from start if given (cost has then one
+    more row and column, the last, for the start position).
+    """
+    order = np.asarray(order)
+    total = cost[order[:-1], order[1:]].sum()
+    if start is not None:
+        total += cost[start, order[0]]
+    return float(total)
+
+
+def order_points(cost, start=None, max_passes=50):
+    """
+    @param cost: (N, N) symmetric matrix of travel costs between points
+    @type cost: numpy.ndarray
+
+    @param start: index in cost of where the tour starts, not visited again.
+                  None starts at whichever point gives the shortest tour
+    @type start: int
+
+    Returns the visiting order of the other points, an open path with a
+    nearest neighbour start and 2-opt improvements.
+    """
+    cost = np.asarray(cost, dtype=float)
+    n = len(cost)
+    if start is None:
+        points = np.arange(n)
+        # nearest neighbour tours from every point, keep the shortest
+        best = min((_nearest_neighbour(cost, s, points) for s in range(n)), key=lambda o: tour_cost(cost, o))
+        path = best
+    else:
+        points = np.delete(np.arange(n), start)
+        path = np.concatenate(([start], _nearest_neighbour(cost, start, points)))
+    path = _two_opt(cost, path, fixed_start=start is not None, max_passes=max_passes)
+    return path[1:] if start is not None else path
+
+
+def _nearest_neighbour(cost, start, points):
+    left = set(int(p) for p in points)
+    left.discard(start)
+    path = [start] if start in points else []
+    current = start
+    while left:
+        candidates = np.fromiter(left, dtype=int)
+        current = int(candidates[np.argmin(cost[current, candidates])])
+        path.append(current)
+        left.remove(current)
+    return np.array(path, dtype=int)
+
+
+def _two_opt(cost, path, fixed_start=False, max_passes=50):
+    """
+    Reverses path[i:j + 1] while that shortens the open path.
+    """
+    path = path.copy()
+    n = len(path)
+    first = 1 if fixed_start else 0
+    for _ in range(max_passes):
+        improved = False
+        for i in range(first, n - 1):
+            j = np.arange(i + 1, n)
+            before = path[i - 1] if i > 0 else -1
+            after = np.where(j + 1 < n, path[np.minimum(j + 1, n - 1)], -1)
+            # edges removed and added by reversing path[i:j + 1], open ends cost nothing
+            removed = (cost[before, path[i]] if before >= 0 else 0.0) + np.where(after >= 0, cost[path[j], after], 0.0)
+            added = (cost[before, path[j]] if before >= 0 else 0.0) + np.where(after >= 0, cost[path[i], after], 0.0)
+            gain = removed - added
+            k = np.argmax(gain)
+            if gain[k] > 1e-9:
+                path[i : j[k] + 1] = path[i : j[k] + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return path
+
+
+def plan_run(n, lst, latitude, current=None, min_alt=30.0, max_alt=85.0, kind="equal_area", rate=2.0, settle=5.0):
+    """
+    @param lst: local sidereal time in degrees
+    @param latitude: site latitude in degrees
+
+    @param current: (ra, dec) in degrees where the mount points now
+    @type current: tuple
+
+    Returns a structured array with alt, az, ha, dec of the points in the
+    order to visit them and the estimated total slew time in seconds. The
+    points are fixed in hour angle, the right ascension to slew to is
+    lst - ha at the time of the slew.
+    """
+    alt, az = sky_grid(n, min_alt, max_alt, kind)
+    ha, dec = hadec(alt, az, latitude)
+    if current is not None:
+        ha = np.append(ha, wrap180(lst - current[0]))
+        dec = np.append(dec, current[1])
+        cost = slew_matrix(ha, dec, rate, settle)
+        order = order_points(cost, start=len(alt))
+        total = tour_cost(cost, order, start=len(alt))
+    else:
+        cost = slew_matrix(ha, dec, rate, settle)
+        order = order_points(cost)
+        total = tour_cost(cost, order)
+
+    points = np.zeros(len(order), dtype=[("alt", "f8"), ("az", "f8"), ("ha", "f8"), ("dec", "f8")])
+    points["alt"], points["az"] = alt[order], az[order]
+    points["ha"], points["dec"] = ha[order], dec[order]
+    return points, total
@@ -0,0 +1,308 @@
+"""
+Pointing model fitting for equatorial mounts.
+
+The model is a linear combination of the usual TPOINT terms. Each term
+gives the (scope - star) offset it produces in hour angle and declination;
+the coefficients of the selected terms are fitted to many pointings at once
+by weighted least squares, rejecting outliers by iterative clipping on the
+on-sky residuals. Term columns are computed once per data set, so the fit
+can be repeated with different term selections in a few milliseconds.
+
+    python -m chimera_pverify.util.pointingmodel pmodel_astrometry_results.npz --latitude -29:00:43
+"""
+
+import argparse
+import csv
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TERMS = ("IH", "ID", "CH", "NP", "MA", "ME", "TF")
+
+
+def _tan_z_terms(h, d, phi):
+    cos_z = np.sin(phi) * np.sin(d) + np.cos(phi) * np.cos(d) * np.cos(h)
+    return (
+        np.cos(phi) * np.sin(h) / (np.cos(d) * cos_z),
+        (np.cos(phi) * np.cos(h) * np.sin(d) - np.sin(phi) * np.cos(d)) / cos_z,
+    )
+
+
+# term -> function of hour angle, declination and latitude (radians) returning
+# the (dH, dDec) produced by a unit coefficient, TPOINT sign conventions.
+# dH is along the hour angle axis, on the sky it is dH * cos(dec).
+TERMS = {
+    # index errors
+    "IH": lambda h, d, phi: (-np.ones_like(h), np.zeros_like(h)),
+    "ID": lambda h, d, phi: (np.zeros_like(h), -np.ones_like(h)),
+    # east-west collimation error
+    "CH": lambda h, d, phi: (-1.0 / np.cos(d), np.zeros_like(h)),
+    # HA/Dec non-perpendicularity
+    "NP": lambda h, d, phi: (-np.tan(d), np.zeros_like(h)),
+    # polar axis misalignment, east-west and elevation
+    "MA": lambda h, d, phi: (-np.cos(h) * np.tan(d), np.sin(h)),
+    "ME": lambda h, d, phi: (np.sin(h) * np.tan(d), np.cos(h)),
+    # tube flexure, proportional to sin(z) and tan(z)
+    "TF": lambda h, d, phi: (
+        np.cos(phi) * np.sin(h) / np.cos(d),
+        np.cos(phi) * np.cos(h) * np.sin(d) - np.sin(phi) * np.cos(d),
+    ),
+    "TX": _tan_z_terms,
+    # fork flexure
+    "FO": lambda h, d, phi: (np.zeros_like(h), np.cos(h)),
+    # declination axis flexure
+    "DAF": lambda h, d, phi: (-(np.cos(phi) * np.cos(h) + np.sin(phi) * np.tan(d)), np.zeros_like(h)),
+    # centering errors of the hour angle and declination encoders
+    "HCES": lambda h, d, phi: (np.sin(h), np.zeros_like(h)),
+    "HCEC": lambda h, d, phi: (np.cos(h), np.zeros_like(h)),
+    "DCES": lambda h, d, phi: (np.zeros_like(h), np.sin(d)),
+    "DCEC": lambda h, d, phi: (np.zeros_like(h), np.cos(d)),
+}
+
+
+def sexagesimal(value):
+    """
+    Returns "[+-]dd:mm:ss.s" (or hh:mm:ss.s) as a float in the same unit.
+    """
+    value = value.strip()
+    sign = -1.0 if value.startswith("-") else 1.0
+    parts = [abs(float(p)) for p in value.lstrip("+-").split(":")]
+    return sign * sum(p / 60.0**i for i, p in enumerate(parts))
+
+
+class PointingData:
+    """
+    Pointings to fit a model to.
+
+    @param ha, dec: hour angle and declination of the stars in degrees
+    @type ha, dec: numpy.ndarray
+
+    @param dha, ddec: (scope - star) in hour angle and declination, in arcsec
+    @type dha, ddec: numpy.ndarray
+
+    @param latitude: site latitude in degrees
+    @type latitude: float
+    """
+
+    def __init__(self, ha, dec, dha, ddec, latitude, filenames=None):
+        self.ha = np.asarray(ha, dtype=float)
+        self.dec = np.asarray(dec, dtype=float)
+        self.dha = np.asarray(dha, dtype=float)
+        self.ddec = np.asarray(ddec, dtype=float)
+        self.latitude = float(latitude)
+        self.filenames = filenames
+        self._h = np.radians(self.ha)
+        self._d = np.radians(self.dec)
+        self._phi = np.radians(self.latitude)
+        self._cos_dec = np.cos(self._d)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.ha)
+
+    @classmethod
+    def from_coordinates(cls, star_ra, star_dec, scope_ra, scope_dec, lst, latitude, filenames=None):
+        """
+        @param star_ra, star_dec: solved positions in degrees
+        @param scope_ra, scope_dec: positions reported by the mount in degrees
+        @param lst: local sidereal time of each pointing in degrees
+        """
+        star_ra, star_dec, scope_ra, scope_dec, lst = (
+            np.asarray(x, dtype=float) for x in (star_ra, star_dec, scope_ra, scope_dec, lst)
+        )
+        ha = (lst - star_ra + 180.0) % 360.0 - 180.0
+        # hour angle grows as right ascension decreases
+        dha = ((star_ra - scope_ra + 180.0) % 360.0 - 180.0) * 3600.0
+        ddec = (scope_dec - star_dec) * 3600.0
+        return cls(ha, star_dec, dha, ddec, latitude, filenames)
+
+    @classmethod
+    def from_pmodel_csv(cls, filename, latitude):
+        """
+        Reads the CSV written by earlier versions of scripts/pmodel.py. Lines
+        of frames that were not solved (starting with #) are skipped.
+        """
+        rows = []
+        with open(filename) as f:
+            for row in csv.reader(line for line in f if not line.startswith("#")):
+                if not row or row[0] == "Star RA":
+                    continue
+                rows.append(row)
+        star_ra = [15.0 * sexagesimal(r[0]) for r in rows]
+        star_dec = [sexagesimal(r[1]) for r in rows]
+        scope_ra = [15.0 * sexagesimal(r[2]) for r in rows]
+        scope_dec = [sexagesimal(r[3]) for r in rows]
+        lst = [15.0 * sexagesimal(r[4]) for r in rows]
+        if isinstance(latitude, str):
+            latitude = sexagesimal(latitude)
+        return cls.from_coordinates(star_ra, star_dec, scope_ra, scope_dec, lst, latitude, [r[-1] for r in rows])
+
+    @classmethod
+    def from_pmodel_npz(cls, filename, latitude):
+        """
+        Reads the results written by scripts/pmodel.py, see FrameManifest.save_results.
+        """
+        if isinstance(latitude, str):
+            latitude = sexagesimal(latitude)
+        with np.load(filename, allow_pickle=False) as npz:
+            return cls.from_coordinates(
+                npz["star_ra"], npz["star_dec"], npz["scope_ra"], npz["scope_dec"], npz["lst"], latitude, list(npz["filename"])
+            )
+
+    def columns(self, term):
+        """
+        Returns the on-sky (x, y) design columns of term, x = dH * cos(dec).
+        """
+        if term not in self._columns:
+            if term not in TERMS:
+                raise ValueError(f"Unknown pointing model term {term}, known terms: {' '.join(TERMS)}")
+            dh, dd = TERMS[term](self._h, self._d, self._phi)
+            self._columns[term] = (dh * self._cos_dec, dd)
+        return self._columns[term]
+
+
+class PointingModel:
+    """
+    Fitted pointing model: coefficients and residuals, in arcsec.
+    """
+
+    def __init__(self, terms, coefficients, sigmas, data, mask, iterations):
+        self.terms = tuple(terms)
+        self.coefficients = coefficients
+        self.sigmas = sigmas
+        self.data = data
+        self.mask = mask
+        self.iterations = iterations
+
+    def __getitem__(self, term):
+        return self.coefficients[self.terms.index(term)]
+
+    def predict(self, ha, dec, latitude=None):
+        """
+        @param ha, dec: hour angle and declination in degrees
+
+        Returns the (scope - star) offsets (dH, dDec) in arcsec predicted by
+        the model, dH along the hour angle axis.
+        """
+        h, d = np.radians(np.asarray(ha, dtype=float)), np.radians(np.asarray(dec, dtype=float))
+        phi = np.radians(self.data.latitude if latitude is None else latitude)
+        dha = np.zeros_like(h)
+        ddec = np.zeros_like(h)
+        for term, coefficient in zip(self.terms, self.coefficients):
+            th, td = TERMS[term](h, d, phi)
+            dha += coefficient * th
+            ddec += coefficient * td
+        return dha, ddec
+
+    def residuals(self):
+        """
+        Returns the on-sky (x, y) residuals of every pointing in arcsec,
+        including the rejected ones.
+        """
+        dha, ddec = self.predict(self.data.ha, self.data.dec)
+        return (self.data.dha - dha) * self.data._cos_dec, self.data.ddec - ddec
+
+    def stats(self):
+        """
+        Residual statistics of the pointings used in the fit, in arcsec.
+        """
+        x, y = (r[self.mask] for r in self.residuals())
+        n, m = int(self.mask.sum()), len(self.terms)
+        r2 = x**2 + y**2
+        dof = max(2 * n - m, 1)
+        return dict(
+            n=n,
+            rejected=int((~self.mask).sum()),
+            rms_x=float(np.sqrt(np.mean(x**2))),
+            rms_y=float(np.sqrt(np.mean(y**2))),
+            sky_rms=float(np.sqrt(np.mean(r2))),
+            # radial scatter with the fitted degrees of freedom removed
+            psd=float(np.sqrt(2.0 * r2.sum() / dof)),
+            max=float(np.sqrt(r2.max())),
+        )
+
+    def to_dict(self):
+        return dict(
+            terms={t: dict(value=float(c), sigma=float(s)) for t, c, s in zip(self.terms, self.coefficients, self.sigmas)},
+            stats=self.stats(),
+        )
+
+    def summary(self):
+        lines = [f"{'term':>6s} {'value':>10s} {'sigma':>8s}"]
+        for term, coefficient, sigma in zip(self.terms, self.coefficients, self.sigmas):
+            lines.append(f"{term:>6s} {coefficient:10.2f} {sigma:8.2f}")
+        s = self.stats()
+        lines.append(
+            f"{s['n']:d} pointings ({s['rejected']:d} rejected): sky RMS {s['sky_rms']:.2f}\", "
+            f"PSD {s['psd']:.2f}\", max {s['max']:.2f}\""
+        )
+        return "\n".join(lines)
+
+
+def fit_model(data, terms=DEFAULT_TERMS, clip=3.0, max_iter=10):
+    """
+    @param data: pointings to fit
+    @type data: PointingData
+
+    @param terms: model terms, see TERMS
+    @type terms: sequence of str
+
+    @param clip: pointings whose on-sky residual is larger than clip times
+                 the robust (MAD) scatter are rejected, None to keep all
+    @type clip: float
+
+    Returns the fitted PointingModel.
+    """
+    terms = tuple(terms)
+    n = len(data)
+    a = np.empty((2 * n, len(terms)))
+    for j, term in enumerate(terms):
+        a[:n, j], a[n:, j] = data.columns(term)
+    b = np.concatenate((data.dha * data._cos_dec, data.ddec))
+
+    mask = np.ones(n, dtype=bool)
+    for iteration in range(1, max_iter + 1):
+        rows = np.concatenate((mask, mask))
+        coefficients, _, rank, _ = np.linalg.lstsq(a[rows], b[rows], rcond=None)
+        if rank < len(terms):
+            log.warning(f"Pointing model terms {' '.join(terms)} are degenerate for these pointings")
+        r = b - a @ coefficients
+        radial = np.hypot(r[:n], r[n:])
+        if clip is None:
+            break
+        # radial residuals of 2d gaussian scatter, MAD -> sigma per axis
+        sigma = 1.4826 * np.median(np.abs(radial[mask] - np.median(radial[mask])))
+        new_mask = radial <= np.median(radial[mask]) + clip * max(sigma, 1e-9)
+        if np.array_equal(new_mask, mask) or new_mask.sum() <= len(terms):
+            break
+        mask = new_mask
+
+    rows = np.concatenate((mask, mask))
+    dof = max(rows.sum() - len(terms), 1)
+    s2 = (r[rows] ** 2).sum() / dof
+    try:
+        sigmas = np.sqrt(np.diag(np.linalg.inv(a[rows].T @ a[rows])) * s2)
+    except np.linalg.LinAlgError:
+        sigmas = np.full(len(terms), np.nan)
+    return PointingModel(terms, coefficients, sigmas, data, mask, iteration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fits a pointing model to pmodel.py results")
+    parser.add_argument("results", help=".npz (or older .csv) results of scripts/pmodel.py")
+    parser.add_argument("--latitude", required=True, help="Site latitude, degrees or dd:mm:ss")
+    parser.add_argument("--terms", nargs="+", default=list(DEFAULT_TERMS), help=f"Model terms among {' '.join(TERMS)}")
+    parser.add_argument("--clip", type=float, default=3.0, help="Outlier rejection threshold in robust sigmas")
+    args = parser.parse_args()
+
+    if args.results.endswith(".csv"):
+        data = PointingData.from_pmodel_csv(args.results, args.latitude)
+    else:
+        data = PointingData.from_pmodel_npz(args.results, args.latitude)
+    print(fit_model(data, args.terms, clip=args.clip).summary())
+
+
+if __name__ == "__main__":
+    main()
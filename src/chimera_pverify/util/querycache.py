@@ -0,0 +1,190 @@
+"""
+Disk-backed cache of Vizier cone searches.
+
+Results are stored per query family (catalog, columns, constraints and
+sort order). A new cone search is answered from the cache when it matches
+a stored one, or when it lies inside a larger stored cone whose result was
+not truncated by the row limit: the stored rows are then filtered by
+distance locally, without a new HTTP request.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# columns Vizier computes with the J2000 position of each row, in degrees
+RA_COLUMN = "_RAJ2000"
+DEC_COLUMN = "_DEJ2000"
+
+# Vizier -c.u unit -> units per degree, for the _r column
+R_UNITS = {"deg": 1.0, "arcmin": 60.0, "arcsec": 3600.0}
+
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    """
+    Returns the angular distance in degrees between positions in degrees.
+    """
+    ra1, dec1, ra2, dec2 = (np.radians(x) for x in (ra1, dec1, ra2, dec2))
+    # haversine, well behaved for small distances
+    a = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+def query_family(args):
+    """
+    Returns the part of a Vizier query that must match for results to be
+    reused: everything but the target, radius and row limit.
+    """
+    family = {k: str(v) for k, v in args.items() if k not in ("-c", "-c.rd", "-c.bd", "-out.max")}
+    return hashlib.sha256(json.dumps(family, sort_keys=True).encode()).hexdigest()[:32]
+
+
+class QueryCache:
+    """
+    @param directory: where to keep cached results
+    @type directory: str
+
+    @param ttl: seconds a cached result stays valid
+    @type ttl: float
+
+    @param max_entries: least recently used results above this are evicted
+    @type max_entries: int
+    """
+
+    def __init__(self, directory, ttl=7 * 86400, max_entries=256):
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._index_filename = os.path.join(self.directory, "index.json")
+        try:
+            with open(self._index_filename) as f:
+                self._index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._index = {}
+
+    def _save_index(self):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_filename)
+
+    def _rows_filename(self, entry_id):
+        return os.path.join(self.directory, entry_id + ".npy")
+
+    def _remove(self, entry_id):
+        self._index.pop(entry_id, None)
+        try:
+            os.remove(self._rows_filename(entry_id))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, args, ra, dec, radius, limit):
+        """
+        @param args: Vizier query arguments
+        @param ra, dec: cone center in degrees
+        @param radius: cone radius in degrees
+        @param limit: maximum number of rows
+
+        Returns the result table, or None if it must be fetched from Vizier.
+        """
+        family = query_family(args)
+        now = time.time()
+        best = None
+        with self._lock:
+            expired = False
+            for entry_id, entry in list(self._index.items()):
+                if now - entry["created"] > self.ttl:
+                    self._remove(entry_id)
+                    expired = True
+                    continue
+                if entry["family"] != family:
+                    continue
+                exact = entry["ra"] == ra and entry["dec"] == dec and entry["radius"] == radius
+                if exact and (entry["complete"] or entry["limit"] >= limit):
+                    best = (entry_id, entry, True)
+                    break
+                # a complete result of a cone containing ours has all our rows
+                if entry["complete"] and angular_distance(entry["ra"], entry["dec"], ra, dec) + radius <= entry["radius"]:
+                    if best is None or entry["radius"] < best[1]["radius"]:
+                        best = (entry_id, entry, False)
+            if best is None:
+                if expired:
+                    self._save_index()
+                return None
+            entry_id, entry, exact = best
+            entry["last_used"] = now
+            try:
+                table = np.load(self._rows_filename(entry_id), allow_pickle=False)
+            except (OSError, ValueError):
+                self._remove(entry_id)
+                table = None
+            # the LRU order and the removals must survive a restart
+            self._save_index()
+            if table is None:
+                return None
+
+        if exact:
+            log.debug(f"Vizier cache hit {entry_id}")
+            return table[:limit]
+
+        log.debug(f"Vizier cache hit {entry_id} (radius {entry['radius']} contains {radius})")
+        return self._filter(table, args, ra, dec, radius, limit)
+
+    def _filter(self, table, args, ra, dec, radius, limit):
+        distance = angular_distance(table[RA_COLUMN], table[DEC_COLUMN], ra, dec)
+        inside = distance <= radius
+        table = table[inside].copy()
+        distance = distance[inside]
+        if "_r" in table.dtype.names:
+            table["_r"] = distance * R_UNITS.get(args.get("-c.u", "arcmin"), 60.0)
+
+        sort_by = str(args.get("-sort", ""))
+        reverse = sort_by.startswith("-")
+        sort_by = sort_by.lstrip("-")
+        if sort_by in table.dtype.names:
+            order = np.argsort(table[sort_by], kind="stable")
+            if reverse:
+                order = order[::-1]
+            table = table[order]
+        return table[:limit]
+
+    def store(self, args, ra, dec, radius, limit, table):
+        """
+        Stores the result table of a cone search. Tables without RA_COLUMN
+        and DEC_COLUMN are only reused for identical queries.
+        """
+        if table.dtype.hasobject:
+            return
+        entry_id = hashlib.sha256(f"{query_family(args)}{ra}{dec}{radius}{limit}".encode()).hexdigest()[:32]
+        has_positions = RA_COLUMN in table.dtype.names and DEC_COLUMN in table.dtype.names
+        now = time.time()
+        with self._lock:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".npy.tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, table, allow_pickle=False)
+            os.replace(tmp, self._rows_filename(entry_id))
+            self._index[entry_id] = dict(
+                family=query_family(args),
+                ra=ra,
+                dec=dec,
+                radius=radius,
+                limit=limit,
+                # fewer rows than the limit means nothing was left out
+                complete=bool(has_positions and len(table) < limit),
+                created=now,
+                last_used=now,
+            )
+            by_use = sorted(self._index, key=lambda k: self._index[k]["last_used"])
+            for old_id in by_use[: max(len(by_use) - self.max_entries, 0)]:
+                self._remove(old_id)
+            self._save_index()
@@ -0,0 +1,141 @@
+"""
+Content-addressed cache of plate solutions.
+
+Entries are keyed on a hash of the image pixels plus the solve hints, so
+re-solving an unchanged frame returns the stored WCS instead of running the
+solver again. Each entry is a <key>.wcs header file and a <key>.json summary.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class SolutionCache:
+    """
+    @param directory: where to keep the cache entries
+    @type directory: str
+
+    @param max_bytes: total size above which least recently used entries are evicted
+    @type max_bytes: int
+
+    @param max_age: entries older than this (seconds) are evicted
+    @type max_age: float
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_age=30 * 86400):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(data, **hints):
+        """
+        @param data: image pixels
+        @type data: numpy.ndarray
+
+        @param hints: solve hints (ra, dec, radius, find_star_method, ...)
+
+        Returns the hex digest identifying this solve.
+        """
+        data = np.ascontiguousarray(data)
+        h = hashlib.sha256()
+        h.update(f"{data.dtype.str}{data.shape}".encode())
+        h.update(memoryview(data).cast("B"))
+        h.update(json.dumps(hints, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".wcs", base + ".json"
+
+    def get(self, key, wcs_filename):
+        """
+        Copies the cached solution for key to wcs_filename.
+        Returns the stored summary dict, or None on a cache miss.
+        """
+        cached_wcs, cached_json = self._paths(key)
+        try:
+            with open(cached_json) as f:
+                summary = json.load(f)
+            if time.time() - summary["created"] > self.max_age:
+                self._remove(key)
+                return None
+            shutil.copyfile(cached_wcs, wcs_filename)
+        except (OSError, ValueError, KeyError):
+            return None
+        # mark as recently used for the LRU eviction
+        now = time.time()
+        os.utime(cached_json, (now, now))
+        log.debug(f"Solution cache hit {key}")
+        return summary
+
+    def put(self, key, wcs_filename, **summary):
+        """
+        Stores wcs_filename as the solution of key, with summary values
+        (e.g. nmatch, hints) kept alongside it.
+        """
+        cached_wcs, cached_json = self._paths(key)
+        summary["created"] = time.time()
+        # write to temporary files and rename so concurrent readers never
+        # see a partial entry
+        fd, tmp_wcs = tempfile.mkstemp(dir=self.directory, suffix=".wcs.tmp")
+        os.close(fd)
+        shutil.copyfile(wcs_filename, tmp_wcs)
+        os.replace(tmp_wcs, cached_wcs)
+        fd, tmp_json = tempfile.mkstemp(dir=self.directory, suffix=".json.tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(summary, f, default=str)
+        os.replace(tmp_json, cached_json)
+        self.evict()
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        """
+        Returns a list of (key, last_used, size) for all entries.
+        """
+        res = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[: -len(".json")]
+            size = 0
+            last_used = 0.0
+            for path in self._paths(key):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                size += st.st_size
+                last_used = max(last_used, st.st_mtime)
+            res.append((key, last_used, size))
+        return res
+
+    def evict(self):
+        """
+        Removes entries past max_age, then least recently used entries until
+        the cache fits in max_bytes.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        now = time.time()
+        total = sum(size for _, _, size in entries)
+        for key, last_used, size in entries:
+            if now - last_used > self.max_age or total > self.max_bytes:
+                self._remove(key)
+                total -= size
+                log.debug(f"Evicted {key} from solution cache")
@@ -0,0 +1,161 @@
+"""
+Bounded pool of solver workers shared by several telescopes.
+
+Every PointVerify of a process can send its plate solves to the same
+SolverPool, so a host running several mounts never runs more solves at a
+time than it has workers for. Waiting solves are taken by priority (lower
+first) and, among the same priority, round robin between clients, so a
+telescope queueing many frames (a pointing model run, say) does not hold
+back the verifications of the others.
+"""
+
+import itertools
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool(max_workers):
+    """
+    Returns the pool of this process, created with max_workers the first
+    time. Later calls with a larger max_workers grow it.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared.closed:
+            _shared = SolverPool(max_workers)
+        elif max_workers > _shared.max_workers:
+            _shared.resize(max_workers)
+        return _shared
+
+
+def reset_shared_pool(wait=True):
+    """
+    Shuts the pool of this process down, cancelling its queued solves, so
+    the next shared_pool call starts a new one of the size it asks for.
+    """
+    global _shared
+    with _shared_lock:
+        pool, _shared = _shared, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+class SolverPool:
+    """
+    @param max_workers: solves run at the same time
+    @type max_workers: int
+    """
+
+    def __init__(self, max_workers=2, name="solver"):
+        if max_workers < 1:
+            raise ValueError("SolverPool needs at least one worker")
+        self.max_workers = max_workers
+        self.name = name
+        self.closed = False
+        # priority -> client -> deque of (future, fn, args, kwargs)
+        self._queues = {}
+        self._running = {}
+        self._workers = []
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._start_workers()
+
+    def submit(self, client, fn, *args, priority=0, **kwargs):
+        """
+        Queues fn(*args, **kwargs) for client (e.g. the telescope name) and
+        returns a Future of its result.
+        """
+        future = Future()
+        with self._cond:
+            if self.closed:
+                raise RuntimeError("SolverPool is shut down")
+            clients = self._queues.setdefault(priority, OrderedDict())
+            clients.setdefault(client, deque()).append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        """
+        Returns a dict of client -> dict(queued, running).
+        """
+        with self._cond:
+            stats = {}
+            for clients in self._queues.values():
+                for client, tasks in clients.items():
+                    stats.setdefault(client, dict(queued=0, running=0))["queued"] += len(tasks)
+            for client, running in self._running.items():
+                stats.setdefault(client, dict(queued=0, running=0))["running"] = running
+            return stats
+
+    def resize(self, max_workers):
+        with self._cond:
+            self.max_workers = max_workers
+            self._start_workers()
+
+    def shutdown(self, wait=True, cancel_queued=True):
+        with self._cond:
+            self.closed = True
+            if cancel_queued:
+                for clients in self._queues.values():
+                    for tasks in clients.values():
+                        for future, _, _, _ in tasks:
+                            future.cancel()
+                self._queues.clear()
+            self._cond.notify_all()
+        if wait:
+            for worker in list(self._workers):
+                worker.join()
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._work, name=f"{self.name}-{next(self._ids):d}", daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _next(self):
+        """
+        Takes the next task, lowest priority value first and round robin
+        between clients. Called with the condition held.
+        """
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            # the first client with a task gets served and goes to the back
+            client, tasks = next(iter(clients.items()))
+            task = tasks.popleft()
+            del clients[client]
+            if tasks:
+                clients[client] = tasks
+            if not clients:
+                del self._queues[priority]
+            return client, task
+        return None, None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queues and not self.closed:
+                    self._cond.wait()
+                if not self._queues:
+                    return
+                client, (future, fn, args, kwargs) = self._next()
+                self._running[client] = self._running.get(client, 0) + 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[client] -= 1
+                    if not self._running[client]:
+                        del self._running[client]
@@ -0,0 +1,387 @@
+"""
+Resident astrometry.net solver.
+
+SolverServer loads the astrometry.net index files once, through the
+``astrometry`` Python bindings, and answers solve jobs sent by
+SolverClient over a local socket. A solve then only costs the star
+matching itself, instead of a solve-field process start plus the index
+reload on every frame.
+
+Run it with:
+
+    python -m chimera_pverify.util.solverserver --index-dir /usr/share/astrometry
+
+Jobs and replies are JSON, never pickles. The server listens on a unix
+socket only its user can connect to, unless a shared secret is set (see
+load_secret): only then it may listen on host:port, and clients must
+authenticate with the same secret.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError, connection
+from multiprocessing.connection import Client, Listener
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = "/tmp/chimera-pverify-solver.sock"
+SECRET_ENV = "CHIMERA_PVERIFY_SOLVER_SECRET"
+
+# largest job or reply accepted, in bytes
+MAX_MESSAGE = 16 << 20
+
+
+def load_secret(filename=None):
+    """
+    Returns the shared secret of server and clients, as bytes: the
+    contents of filename if given, else the CHIMERA_PVERIFY_SOLVER_SECRET
+    environment variable. None if neither is set.
+    """
+    if filename is not None:
+        with open(os.path.expanduser(filename), "rb") as f:
+            secret = f.read().strip()
+    else:
+        secret = os.environ.get(SECRET_ENV, "").strip().encode()
+    return secret or None
+
+
+def is_network_address(address):
+    return not isinstance(address, str)
+
+
+def send_message(conn, message):
+    conn.send_bytes(json.dumps(message).encode())
+
+
+def recv_message(conn):
+    return json.loads(conn.recv_bytes(MAX_MESSAGE).decode())
+
+
+def parse_address(address):
+    """
+    @param address: unix socket path or host:port
+    @type address: str
+
+    Returns an address usable by multiprocessing.connection.
+    """
+    if address is None:
+        return DEFAULT_ADDRESS
+    if not isinstance(address, str) or address.startswith("/"):
+        return address
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "localhost", int(port))
+    return address
+
+
+def solve_job(astrometry, solver, job):
+    """
+    @param job: stars (list of (x, y) sorted by brightness), ra, dec,
+                radius (degrees), optional scale_low and scale_high (arcsec/pixel)
+    @type job: dict
+
+    Returns a dict with the WCS header cards, or with an error message
+    if there was no solution.
+    """
+    if job.get("scale_low") and job.get("scale_high"):
+        size_hint = astrometry.SizeHint(
+            lower_arcsec_per_pixel=float(job["scale_low"]),
+            upper_arcsec_per_pixel=float(job["scale_high"]),
+        )
+    else:
+        size_hint = None
+    position_hint = astrometry.PositionHint(
+        ra_deg=float(job["ra"]), dec_deg=float(job["dec"]), radius_deg=float(job["radius"])
+    )
+    stars = [(float(x), float(y)) for x, y in job["stars"]]
+
+    t0 = time.time()
+    solution = solver.solve(
+        stars=stars,
+        size_hint=size_hint,
+        position_hint=position_hint,
+        solution_parameters=astrometry.SolutionParameters(),
+    )
+    elapsed = time.time() - t0
+
+    if not solution.has_match():
+        return dict(solved=False, elapsed=elapsed)
+
+    match = solution.best_match()
+    wcs = {key: value for key, (value, _) in match.wcs_fields.items()}
+    return dict(solved=True, wcs=wcs, nmatch=len(match.stars), elapsed=elapsed)
+
+
+def solver_process(index_files, conn):
+    """
+    Loads the index files and solves the jobs sent over conn until it is
+    closed. Runs in a process of its own, so the server can kill a solve
+    that takes too long.
+    """
+    import astrometry
+
+    t0 = time.time()
+    solver = astrometry.Solver(index_files)
+    send_message(conn, dict(ready=True, elapsed=time.time() - t0))
+    while True:
+        try:
+            job = recv_message(conn)
+        except EOFError:
+            return
+        try:
+            reply = solve_job(astrometry, solver, job)
+        except Exception as e:
+            reply = dict(solved=False, error=str(e))
+        send_message(conn, reply)
+
+
+class SolverServer:
+    """
+    Keeps an astrometry.Solver with all index files loaded, in a solver
+    process, and serves solve jobs one at a time.
+
+    A solve is stopped after the time_limit of its job, or max_time,
+    whichever is shorter, and as soon as its client disconnects (it gave
+    up or was cancelled), so it does not hold back the jobs queued behind
+    it. The solver process is then killed and started again, reloading the
+    index files.
+
+    @param authkey: shared secret clients authenticate with, load_secret()
+                    by default. Required to listen on host:port.
+    @type authkey: bytes
+
+    @param max_time: seconds any solve may take, None for no limit
+    @type max_time: float
+    """
+
+    def __init__(self, index_files, address=DEFAULT_ADDRESS, authkey=None, max_time=None):
+        self.address = parse_address(address)
+        self.authkey = authkey if authkey is not None else load_secret()
+        if is_network_address(self.address) and not self.authkey:
+            raise ValueError(
+                f"Refusing to listen on {address} without a secret, set {SECRET_ENV} or use a unix socket"
+            )
+        try:
+            import astrometry  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "SolverServer needs the astrometry python package: pip install astrometry"
+            )
+        self.index_files = list(index_files)
+        if not self.index_files:
+            raise ValueError("No astrometry.net index files given")
+        self.max_time = max_time
+
+        self._solve_lock = threading.Lock()
+        self._listener = None
+        self._process = None
+        self._solver = None
+        self._start_solver()
+
+    def _start_solver(self):
+        # spawned, not forked: the server runs a thread per client
+        context = multiprocessing.get_context("spawn")
+        self._solver, child = context.Pipe()
+        self._process = context.Process(
+            target=solver_process, args=(self.index_files, child), name="pverify-solver", daemon=True
+        )
+        self._process.start()
+        child.close()
+        try:
+            ready = recv_message(self._solver)
+        except EOFError:
+            self._process.join()
+            raise RuntimeError(f"Solver process exited with code {self._process.exitcode} loading the index files")
+        log.info(f"Loaded {len(self.index_files)} index files in {ready['elapsed']:3.2f} sec")
+
+    def _stop_solver(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
+            self._solver.close()
+            self._process = self._solver = None
+
+    def solve(self, job, client=None):
+        """
+        @param job: see solve_job, with an optional time_limit in seconds
+        @type job: dict
+
+        @param client: connection of the client that sent job, watched so the
+                       solve stops if the client goes away
+        @type client: multiprocessing.connection.Connection
+
+        Returns the reply of solve_job, or one with timeout set if the
+        solve was stopped.
+        """
+        limits = [limit for limit in (job.get("time_limit"), self.max_time) if limit is not None]
+        limit = float(min(limits)) if limits else None
+        with self._solve_lock:
+            t0 = time.time()
+            if self._process is None:
+                self._start_solver()
+            try:
+                send_message(self._solver, job)
+                while True:
+                    wait = None if limit is None else max(0.0, t0 + limit - time.time())
+                    ready = connection.wait([self._solver] + ([client] if client is not None else []), wait)
+                    if self._solver in ready:
+                        return recv_message(self._solver)
+                    if ready:
+                        # a client only sends its next job after the reply, so this is its disconnection
+                        reason = "the client went away"
+                    else:
+                        reason = f"time limit of {limit:.1f} sec reached"
+                    break
+            except (EOFError, OSError):
+                self._stop_solver()
+                raise RuntimeError("Solver process died")
+            log.warning(f"Stopping solve after {time.time() - t0:.1f} sec, {reason}")
+            self._stop_solver()
+            self._start_solver()
+        return dict(solved=False, timeout=True, error=f"Solve stopped, {reason}", elapsed=time.time() - t0)
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    job = recv_message(conn)
+                except (EOFError, OSError):
+                    return
+                except ValueError as e:
+                    reply = dict(solved=False, error=f"Invalid job: {e}")
+                else:
+                    try:
+                        reply = self.solve(job, conn)
+                    except Exception as e:
+                        log.exception("Error solving job")
+                        reply = dict(solved=False, error=str(e))
+                try:
+                    send_message(conn, reply)
+                except OSError:
+                    return
+
+    def serve_forever(self):
+        if not is_network_address(self.address):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            # only our own user may connect
+            umask = os.umask(0o177)
+        try:
+            self._listener = Listener(self.address, authkey=self.authkey)
+        finally:
+            if not is_network_address(self.address):
+                os.umask(umask)
+        log.info(f"Solver listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = self._listener.accept()
+                except AuthenticationError:
+                    log.warning("Rejected a client with the wrong secret")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        with self._solve_lock:
+            self._stop_solver()
+
+
+class SolverClient:
+    """
+    Sends solve jobs to a running SolverServer.
+    Raises OSError if there is no server listening on address.
+
+    @param authkey: shared secret of the server, load_secret() by default
+    @type authkey: bytes
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        self.address = parse_address(address)
+        self.authkey = authkey if authkey is not None else load_secret()
+        if is_network_address(self.address) and not self.authkey:
+            raise ValueError(f"Solver server at {address} needs a secret, set {SECRET_ENV}")
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = Client(self.address, authkey=self.authkey)
+        return self._conn
+
+    def solve(self, stars, ra, dec, radius, scale_low=None, scale_high=None, timeout=None, cancel=None):
+        """
+        Returns the reply of the server, see SolverServer.solve. Raises
+        TimeoutError if there is none after timeout seconds, and
+        InterruptedError soon after cancel (a threading.Event) is set.
+        """
+        job = dict(
+            stars=[(float(x), float(y)) for x, y in stars],
+            ra=ra,
+            dec=dec,
+            radius=radius,
+            scale_low=scale_low,
+            scale_high=scale_high,
+            # the server stops the solve there too, instead of only us giving up
+            time_limit=timeout,
+        )
+        deadline = time.time() + timeout if timeout is not None else None
+        conn = self._connect()
+        try:
+            send_message(conn, job)
+            while True:
+                # short polls when there is a cancel event to watch
+                wait = 0.1 if cancel is not None else None
+                if deadline is not None:
+                    left = max(0.0, deadline - time.time())
+                    wait = left if wait is None else min(wait, left)
+                if conn.poll(wait):
+                    return recv_message(conn)
+                if cancel is not None and cancel.is_set():
+                    error = InterruptedError(f"Solve on solver server at {self.address} cancelled")
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    error = TimeoutError(f"No reply from solver server at {self.address} in {timeout:.1f} seconds")
+                    break
+        except (EOFError, OSError, ValueError):
+            self.close()
+            raise ConnectionError(f"Lost connection to solver server at {self.address}")
+        # a late reply to this job would be read as the reply to the next one
+        self.close()
+        raise error
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident astrometry.net solver")
+    parser.add_argument("--index-dir", required=True, help="Directory with index-*.fits files")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="Unix socket path or host:port")
+    parser.add_argument(
+        "--secret-file", help=f"File with the secret clients must know, {SECRET_ENV} by default. Needed for host:port"
+    )
+    parser.add_argument("--max-time", type=float, default=None, help="Seconds any solve may take")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    index_files = sorted(glob.glob(os.path.join(args.index_dir, "index-*.fits")))
+    SolverServer(
+        index_files, address=args.address, authkey=load_secret(args.secret_file), max_time=args.max_time
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+In-process star finder.
+
+Background estimation, thresholding, connected components and centroiding
+with numpy/scipy on an image already in memory. Replaces running SExtractor
+and reading its catalog back from disk when find_star_method="native".
+"""
+
+import logging
+
+import numpy as np
+from scipy import ndimage
+
+log = logging.getLogger(__name__)
+
+
+def estimate_background(data, box=64, nsigma=3.0, iterations=3):
+    """
+    @param data: image pixels
+    @type data: numpy.ndarray
+
+    @param box: mesh size, in pixels, of the background map
+    @type box: int
+
+    Returns (background, rms). background is a map with the same shape as
+    data built from sigma clipped medians on a box x box mesh, rms is the
+    global sigma clipped standard deviation.
+    """
+    ny, nx = data.shape
+    my, mx = max(ny // box, 1), max(nx // box, 1)
+    # trim so the image divides evenly in the mesh, edges reuse the last cell
+    cells = data[: my * (ny // my), : mx * (nx // mx)].reshape(my, ny // my, mx, nx // mx)
+    cells = cells.transpose(0, 2, 1, 3).reshape(my, mx, -1).astype(np.float64)
+
+    for _ in range(iterations):
+        med = np.nanmedian(cells, axis=2, keepdims=True)
+        std = np.nanstd(cells, axis=2, keepdims=True)
+        cells = np.where(np.abs(cells - med) > nsigma * std, np.nan, cells)
+    mesh = np.nanmedian(cells, axis=2)
+    rms = float(np.nanmedian(np.nanstd(cells, axis=2)))
+
+    # bilinear upsampling of the mesh to the image size
+    zoom = (ny / my, nx / mx)
+    background = ndimage.zoom(mesh, zoom, order=1, mode="nearest", grid_mode=True)
+    return background[:ny, :nx], rms
+
+
+def find_stars(data, threshold=3.0, min_area=18, box=64, max_stars=None, saturation=None):
+    """
+    @param data: image pixels
+    @type data: numpy.ndarray
+
+    @param threshold: detection threshold in units of background rms
+    @type threshold: float
+
+    @param min_area: minimum number of connected pixels above threshold
+    @type min_area: int
+
+    @param max_stars: return only the brightest max_stars
+    @type max_stars: int
+
+    @param saturation: pixel value at which the detector saturates, objects
+                       with a pixel at or above it are dropped. None keeps
+                       them.
+    @type saturation: float
+
+    Returns a numpy structured array with X, Y (FITS 1-based pixel
+    coordinates) and FLUX columns, brightest first.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    background, rms = estimate_background(data, box=box)
+    signal = data - background
+
+    mask = signal > threshold * rms
+    labels, nlabels = ndimage.label(mask)
+    stars = np.zeros(0, dtype=[("X", "f8"), ("Y", "f8"), ("FLUX", "f8")])
+    if nlabels == 0:
+        return stars
+
+    index = np.arange(1, nlabels + 1)
+    area = ndimage.sum_labels(mask, labels, index)
+    flux = ndimage.sum_labels(signal, labels, index)
+    # drop small detections and objects with negative flux
+    good = (area >= min_area) & (flux > 0)
+    if saturation is not None:
+        # a clipped core biases the centroid, drop the whole object
+        good &= ndimage.maximum(data, labels, index) < saturation
+    index = index[good]
+    if index.size == 0:
+        return stars
+
+    centroids = np.array(ndimage.center_of_mass(np.where(mask, signal, 0.0), labels, index))
+    stars = np.empty(index.size, dtype=stars.dtype)
+    stars["X"] = centroids[:, 1] + 1.0
+    stars["Y"] = centroids[:, 0] + 1.0
+    stars["FLUX"] = flux[good]
+
+    stars = stars[np.argsort(stars["FLUX"])[::-1]]
+    if max_stars is not None:
+        stars = stars[:max_stars]
+    log.debug(f"Found {stars.size} stars, background rms {rms:.2f}")
+    return stars
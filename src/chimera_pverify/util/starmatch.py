@@ -0,0 +1,134 @@
+"""
+Relative plate solution by matching star patterns between frames.
+
+The brightest stars of a new frame are matched to those of a previous,
+solved frame of the same field with an offset histogram: the most common
+displacement between all star pairs is the shift between the frames. A
+similarity transform (shift, rotation, scale) is fitted to the matched
+pairs and composed with the previous WCS, which gives the new frame's
+solution in a few tens of milliseconds instead of a blind solve.
+"""
+
+import logging
+
+import numpy as np
+from astropy.io import fits
+
+from chimera_pverify.util.imagecontext import WCSSolution
+from chimera_pverify.util.starfinder import find_stars
+
+log = logging.getLogger(__name__)
+
+# header keywords of distortion and of the linear transform, rewritten as CD
+_DROP_PREFIXES = ("A_", "B_", "AP_", "BP_", "PC", "CDELT", "CROTA", "CD1_", "CD2_")
+
+
+def bright_stars(data, n=60, max_size=512):
+    """
+    Returns the (x, y) FITS pixel positions of the n brightest stars (all
+    of them if n is None), brightest first, detected on a binned copy of
+    data no larger than max_size pixels.
+    """
+    binning = max(1, min(data.shape) // max_size)
+    ny, nx = (s // binning * binning for s in data.shape)
+    binned = np.asarray(data[:ny, :nx], dtype=np.float32).reshape(
+        ny // binning, binning, nx // binning, binning
+    ).sum(axis=(1, 3))
+    stars = find_stars(binned, min_area=max(18 // binning**2, 3), box=max(64 // binning, 16), max_stars=n)
+    # center of binned pixel i (1-based) is at binning * (i - 0.5) + 0.5
+    return np.column_stack((binning * (stars["X"] - 0.5) + 0.5, binning * (stars["Y"] - 0.5) + 0.5))
+
+
+def fit_similarity(src, dst):
+    """
+    Returns (A, t), the least squares similarity transform dst = A src + t
+    between (N, 2) arrays of positions.
+    """
+    zs = src[:, 0] + 1j * src[:, 1]
+    zd = dst[:, 0] + 1j * dst[:, 1]
+    ms, md = zs.mean(), zd.mean()
+    a = np.sum((zd - md) * np.conj(zs - ms)) / np.sum(np.abs(zs - ms) ** 2)
+    b = md - a * ms
+    return np.array([[a.real, -a.imag], [a.imag, a.real]]), np.array([b.real, b.imag])
+
+
+def match_stars(ref, new, rotations=(0.0,), bin_size=4.0, tolerance=2.0, min_matches=6, scale_tolerance=0.02):
+    """
+    @param ref, new: (N, 2) star positions of the reference and the new frame
+    @type ref, new: numpy.ndarray
+
+    @param rotations: rotations (degrees) of new relative to ref to try, e.g.
+                      when a rotator moved between the frames
+    @type rotations: sequence of float
+
+    @param tolerance: maximum residual, in pixels, of a matched pair
+    @type tolerance: float
+
+    Returns (A, t, nmatch, rms) with the transform ref = A new + t, or None
+    if the frames could not be matched.
+    """
+    if len(ref) < min_matches or len(new) < min_matches:
+        return None
+    best = None
+    for angle in rotations:
+        theta = np.radians(angle)
+        rot = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+        new_rot = new @ rot.T
+        # displacements of every (new, ref) pair, the true shift is the common one
+        diff = ref[None, :, :] - new_rot[:, None, :]
+        cells = np.floor(diff / bin_size).astype(np.int64)
+        keys = cells[..., 0] * 1000003 + cells[..., 1]
+        values, counts = np.unique(keys, return_counts=True)
+        peak = values[np.argmax(counts)]
+        shift = np.median(diff[keys == peak], axis=0)
+
+        # pair each new star with the reference star closest to the shift
+        distance = np.hypot(*(diff - shift).transpose(2, 0, 1))
+        j = np.argmin(distance, axis=1)
+        i = np.flatnonzero(distance[np.arange(len(new)), j] <= bin_size + tolerance)
+        j = j[i]
+        for _ in range(3):
+            if len(i) < min_matches:
+                break
+            a, t = fit_similarity(new[i], ref[j])
+            residual = np.hypot(*(ref[j] - (new[i] @ a.T + t)).T)
+            keep = residual <= tolerance
+            i, j = i[keep], j[keep]
+            if keep.all():
+                break
+        if len(i) < min_matches:
+            continue
+        a, t = fit_similarity(new[i], ref[j])
+        rms = float(np.sqrt(np.mean(np.sum((ref[j] - (new[i] @ a.T + t)) ** 2, axis=1))))
+        if best is None or len(i) > best[2]:
+            best = (a, t, len(i), rms)
+
+    if best is None:
+        return None
+    scale = np.sqrt(abs(np.linalg.det(best[0])))
+    if abs(scale - 1.0) > scale_tolerance:
+        log.debug(f"Star match rejected, scale {scale:.4f}")
+        return None
+    return best
+
+
+def relative_solution(solution, a, t):
+    """
+    @param solution: plate solution of the reference frame
+    @type solution: L{WCSSolution}
+
+    Returns the WCSSolution of a frame related to the reference one by
+    ref = a new + t (pixels). Distortion terms are dropped.
+    """
+    header = fits.Header()
+    for card in solution.header.cards:
+        if not card.keyword.startswith(_DROP_PREFIXES):
+            header.append(card)
+    for axis in ("CTYPE1", "CTYPE2"):
+        header[axis] = header[axis].replace("-SIP", "")
+    cd = solution.wcs.pixel_scale_matrix @ a
+    crpix = np.linalg.solve(a, np.array([header["CRPIX1"], header["CRPIX2"]]) - t)
+    header["CRPIX1"], header["CRPIX2"] = crpix
+    header["CD1_1"], header["CD1_2"] = cd[0]
+    header["CD2_1"], header["CD2_2"] = cd[1]
+    return WCSSolution(header)
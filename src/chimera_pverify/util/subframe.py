@@ -0,0 +1,116 @@
+"""
+Windowed and binned readouts for verification retries.
+
+After the first trial the pointing error is known, so a retry only needs a
+window around the detector center large enough to still contain the target
+after the offset, read out binned. Pixels of such a frame are mapped to
+physical (unbinned, full detector) pixels by phys = b * pix + offset, which
+keeps the field center and star matching between frames of different
+readouts in the same coordinates.
+"""
+
+import math
+
+import numpy as np
+
+from chimera_pverify.util.platescale import header_binning
+
+
+def window_string(x0, y0, width, height):
+    """
+    Returns the chimera image request window of width x height unbinned
+    pixels whose first pixel is (x0, y0), 0-based: "x1:x2,y1:y2", 1-based
+    and inclusive.
+    """
+    return f"{x0 + 1:d}:{x0 + width:d},{y0 + 1:d}:{y0 + height:d}"
+
+
+def parse_window(window):
+    """
+    Returns (x0, y0, width, height) of a "x1:x2,y1:y2" window.
+    """
+    xx, yy = (axis.strip().split(":") for axis in window.split(","))
+    x1, x2 = sorted(int(x) for x in xx)
+    y1, y2 = sorted(int(y) for y in yy)
+    return x1 - 1, y1 - 1, x2 - x1 + 1, y2 - y1 + 1
+
+
+def subframe_origin(header, default=(0, 0)):
+    """
+    Returns (x0, y0), the 0-based unbinned detector pixel where the frame
+    starts, from the IRAF LTV or the MaxIm XORGSUBF keywords of header, or
+    default if it has none.
+    """
+    if "LTV1" in header and "LTV2" in header:
+        # image = physical / binning + LTV, both 1-based pixel centers
+        binning = header_binning(header)
+        return tuple(int(round((binning - 1) / 2.0 - header[key] * binning)) for key in ("LTV1", "LTV2"))
+    if "XORGSUBF" in header and "YORGSUBF" in header:
+        return int(header["XORGSUBF"]), int(header["YORGSUBF"])
+    return default
+
+
+class PixelMap:
+    """
+    phys = binning * pix + offset, between the 1-based FITS pixels of a
+    frame and those of the unbinned full detector.
+    """
+
+    def __init__(self, binning=1, origin=(0, 0)):
+        self.binning = binning
+        self.origin = origin
+        # binned pixel i covers physical pixels origin + (i - 1) * b + 1 ... origin + i * b
+        self.offset = np.asarray(origin, dtype=float) - (binning - 1) / 2.0
+
+    @classmethod
+    def from_header(cls, header, default_binning=1, default_origin=(0, 0)):
+        """
+        Reads the readout from header, the defaults (e.g. what was asked for)
+        fill in what it does not say.
+        """
+        return cls(header_binning(header, default_binning), subframe_origin(header, default_origin))
+
+    def to_physical(self, xy):
+        return self.binning * np.asarray(xy, dtype=float) + self.offset
+
+    def to_pixel(self, xy):
+        return (np.asarray(xy, dtype=float) - self.offset) / self.binning
+
+
+def relative_transform(a, t, reference_map, new_map):
+    """
+    Turns ref_phys = a new_phys + t, a transform between physical pixels,
+    into the one between the frames' own pixels, ref_pix = A new_pix + T.
+    """
+    b_ref, b_new = reference_map.binning, new_map.binning
+    a_pix = a * b_new / b_ref
+    t_pix = (a @ new_map.offset + t - reference_map.offset) / b_ref
+    return a_pix, t_pix
+
+
+def retry_window(detector_size, error, scale, binning=1, margin=3.0, min_size=512, max_fraction=0.8):
+    """
+    @param detector_size: (width, height) of the detector in unbinned pixels
+    @type detector_size: tuple
+
+    @param error: pointing error in degrees
+    @param scale: unbinned plate scale in arcsec/pixel
+
+    @param margin: the window half-size in units of the pointing error
+    @param min_size: smallest window side in unbinned pixels, so it still has
+                     stars to solve
+
+    Returns (x0, y0, width, height), a window centered on the detector in
+    unbinned pixels, a multiple of binning on each side, or None when it
+    would be close to the full frame anyway.
+    """
+    width, height = detector_size
+    side = max(min_size, 2.0 * margin * error * 3600.0 / scale)
+    # multiple of 2 binned pixels, so the window stays centered
+    step = 2 * binning
+    side = int(math.ceil(round(side / step, 6)) * step)
+    if side >= max_fraction * min(width, height):
+        return None
+    x0 = (width - side) // 2 // binning * binning
+    y0 = (height - side) // 2 // binning * binning
+    return x0, y0, side, side
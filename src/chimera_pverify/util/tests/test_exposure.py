@@ -0,0 +1,51 @@
+from chimera_pverify.util.exposure import (
+    ExposureCalibration,
+    binning_from_request,
+    galactic_band,
+)
+
+
+class TestExposureCalibration(object):
+
+    def test_choose(self, tmp_path):
+        filename = str(tmp_path / "exptime.json")
+        calibration = ExposureCalibration(filename, min_stars=20, min_exptime=0.5, max_exptime=60.0)
+        assert calibration.choose("cam", "R", 1, band=3, default=10.0) == 10.0
+
+        # 80 stars in 10 s: 30 stars (1.5 x 20 needed) come in (30 / 80) ** (1 / 0.75) * 10 s
+        calibration.update("cam", "R", 1, 3, 10.0, 80)
+        assert calibration.choose("cam", "R", 1, band=3) == 2.7
+        # other bands fall back on what is known, other filters on the default
+        assert calibration.choose("cam", "R", 1, band=0) == 2.7
+        assert calibration.choose("cam", "V", 1, band=3, default=5.0) == 5.0
+
+        # persisted
+        assert ExposureCalibration(filename, min_stars=20).choose("cam", "R", 1, band=3) == 2.7
+
+    def test_needed(self):
+        calibration = ExposureCalibration(min_stars=20)
+        # an empty frame does not teach a rate
+        calibration.update("cam", "R", 1, 0, 5.0, 0)
+        assert calibration.rate("cam", "R", 1) is None
+        calibration.update("cam", "R", 1, 0, 5.0, 40, solved=False)
+        assert calibration.needed("cam", "R", 1) == 50
+        calibration.update("cam", "R", 1, 0, 5.0, 30, solved=True)
+        assert calibration.needed("cam", "R", 1) == 45
+        assert calibration.needed("cam", "R", 2) == 20
+
+    def test_escalate(self):
+        calibration = ExposureCalibration(min_stars=20, max_exptime=30.0)
+        assert calibration.escalate(2.0, 25, 20) == 4.0
+        # far too few stars: jump further than doubling
+        assert calibration.escalate(2.0, 10, 20) == 8.7
+        assert calibration.escalate(2.0, 3, 20) == 30.0
+        assert calibration.escalate(20.0, 0, 20) == 30.0
+        assert calibration.escalate(30.0, 5, 20) is None
+
+    def test_helpers(self):
+        assert binning_from_request({}) == 1
+        assert binning_from_request({"binning": "2x2"}) == 2
+        assert binning_from_request({"binning": 3}) == 3
+        # galactic center and north galactic pole
+        assert galactic_band(266.4, -28.9) == 0
+        assert galactic_band(192.86, 27.13) == 5
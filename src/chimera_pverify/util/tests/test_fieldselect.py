@@ -0,0 +1,60 @@
+import numpy as np
+
+from chimera_pverify.util.fieldselect import (
+    airmass,
+    alt_az,
+    field_star_counts,
+    hours_above,
+    select_fields,
+    slew_time,
+)
+
+LATITUDE = -29.0
+
+
+class TestFieldSelect(object):
+
+    def test_alt_az(self):
+        alt, az = alt_az(np.array([0.0, 0.0, 90.0]), np.array([LATITUDE, 0.0, 0.0]), LATITUDE)
+        assert abs(alt[0] - 90.0) < 1e-5
+        # on the meridian, north of zenith from the south
+        assert abs(alt[1] - 61.0) < 1e-9 and abs(az[1]) < 1e-6
+        # six hours west on the equator: setting due west
+        assert abs(alt[2]) < 1e-9 and abs(az[2] - 270.0) < 1e-6
+        assert abs(airmass(90.0) - 1.0) < 1e-3
+        assert abs(airmass(30.0) - 2.0) < 0.01
+
+    def test_hours_above(self):
+        hours = hours_above(np.array([0.0, 30.0, 170.0]), np.array([0.0, 0.0, 0.0]), LATITUDE, 30.0)
+        assert 3.0 < hours[0] < 4.5
+        assert hours[1] < hours[0]
+        assert hours[2] == 0.0
+        # never below 28 degrees
+        assert hours_above(90.0, -89.0, LATITUDE, 20.0) == 24.0
+
+    def test_slew_time(self):
+        assert slew_time(0.0, 0.0, 10.0, -20.0, rate=2.0, settle=5.0) == 15.0
+        assert slew_time(170.0, 0.0, -170.0, 0.0, rate=2.0, settle=0.0) == 10.0
+
+    def test_star_counts(self):
+        counts = field_star_counts(np.array([10.0, 10.1, 50.0]), np.array([0.0, 0.0, 0.0]), 0.2)
+        assert list(counts) == [2, 2, 1]
+
+    def test_select_fields(self):
+        lst = 100.0
+        ra = np.array([100.0, 60.0, 140.0, 300.0, 102.0, 175.0])
+        dec = np.array([-29.0, -29.0, -29.0, -29.0, -35.0, -29.0])
+        fields = select_fields(ra, dec, lst, LATITUDE, current=(103.0, -33.0), n=3, min_hours=1.0)
+        # below the horizon, or setting within the hour, left out
+        assert 3 not in fields["index"] and 5 not in fields["index"]
+        # the closest field to the mount wins over the one at zenith
+        assert fields["index"][0] == 4
+        assert np.all(np.diff(fields["score"]) >= 0)
+        assert len(fields) == 3
+
+        fields = select_fields(ra, dec, lst, LATITUDE, current=None, n=1)
+        assert fields["index"][0] == 0
+
+        # two candidates in the same field count once
+        fields = select_fields(ra, dec, lst, LATITUDE, current=(101.0, -29.0), n=2, min_separation=10.0)
+        assert list(fields["index"]) == [0, 2]
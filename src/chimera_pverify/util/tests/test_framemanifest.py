@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from chimera_pverify.util.framemanifest import FrameManifest, read_primary_header
+from chimera_pverify.util.pointingmodel import PointingData
+
+
+def write_frame(path, obj, data_shape=(64, 64), crval=True):
+    header = fits.Header()
+    header["OBJECT"] = obj
+    if crval:
+        header["CRVAL1"] = 150.0
+        header["CRVAL2"] = -30.0
+    header["DATE-OBS"] = "2025-12-08T03:00:00.000"
+    # long enough to need a second header block
+    for i in range(40):
+        header[f"KEY{i:d}"] = i
+    fits.PrimaryHDU(np.zeros(data_shape, dtype=np.float32), header=header).writeto(path, overwrite=True)
+    return str(path)
+
+
+class TestFrameManifest(object):
+
+    def test_read_primary_header(self, tmp_path):
+        f = write_frame(tmp_path / "a.fits", "SA 98_pmhelper")
+        header = read_primary_header(f)
+        assert header["OBJECT"] == "SA 98_pmhelper"
+        assert header["KEY39"] == 39
+
+    def test_resume(self, tmp_path):
+        a = write_frame(tmp_path / "a.fits", "f1_pmhelper")
+        b = write_frame(tmp_path / "b.fits", "f2_pmhelper")
+        write_frame(tmp_path / "c.fits", "science")
+        manifest_file = str(tmp_path / "manifest.json")
+        frames = sorted(tmp_path.glob("*.fits"))
+
+        manifest = FrameManifest(manifest_file)
+        assert manifest.scan(frames) == 3
+        assert manifest.select() == [a, b]
+        manifest.set_result(a, "ok", dict(star_ra=150.01, star_dec=-30.0, scope_ra=150.0, scope_dec=-30.0, lst=160.0))
+        manifest.set_result(b, "nosolution")
+        manifest.save()
+
+        # nothing changed: no file is read again, only the failed frame is left
+        manifest = FrameManifest(manifest_file)
+        assert manifest.scan(frames) == 0
+        assert manifest.select() == [b]
+        assert manifest.select(retry_failed=False) == []
+
+        # a modified frame is scanned and solved again
+        write_frame(tmp_path / "a.fits", "f1_pmhelper", data_shape=(32, 32))
+        os.utime(a, (0, 0))
+        assert manifest.scan(frames) == 1
+        assert manifest.select() == [a, b]
+
+    def test_select_needs_crval(self, tmp_path):
+        a = write_frame(tmp_path / "a.fits", "f1_pmhelper")
+        write_frame(tmp_path / "b.fits", "f2_pmhelper", crval=False)
+        manifest = FrameManifest(str(tmp_path / "manifest.json"))
+        manifest.scan(sorted(tmp_path.glob("*.fits")))
+        assert manifest.select() == [a]
+
+    def test_save_results(self, tmp_path):
+        a = write_frame(tmp_path / "a.fits", "f1_pmhelper")
+        manifest = FrameManifest(str(tmp_path / "manifest.json"))
+        manifest.scan([a])
+        manifest.set_result(a, "ok", dict(star_ra=150.01, star_dec=-30.0, scope_ra=150.0, scope_dec=-30.0, lst=160.0))
+        assert manifest.save_results(str(tmp_path / "results.npz")) == 1
+        with np.load(str(tmp_path / "results.npz")) as npz:
+            assert npz["star_ra"][0] == 150.01
+            assert npz["filename"][0] == a
+            assert npz["date_obs"][0] == "2025-12-08T03:00:00.000"
+        data = PointingData.from_pmodel_npz(str(tmp_path / "results.npz"), "-29:00:43")
+        assert abs(data.ha[0] - 9.99) < 1e-9
+        assert abs(data.dha[0] - 36.0) < 1e-6
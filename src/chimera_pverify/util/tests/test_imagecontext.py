@@ -0,0 +1,89 @@
+import io
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from chimera_pverify.util.imagecontext import ImageContext, WCSSolution, io_stats
+from chimera_pverify.util.transfer import TransferredImage
+
+
+def make_image(data):
+    header = fits.Header()
+    header["CRVAL1"] = 150.0
+    header["CRVAL2"] = -30.0
+    for i in range(40):
+        header[f"KEY{i:d}"] = i
+    buffer = io.BytesIO()
+    fits.PrimaryHDU(data, header=header).writeto(buffer)
+    return buffer.getvalue()
+
+
+class TestImageContext(object):
+
+    def test_from_file(self, tmp_path):
+        data = np.arange(64 * 32, dtype=np.uint16).reshape(32, 64)
+        path = tmp_path / "image.fits"
+        path.write_bytes(make_image(data))
+
+        opens = io_stats["opens"]
+        image = ImageContext.from_file(str(path))
+        assert io_stats["opens"] == opens
+        assert image["CRVAL1"] == 150.0 and "KEY39" in image
+        assert image["NAXIS1"] == 64
+        assert io_stats["opens"] == opens + 1
+        assert np.array_equal(image.data, data)
+        assert np.array_equal(image.data, data)
+        assert io_stats["opens"] == opens + 2
+
+    def test_from_transfer(self, tmp_path):
+        data = np.random.default_rng(0).normal(size=(16, 16)).astype(np.float32)
+        image = ImageContext.from_transfer(TransferredImage(bytearray(make_image(data)), "image.fits"))
+        assert image["CRVAL2"] == -30.0
+        assert np.array_equal(image.data, data)
+        path = image.path(str(tmp_path))
+        assert image.path() == path
+        assert np.array_equal(fits.getdata(path), data)
+
+    def test_cleanup(self, tmp_path):
+        buffer = bytearray(make_image(np.zeros((8, 8), dtype=np.uint16)))
+        # frames with the same name get their own files
+        image = ImageContext.from_transfer(TransferredImage(buffer, "image.fits"))
+        other = ImageContext.from_transfer(TransferredImage(buffer, "image.fits"))
+        path = image.path(str(tmp_path))
+        assert other.path(str(tmp_path)) != path
+        assert image.name == "image.fits"
+
+        wcs = path[:-len(".fits")] + "-out.wcs"
+        open(wcs, "w").close()
+        image.cleanup()
+        assert not any(os.path.exists(p) for p in (path, wcs))
+        assert os.path.exists(other.path())
+        # written again if needed after all
+        assert os.path.exists(image.path(str(tmp_path)))
+
+        # files that were there before are not removed
+        kept = tmp_path / "kept.fits"
+        kept.write_bytes(buffer)
+        ImageContext.from_file(str(kept)).cleanup()
+        assert kept.exists()
+
+
+class TestWCSSolution(object):
+
+    def test_world_at(self, tmp_path):
+        header = fits.Header()
+        header["CTYPE1"], header["CTYPE2"] = "RA---TAN", "DEC--TAN"
+        header["CRVAL1"], header["CRVAL2"] = 150.0, -30.0
+        header["CRPIX1"], header["CRPIX2"] = 100.0, 100.0
+        s = 1.0 / 3600.0
+        theta = np.radians(10.0)
+        header["CD1_1"], header["CD1_2"] = -s * np.cos(theta), s * np.sin(theta)
+        header["CD2_1"], header["CD2_2"] = s * np.sin(theta), s * np.cos(theta)
+        fits.PrimaryHDU(header=header).writeto(str(tmp_path / "image.wcs"))
+
+        solution = WCSSolution.from_file(str(tmp_path / "image.wcs"))
+        ra, dec = solution.world_at((100.0, 100.0))
+        assert abs(ra - 150.0) < 1e-9 and abs(dec + 30.0) < 1e-9
+        assert abs(solution.get_rotation() - 10.0) < 1e-6
+        assert "CD1_1" in solution
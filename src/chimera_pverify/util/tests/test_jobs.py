@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from chimera_pverify.util.jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    JobCancelledException,
+    JobQueue,
+    UnknownJobException,
+)
+
+
+def steps(job, n, gate=None):
+    for i in range(n):
+        if gate is not None:
+            gate.wait(5)
+        job.progress("step", i=i)
+    return n
+
+
+class TestJobQueue(object):
+
+    def test_result_and_events(self):
+        queue = JobQueue()
+        job = queue.submit("steps", steps, 3)
+        assert job.wait(5) == 3
+        assert queue.get(job.id).status()["state"] == DONE
+        assert [e["i"] for e in job.get_events()] == [0, 1, 2]
+        assert [e["index"] for e in job.get_events(since=2)] == [2]
+        queue.shutdown()
+
+    def test_failure(self):
+        def fail(job):
+            raise ValueError("no stars")
+
+        queue = JobQueue()
+        job = queue.submit("fail", fail)
+        with pytest.raises(ValueError):
+            job.wait(5)
+        status = job.status()
+        assert status["state"] == FAILED and "no stars" in status["error"]
+        with pytest.raises(UnknownJobException):
+            queue.get("fail-99")
+        queue.shutdown()
+
+    def test_cancel(self):
+        queue = JobQueue()
+        gate = threading.Event()
+        running = queue.submit("steps", steps, 3, gate)
+        queued = queue.submit("steps", steps, 3)
+        while running.state != RUNNING:
+            time.sleep(0.001)
+        assert queued.status()["state"] == QUEUED
+        # a queued job never starts, a running one stops at its next step
+        assert queued.cancel()
+        assert running.cancel()
+        gate.set()
+        with pytest.raises(JobCancelledException):
+            running.wait(5)
+        assert running.state == CANCELLED and len(running.events) == 1
+        with pytest.raises(JobCancelledException):
+            queued.wait(5)
+        assert queued.events == []
+        assert not running.cancel()
+        queue.shutdown()
+
+    def test_forget_finished(self):
+        queue = JobQueue(max_finished=2)
+        jobs = [queue.submit("steps", steps, 0) for _ in range(4)]
+        jobs[-1].wait(5)
+        queue.submit("steps", steps, 0).wait(5)
+        assert len(queue.jobs()) <= 3
+        assert queue.jobs()[-1].id == "steps-5"
+        queue.shutdown()
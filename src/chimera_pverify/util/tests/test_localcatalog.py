@@ -0,0 +1,40 @@
+import numpy as np
+
+from chimera_pverify.util.catalogs.localcatalog import LocalCatalog
+
+
+class TestLocalCatalog(object):
+
+    def make_catalog(self):
+        return LocalCatalog(
+            dict(
+                ra=np.array([10.0, 10.5, 12.0, 200.0, 359.9]),
+                dec=np.array([-20.0, -20.0, -21.0, 30.0, -20.0]),
+                vmag=np.array([9.0, 11.0, 8.0, 7.0, 10.0]),
+            )
+        )
+
+    def test_cone(self):
+        cat = self.make_catalog()
+        index, distance = cat.cone(10.0, -20.0, 3.0)
+        assert list(index) == [0, 1, 2]
+        assert np.all(np.diff(distance) >= 0)
+        assert distance[0] < 1e-6
+
+    def test_cone_wraps_ra(self):
+        index, _ = self.make_catalog().cone(0.5, -20.0, 1.0)
+        assert list(index) == [4]
+
+    def test_sort_limit_mask(self):
+        cat = self.make_catalog()
+        index, _ = cat.cone(10.0, -20.0, 3.0, sort_by="vmag", limit=2)
+        assert list(index) == [2, 0]
+        index, _ = cat.cone(10.0, -20.0, 3.0, mask=cat.columns["vmag"] < 10)
+        assert list(index) == [0, 2]
+
+    def test_save_load(self, tmp_path):
+        filename = str(tmp_path / "cat.npz")
+        self.make_catalog().save(filename)
+        cat = LocalCatalog.load(filename)
+        assert len(cat) == 5
+        assert list(cat.cone(200.0, 30.0, 0.1)[0]) == [3]
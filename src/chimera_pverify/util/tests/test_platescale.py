@@ -0,0 +1,39 @@
+import json
+
+from chimera_pverify.util.platescale import (
+    PlateScaleCalibration,
+    plate_scale,
+    scale_bounds,
+    scale_from_header,
+)
+
+
+class TestPlateScale(object):
+
+    def test_plate_scale(self):
+        # 9 um pixels on a 1000 mm focal length: 1.856 arcsec/pixel
+        assert abs(plate_scale(1000.0, 9.0) - 1.8564) < 1e-3
+        assert abs(plate_scale(1000.0, 9.0, binning=2) - 2 * plate_scale(1000.0, 9.0)) < 1e-9
+
+    def test_scale_from_header(self):
+        assert abs(scale_from_header({"CD1_1": -1e-4, "CD2_2": 1e-4, "CD1_2": 0.0, "CD2_1": 0.0}) - 0.36) < 1e-9
+        assert abs(scale_from_header({"CDELT1": -2e-4}) - 0.72) < 1e-9
+        assert scale_from_header({"PIXSCALE": 1.2}) == 1.2
+        assert scale_from_header({}) is None
+
+    def test_scale_bounds(self):
+        low, high = scale_bounds(2.0, 0.1)
+        assert abs(low - 1.8) < 1e-9 and abs(high - 2.2) < 1e-9
+
+    def test_calibration(self, tmp_path):
+        filename = str(tmp_path / "scales.json")
+        cal = PlateScaleCalibration(filename)
+        assert cal.get("/Camera/0", 1) is None
+        cal.update("/Camera/0", 1, 1.0)
+        cal.update("/Camera/0", 1, 2.0)
+        assert abs(cal.get("/Camera/0", 1) - 1.5) < 1e-9
+        assert cal.get("/Camera/0", 2) is None
+
+        # persisted across instances
+        assert abs(PlateScaleCalibration(filename).get("/Camera/0", 1) - 1.5) < 1e-9
+        assert "/Camera/0|1" in json.load(open(filename))
@@ -0,0 +1,57 @@
+import numpy as np
+
+from chimera_pverify.util.fieldselect import alt_az
+from chimera_pverify.util.pmodelplan import (
+    hadec,
+    order_points,
+    plan_run,
+    sky_grid,
+    slew_matrix,
+    tour_cost,
+)
+
+LATITUDE = -29.0
+
+
+class TestPModelPlan(object):
+
+    def test_sky_grid(self):
+        for kind in ("equal_area", "altaz"):
+            alt, az = sky_grid(40, min_alt=30.0, max_alt=85.0, kind=kind)
+            assert len(alt) == len(az) == 40
+            assert alt.min() >= 30.0 and alt.max() <= 85.0
+            assert np.all((az >= 0.0) & (az < 360.0))
+        # equal area: as many points below 48.6 degrees (half the solid angle) as above
+        alt, _ = sky_grid(100, min_alt=30.0, max_alt=90.0)
+        assert np.sum(alt < np.degrees(np.arcsin(0.75))) == 50
+        # altaz: the zenith ring keeps its point when the floor overshoots n
+        alt, _ = sky_grid(11, min_alt=30.0, max_alt=90.0, kind="altaz")
+        assert len(alt) == 11 and alt.max() == 90.0
+
+    def test_hadec(self):
+        alt, az = sky_grid(20)
+        ha, dec = hadec(alt, az, LATITUDE)
+        alt2, az2 = alt_az(ha, dec, LATITUDE)
+        assert np.allclose(alt, alt2) and np.allclose(az, az2)
+
+    def test_order_points(self):
+        # points on a line visited out of order
+        x = np.array([0.0, 5.0, 1.0, 4.0, 2.0, 3.0])
+        cost = np.abs(x[:, None] - x[None, :])
+        order = order_points(cost)
+        assert tour_cost(cost, order) == 5.0
+        assert sorted(order) == list(range(6))
+        # from a fixed start, the start is not visited again
+        order = order_points(cost, start=1)
+        assert list(order) == [3, 5, 4, 2, 0]
+
+    def test_plan_run(self):
+        points, total = plan_run(60, 100.0, LATITUDE, current=(100.0, -29.0))
+        assert len(points) == 60
+        ha, dec = hadec(points["alt"], points["az"], LATITUDE)
+        assert np.allclose(ha, points["ha"]) and np.allclose(dec, points["dec"])
+        # much better than visiting the points in a random order
+        cost = slew_matrix(np.append(points["ha"], 0.0), np.append(points["dec"], -29.0))
+        random = tour_cost(cost, np.random.default_rng(0).permutation(60), start=60)
+        assert total == tour_cost(cost, np.arange(60), start=60)
+        assert total < 0.5 * random
@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+import pytest
+
+from chimera_pverify.util.pointingmodel import PointingData, fit_model, sexagesimal
+
+LATITUDE = -29.0
+
+
+def make_data(n=2000, true=None, noise=1.0, outliers=0, seed=0):
+    rng = np.random.default_rng(seed)
+    ha = rng.uniform(-80, 80, n)
+    dec = rng.uniform(-85, 20, n)
+    data = PointingData(ha, dec, np.zeros(n), np.zeros(n), LATITUDE)
+    model = fit_model(data, list(true), clip=None)
+    model.coefficients = np.array(list(true.values()))
+    dha, ddec = model.predict(ha, dec)
+    dha += rng.normal(0, noise, n) / np.cos(np.radians(dec))
+    ddec += rng.normal(0, noise, n)
+    dha[:outliers] += 300.0
+    return PointingData(ha, dec, dha, ddec, LATITUDE)
+
+
+class TestPointingModel(object):
+
+    true = dict(IH=-120.0, ID=45.0, CH=30.0, NP=-8.0, MA=60.0, ME=-25.0, TF=12.0)
+
+    def test_recovers_terms(self):
+        model = fit_model(make_data(true=self.true), self.true.keys())
+        for term, value in self.true.items():
+            assert abs(model[term] - value) < 5 * model.sigmas[model.terms.index(term)] + 0.5
+        assert abs(model.stats()["sky_rms"] - np.sqrt(2)) < 0.2
+
+    def test_rejects_outliers(self):
+        data = make_data(true=self.true, outliers=50)
+        model = fit_model(data, self.true.keys())
+        assert not model.mask[:50].any()
+        assert model.stats()["sky_rms"] < 2.0
+        assert fit_model(data, self.true.keys(), clip=None).stats()["sky_rms"] > 10.0
+
+    def test_polar_axis_signs(self):
+        # written out from the TPOINT definitions, not from TERMS
+        ma, me = 60.0, -25.0
+        rng = np.random.default_rng(1)
+        ha, dec = rng.uniform(-80, 80, 200), rng.uniform(-85, 20, 200)
+        h, d = np.radians(ha), np.radians(dec)
+        dha = -ma * np.cos(h) * np.tan(d) + me * np.sin(h) * np.tan(d)
+        ddec = ma * np.sin(h) + me * np.cos(h)
+        model = fit_model(PointingData(ha, dec, dha, ddec, LATITUDE), ["MA", "ME"], clip=None)
+        assert abs(model["MA"] - ma) < 1e-6
+        assert abs(model["ME"] - me) < 1e-6
+
+    def test_fast(self):
+        data = make_data(n=5000, true=self.true)
+        t0 = time.perf_counter()
+        for terms in (["IH", "ID"], ["IH", "ID", "CH", "NP"], list(self.true) + ["FO", "DAF", "HCES", "HCEC"]):
+            fit_model(data, terms)
+        assert time.perf_counter() - t0 < 1.0
+
+    def test_unknown_term(self):
+        with pytest.raises(ValueError):
+            fit_model(make_data(n=10, true=dict(IH=1.0)), ["XX"])
+
+    def test_pmodel_csv(self, tmp_path):
+        filename = tmp_path / "results.csv"
+        filename.write_text(
+            "Star RA,Star Dec,Scope RA,Scope Dec,LST,Date_Obs,Filename\n"
+            "10:00:00.00,-30:00:00.00,10:00:01.00,-30:00:10.00,11:00:00.000,2025-12-08 03:00:00,a.fits\n"
+            "# b.fits: No solution found\n"
+        )
+        data = PointingData.from_pmodel_csv(str(filename), "-29:00:43")
+        assert len(data) == 1
+        assert abs(data.ha[0] - 15.0) < 1e-9
+        assert abs(data.dha[0] + 15.0) < 1e-6
+        assert abs(data.ddec[0] + 10.0) < 1e-6
+        assert abs(data.latitude - sexagesimal("-29:00:43")) < 1e-12
+        assert abs(sexagesimal("-00:30:00") + 0.5) < 1e-12
@@ -0,0 +1,69 @@
+import numpy as np
+
+from chimera_pverify.util.querycache import QueryCache
+
+
+def make_table(ra, dec):
+    table = np.zeros(len(ra), dtype=[("ID", "U8"), ("Vmag", "f4"), ("_r", "f8"), ("_RAJ2000", "f8"), ("_DEJ2000", "f8")])
+    table["ID"] = [f"star{i}" for i in range(len(ra))]
+    table["Vmag"] = np.arange(len(ra))[::-1]
+    table["_RAJ2000"] = ra
+    table["_DEJ2000"] = dec
+    return table
+
+
+ARGS = {"-source": "II/183A/", "-out": "ID,Vmag,_r", "-sort": "_r", "Vmag": "<10"}
+
+
+class TestQueryCache(object):
+
+    def test_exact(self, tmp_path):
+        cache = QueryCache(str(tmp_path))
+        assert cache.lookup(ARGS, 10.0, -20.0, 5.0, 100) is None
+        table = make_table([10.0, 11.0], [-20.0, -20.0])
+        cache.store(ARGS, 10.0, -20.0, 5.0, 100, table)
+        assert list(cache.lookup(ARGS, 10.0, -20.0, 5.0, 100)["ID"]) == ["star0", "star1"]
+        # other constraints are a different query
+        assert cache.lookup(dict(ARGS, Vmag="<12"), 10.0, -20.0, 5.0, 100) is None
+
+    def test_contained_cone(self, tmp_path):
+        cache = QueryCache(str(tmp_path))
+        cache.store(ARGS, 10.0, -20.0, 10.0, 100, make_table([10.0, 12.0, 15.0, 10.0], [-20.0, -20.0, -20.0, -25.0]))
+
+        res = cache.lookup(ARGS, 12.0, -20.0, 2.5, 100)
+        assert list(res["ID"]) == ["star1", "star0"]
+        assert abs(res["_r"][0]) < 1e-9
+        assert abs(res["_r"][1] - 60 * 1.879) < 0.1  # arcmin
+        # does not fit inside the cached cone
+        assert cache.lookup(ARGS, 12.0, -20.0, 9.0, 100) is None
+
+    def test_truncated_not_reused(self, tmp_path):
+        cache = QueryCache(str(tmp_path))
+        cache.store(ARGS, 10.0, -20.0, 10.0, 2, make_table([10.0, 12.0], [-20.0, -20.0]))
+        assert cache.lookup(ARGS, 10.0, -20.0, 1.0, 2) is None
+
+    def test_persistent_and_lru(self, tmp_path):
+        cache = QueryCache(str(tmp_path), max_entries=2)
+        for ra in (10.0, 20.0, 30.0):
+            cache.store(ARGS, ra, 0.0, 1.0, 100, make_table([ra], [0.0]))
+        cache = QueryCache(str(tmp_path))
+        assert cache.lookup(ARGS, 10.0, 0.0, 1.0, 100) is None
+        assert len(cache.lookup(ARGS, 30.0, 0.0, 1.0, 100)) == 1
+
+    def test_lookup_saves_use(self, tmp_path):
+        cache = QueryCache(str(tmp_path), max_entries=2)
+        for ra in (10.0, 20.0):
+            cache.store(ARGS, ra, 0.0, 1.0, 100, make_table([ra], [0.0]))
+        # the oldest entry is used, then the cache restarts
+        cache.lookup(ARGS, 10.0, 0.0, 1.0, 100)
+        cache = QueryCache(str(tmp_path), max_entries=2)
+        cache.store(ARGS, 30.0, 0.0, 1.0, 100, make_table([30.0], [0.0]))
+        assert cache.lookup(ARGS, 10.0, 0.0, 1.0, 100) is not None
+        assert cache.lookup(ARGS, 20.0, 0.0, 1.0, 100) is None
+
+    def test_ttl(self, tmp_path):
+        cache = QueryCache(str(tmp_path), ttl=-1)
+        cache.store(ARGS, 10.0, 0.0, 1.0, 100, make_table([10.0], [0.0]))
+        assert cache.lookup(ARGS, 10.0, 0.0, 1.0, 100) is None
+        # expired entries are gone from the index on disk too
+        assert QueryCache(str(tmp_path))._index == {}
@@ -0,0 +1,45 @@
+import os
+import time
+
+import numpy as np
+
+from chimera_pverify.util.solutioncache import SolutionCache
+
+
+class TestSolutionCache(object):
+
+    def test_key(self):
+        data = np.arange(100, dtype=np.float32).reshape(10, 10)
+        key = SolutionCache.key(data, ra=10.0, dec=-20.0)
+        assert key == SolutionCache.key(data.copy(), dec=-20.0, ra=10.0)
+        assert key != SolutionCache.key(data, ra=10.0, dec=-20.1)
+        data[0, 0] = 1
+        assert key != SolutionCache.key(data, ra=10.0, dec=-20.0)
+
+    def test_get_put(self, tmp_path):
+        cache = SolutionCache(str(tmp_path / "cache"))
+        wcs = tmp_path / "image-out.wcs"
+        wcs.write_text("SIMPLE  = T")
+        out = tmp_path / "other-out.wcs"
+
+        assert cache.get("abc", str(out)) is None
+        cache.put("abc", str(wcs), nmatch=12)
+        assert cache.get("abc", str(out))["nmatch"] == 12
+        assert out.read_text() == "SIMPLE  = T"
+
+    def test_evict(self, tmp_path):
+        cache = SolutionCache(str(tmp_path / "cache"), max_bytes=10**6, max_age=3600)
+        wcs = tmp_path / "image-out.wcs"
+        wcs.write_text("x" * 1000)
+        for key in ("a", "b", "c"):
+            cache.put(key, str(wcs))
+        # age "a" past max_age
+        old = time.time() - 7200
+        for path in cache._paths("a"):
+            os.utime(path, (old, old))
+        # make "b" the least recently used of the rest
+        for path in cache._paths("b"):
+            os.utime(path, (old + 3700, old + 3700))
+        cache.max_bytes = 1500
+        cache.evict()
+        assert sorted(k for k, _, _ in cache.entries()) == ["c"]
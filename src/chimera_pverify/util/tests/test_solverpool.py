@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from chimera_pverify.util.solverpool import SolverPool, reset_shared_pool, shared_pool
+
+
+@pytest.fixture
+def fresh_shared_pool():
+    reset_shared_pool()
+    yield
+    reset_shared_pool()
+
+
+class TestSolverPool(object):
+
+    def test_bounded(self):
+        pool = SolverPool(max_workers=2)
+        lock = threading.Lock()
+        running = [0, 0]  # now, max
+
+        def solve(i):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return i
+
+        futures = [pool.submit(f"tel{i % 3:d}", solve, i) for i in range(12)]
+        assert [f.result(5) for f in futures] == list(range(12))
+        assert running[1] == 2
+        pool.shutdown()
+
+    def test_fair_and_priority(self):
+        pool = SolverPool(max_workers=1)
+        gate = threading.Event()
+        order = []
+        # holds the only worker until everything is queued
+        blocker = pool.submit("tel0", gate.wait, 5)
+        while not pool.stats().get("tel0", {}).get("running"):
+            time.sleep(0.001)
+        futures = [pool.submit("tel1", order.append, f"tel1-{i:d}") for i in range(3)]
+        futures += [pool.submit("tel2", order.append, f"tel2-{i:d}") for i in range(2)]
+        futures.append(pool.submit("tel3", order.append, "tel3-urgent", priority=-1))
+        assert pool.stats()["tel1"] == dict(queued=3, running=0)
+        gate.set()
+        blocker.result(5)
+        for f in futures:
+            f.result(5)
+        assert order == ["tel3-urgent", "tel1-0", "tel2-0", "tel1-1", "tel2-1", "tel1-2"]
+        pool.shutdown()
+
+    def test_errors_and_shutdown(self):
+        pool = SolverPool(max_workers=1)
+        with pytest.raises(ZeroDivisionError):
+            pool.submit("tel0", lambda: 1 / 0).result(5)
+        pool.shutdown()
+        with pytest.raises(RuntimeError):
+            pool.submit("tel0", int)
+
+    def test_shared(self, fresh_shared_pool):
+        pool = shared_pool(1)
+        assert shared_pool(1) is pool
+        assert shared_pool(3) is pool and pool.max_workers == 3
+        reset_shared_pool()
+        assert pool.closed
+        assert shared_pool(1).max_workers == 1
@@ -0,0 +1,61 @@
+import threading
+from multiprocessing.connection import Listener
+
+import pytest
+
+from chimera_pverify.util.solverserver import (
+    SECRET_ENV,
+    SolverClient,
+    SolverServer,
+    load_secret,
+    recv_message,
+    send_message,
+)
+
+
+def serve_one(listener, reply=True):
+    with listener.accept() as conn:
+        job = recv_message(conn)
+        if reply:
+            send_message(conn, dict(solved=False, error=f"{len(job['stars']):d} stars"))
+        else:
+            # keeps the client waiting until it gives up
+            conn.poll(5)
+
+
+class TestSolverServer(object):
+
+    def test_secret(self, tmp_path, monkeypatch):
+        monkeypatch.delenv(SECRET_ENV, raising=False)
+        assert load_secret() is None
+        with pytest.raises(ValueError):
+            SolverServer([], address="localhost:7100")
+        with pytest.raises(ValueError):
+            SolverClient("localhost:7100")
+
+        (tmp_path / "secret").write_bytes(b"s3cret\n")
+        assert load_secret(str(tmp_path / "secret")) == b"s3cret"
+        monkeypatch.setenv(SECRET_ENV, "other")
+        assert SolverClient("localhost:7100").authkey == b"other"
+
+    def test_json_roundtrip(self, tmp_path):
+        address = str(tmp_path / "solver.sock")
+        with Listener(address) as listener:
+            thread = threading.Thread(target=serve_one, args=(listener,))
+            thread.start()
+            client = SolverClient(address)
+            reply = client.solve([(1.0, 2.0), (3.0, 4.0)], 10.0, 20.0, 1.0, timeout=5)
+            client.close()
+            thread.join()
+        assert reply == dict(solved=False, error="2 stars")
+
+    def test_timeout(self, tmp_path):
+        address = str(tmp_path / "solver.sock")
+        with Listener(address) as listener:
+            thread = threading.Thread(target=serve_one, args=(listener, False))
+            thread.start()
+            client = SolverClient(address)
+            with pytest.raises(TimeoutError):
+                client.solve([(1.0, 2.0)], 10.0, 20.0, 1.0, timeout=0.1)
+            assert client._conn is None
+            thread.join()
@@ -0,0 +1,36 @@
+import numpy as np
+
+from chimera_pverify.util.starfinder import find_stars
+
+
+class TestStarFinder(object):
+
+    def make_field(self, positions, shape=(256, 300), sky=100.0, noise=5.0, sigma=2.0):
+        rng = np.random.default_rng(42)
+        yy, xx = np.mgrid[: shape[0], : shape[1]]
+        data = sky + rng.normal(0, noise, shape)
+        for x, y, peak in positions:
+            data += peak * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma**2))
+        return data
+
+    def test_find_stars(self):
+        positions = [(50.3, 40.7, 2000.0), (200.0, 150.2, 1000.0), (120.6, 220.1, 500.0)]
+        stars = find_stars(self.make_field(positions), min_area=5)
+
+        assert len(stars) == 3
+        # brightest first, FITS 1-based coordinates
+        for star, (x, y, _) in zip(stars, positions):
+            assert abs(star["X"] - (x + 1)) < 0.1
+            assert abs(star["Y"] - (y + 1)) < 0.1
+        assert np.all(np.diff(stars["FLUX"]) < 0)
+
+    def test_empty_field(self):
+        stars = find_stars(self.make_field([]), min_area=5)
+        assert len(stars) == 0
+
+    def test_saturation(self):
+        data = np.minimum(self.make_field([(50.3, 40.7, 5000.0), (200.0, 150.2, 1000.0)]), 3000.0)
+        assert len(find_stars(data, min_area=5)) == 2
+        stars = find_stars(data, min_area=5, saturation=3000.0)
+        assert len(stars) == 1
+        assert abs(stars[0]["X"] - 201.0) < 0.1
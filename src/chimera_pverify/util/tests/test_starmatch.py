@@ -0,0 +1,67 @@
+import numpy as np
+from astropy.io import fits
+
+from chimera_pverify.util.imagecontext import WCSSolution
+from chimera_pverify.util.starmatch import bright_stars, match_stars, relative_solution
+
+
+def transform(xy, angle, shift, center=(1024.0, 1024.0)):
+    theta = np.radians(angle)
+    rot = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    return (xy - center) @ rot.T + center + shift
+
+
+def reference_solution():
+    header = fits.Header()
+    header["CTYPE1"], header["CTYPE2"] = "RA---TAN", "DEC--TAN"
+    header["CRVAL1"], header["CRVAL2"] = 150.0, -30.0
+    header["CRPIX1"], header["CRPIX2"] = 1024.5, 1024.5
+    header["CD1_1"], header["CD1_2"] = -1.0 / 3600.0, 0.0
+    header["CD2_1"], header["CD2_2"] = 0.0, 1.0 / 3600.0
+    return WCSSolution(header)
+
+
+class TestStarMatch(object):
+
+    def test_match_shift_and_rotation(self):
+        rng = np.random.default_rng(1)
+        ref = rng.uniform(0, 2048, (60, 2))
+        # the new frame sees the sky shifted by (-40, 25) px and rotated by 1 degree,
+        # with a few stars lost and a few new ones
+        new = transform(ref, 1.0, (-40.0, 25.0))[5:] + rng.normal(0, 0.2, (55, 2))
+        new = np.vstack((new, rng.uniform(0, 2048, (5, 2))))
+
+        match = match_stars(ref, new, rotations=(0.0, -1.0, 1.0))
+        assert match is not None
+        a, t, nmatch, rms = match
+        assert nmatch >= 50
+        assert rms < 0.5
+        back = new[:55] @ a.T + t
+        assert np.max(np.hypot(*(back - ref[5:]).T)) < 1.0
+
+    def test_no_match(self):
+        rng = np.random.default_rng(2)
+        assert match_stars(rng.uniform(0, 2048, (60, 2)), rng.uniform(0, 2048, (60, 2))) is None
+        assert match_stars(np.zeros((3, 2)), np.zeros((3, 2))) is None
+
+    def test_relative_solution(self):
+        solution = reference_solution()
+        # new pixel p sees what the reference saw at p + (10, -20)
+        a, t = np.eye(2), np.array([10.0, -20.0])
+        new_solution = relative_solution(solution, a, t)
+        assert np.allclose(new_solution.world_at((500.0, 600.0)), solution.world_at((510.0, 580.0)))
+        assert abs(new_solution.get_rotation() - solution.get_rotation()) < 1e-9
+
+    def test_bright_stars(self):
+        rng = np.random.default_rng(3)
+        data = rng.normal(1000.0, 10.0, (1024, 1024)).astype(np.float32)
+        yy, xx = np.mgrid[-8:9, -8:9]
+        positions = [(200.3, 300.7), (700.0, 512.2), (810.6, 90.1)]
+        for k, (x, y) in enumerate(positions):
+            ix, iy = int(x), int(y)
+            stamp = 5000.0 * (k + 1) * np.exp(-((xx + ix - x) ** 2 + (yy + iy - y) ** 2) / (2 * 1.5**2))
+            data[iy - 8 : iy + 9, ix - 8 : ix + 9] += stamp
+        stars = bright_stars(data, n=3, max_size=512)
+        # brightest first, FITS 1-based
+        for (x, y), (sx, sy) in zip(positions[::-1], stars):
+            assert abs(sx - (x + 1)) < 0.5 and abs(sy - (y + 1)) < 0.5
@@ -0,0 +1,57 @@
+import numpy as np
+
+from chimera_pverify.util.starmatch import match_stars
+from chimera_pverify.util.subframe import (
+    PixelMap,
+    parse_window,
+    relative_transform,
+    retry_window,
+    subframe_origin,
+    window_string,
+)
+
+
+class TestSubframe(object):
+
+    def test_window_string(self):
+        assert window_string(512, 256, 1024, 512) == "513:1536,257:768"
+        assert parse_window("513:1536,257:768") == (512, 256, 1024, 512)
+
+    def test_pixel_map(self):
+        # binned pixel 1 of a window starting at detector pixel 100 (0-based) covers 101 and 102
+        pixel_map = PixelMap(2, (100, 40))
+        assert np.allclose(pixel_map.to_physical((1.0, 1.0)), (101.5, 41.5))
+        assert np.allclose(pixel_map.to_pixel(pixel_map.to_physical((7.0, 9.0))), (7.0, 9.0))
+        # IRAF keywords of the same readout
+        header = {"XBINNING": 2, "LTV1": -49.75, "LTV2": -19.75}
+        assert subframe_origin(header) == (100, 40)
+        assert PixelMap.from_header(header).binning == 2
+        # nothing in the header: what was asked for
+        assert PixelMap.from_header({}, 2, (100, 40)).origin == (100, 40)
+        assert subframe_origin({"XORGSUBF": 10, "YORGSUBF": 20}) == (10, 20)
+
+    def test_retry_window(self):
+        # 0.01 deg error at 0.5 "/px, margin 3: 432 px side, raised to the 512 px minimum
+        assert retry_window((4096, 4096), 0.01, 0.5, binning=2) == (1792, 1792, 512, 512)
+        x0, y0, width, height = retry_window((4096, 4096), 0.025, 0.5, binning=2)
+        assert width == height == 1080 and x0 + width / 2 == 2048
+        assert width % 4 == 0
+        # would be about the full frame
+        assert retry_window((4096, 4096), 0.2, 0.5) is None
+
+    def test_match_across_readouts(self):
+        rng = np.random.default_rng(4)
+        # stars in detector pixels, the second frame shifted by (12, -7)
+        sky = rng.uniform(1, 4096, (400, 2))
+        ref_map = PixelMap(1, (0, 0))
+        new_map = PixelMap(2, (1536, 1536))
+        ref = ref_map.to_pixel(sky)
+        new_physical = sky - (12.0, -7.0)
+        inside = np.all((new_physical > 1536) & (new_physical < 2560), axis=1)
+        new = new_map.to_pixel(new_physical[inside])
+
+        a, t, nmatch, rms = match_stars(ref_map.to_physical(ref), new_map.to_physical(new))
+        assert nmatch == inside.sum()
+        a, t = relative_transform(a, t, ref_map, new_map)
+        # ref_pix = A new_pix + t
+        assert np.allclose(new @ a.T + t, ref[inside], atol=1e-6)
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from chimera_pverify.util.timing import TimingRecorder, VerificationTimer
+
+
+class TestTiming(object):
+
+    def make_timer(self, success=True):
+        timer = VerificationTimer()
+        with timer.span("filter_change"):
+            pass
+        for _ in range(2):
+            timer.new_trial()
+            timer.add("exposure", 0.0, 1.5)
+            with timer.span("solve", method="sex"):
+                pass
+        timer.finish(success)
+        return timer
+
+    def test_timer(self):
+        verification = self.make_timer().to_dict()
+        assert verification["success"] is True
+        assert [s["phase"] for s in verification["spans"]] == ["filter_change"]
+        assert len(verification["trials"]) == 2
+        assert [s["phase"] for s in verification["trials"][1]["spans"]] == ["exposure", "solve"]
+        assert verification["trials"][0]["spans"][1]["method"] == "sex"
+
+    def test_unknown_phase(self):
+        timer = VerificationTimer()
+        with pytest.raises(ValueError):
+            timer.add("exposre", 0.0, 1.0)
+        with pytest.raises(ValueError):
+            with timer.span("slove"):
+                pass
+        assert timer.to_dict()["spans"] == []
+
+    def test_recorder_exports(self, tmp_path):
+        jsonl = tmp_path / "timings.jsonl"
+        prom = tmp_path / "pverify.prom"
+        recorder = TimingRecorder(maxlen=1, jsonl_filename=str(jsonl), prometheus_filename=str(prom),
+                                  labels=dict(telescope="/Telescope/0"))
+        recorder.record(self.make_timer())
+        recorder.record(self.make_timer(success=False))
+
+        assert len(recorder.last()) == 1
+        lines = jsonl.read_text().splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])["telescope"] == "/Telescope/0"
+
+        text = prom.read_text()
+        assert 'pverify_phase_seconds_sum{phase="exposure",telescope="/Telescope/0"} 6.000000' in text
+        assert 'pverify_phase_seconds_count{phase="exposure",telescope="/Telescope/0"} 4' in text
+        assert 'pverify_verifications_total{success="false",telescope="/Telescope/0"} 1' in text
+        assert 'pverify_last_verification_trials{telescope="/Telescope/0"} 2' in text
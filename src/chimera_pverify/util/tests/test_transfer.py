@@ -0,0 +1,51 @@
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from astropy.io import fits
+
+from chimera_pverify.util.transfer import fetch_image
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class TestTransfer(object):
+
+    def setup_method(self):
+        self.server = None
+
+    def teardown_method(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def serve(self, directory):
+        handler = functools.partial(QuietHandler, directory=str(directory))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def test_fetch_float(self, tmp_path):
+        data = np.arange(60 * 50, dtype=np.float32).reshape(50, 60)
+        fits.PrimaryHDU(data, header=fits.Header({"CRVAL1": 10.0})).writeto(tmp_path / "img.fits")
+        image = fetch_image(self.serve(tmp_path) + "/img.fits", chunk_size=1000)
+
+        assert image.header["CRVAL1"] == 10.0
+        assert image.throughput > 0
+        raw = image.raw_data()
+        assert np.shares_memory(raw, np.frombuffer(image.buffer, dtype=np.uint8))
+        assert np.array_equal(image.data(), data)
+
+    def test_fetch_uint16(self, tmp_path):
+        data = np.array([[0, 1, 32768, 65535]], dtype=np.uint16)
+        fits.PrimaryHDU(data).writeto(tmp_path / "img.fits")
+        image = fetch_image(self.serve(tmp_path) + "/img.fits")
+        assert np.array_equal(image.data(), data)
+
+        (tmp_path / "scratch").mkdir()
+        path = image.to_file(str(tmp_path / "scratch"))
+        assert np.array_equal(fits.getdata(path), data)
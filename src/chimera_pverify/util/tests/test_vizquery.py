@@ -1,5 +1,10 @@
+import gzip
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 from chimera.util.position import Position
-from chimera_pverify.util.vizquery import VizQuery
+from chimera_pverify.util.vizquery import VizierClient, VizQuery
 
 
 class TestVizQuery (object):
@@ -17,3 +22,68 @@ class TestVizQuery (object):
             for k,v in list(obj.items()):
                 print((k, v))
             print()
+
+
+class VizierStandIn(BaseHTTPRequestHandler):
+    """
+    Answers every query with a VOTable holding the query's -source and -c.rd
+    """
+
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_POST(self):
+        VizierStandIn.connections.add(self.client_address)
+        args = urllib.parse.parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        body = (
+            '<VOTABLE xmlns="http://www.ivoa.net/xml/VOTable/v1.3"><RESOURCE><TABLE>'
+            '<FIELD name="source" datatype="char" arraysize="*"/><FIELD name="r" datatype="double"/>'
+            f'<DATA><TABLEDATA><TR><TD>{args["-source"][0]}</TD><TD>{args["-c.rd"][0]}</TD></TR>'
+            "</TABLEDATA></DATA></TABLE></RESOURCE></VOTABLE>"
+        ).encode()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestVizierClient (object):
+
+    def setup_method(self):
+        VizierStandIn.connections = set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), VizierStandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = VizierClient("127.0.0.1", self.server.server_address[1], timeout=5)
+        VizQuery.set_client(self.client)
+
+    def teardown_method(self):
+        VizQuery.set_client(None)
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_query(self, radius):
+        x = VizQuery()
+        x.use_cat("II/183A/")
+        x.use_columns("source,r", sort_by="r")
+        x.use_target("14:00:00 -22:00:00", radius=radius)
+        return x
+
+    def test_find_keepalive(self):
+        assert self.make_query(10).find(limit=5) == [{"source": "II/183A/", "r": 10.0}]
+        assert self.make_query(20).find(limit=5) == [{"source": "II/183A/", "r": 20.0}]
+        # both queries went through the same pooled connection
+        assert len(VizierStandIn.connections) == 1
+
+    def test_find_many(self):
+        results = VizQuery.find_many([self.make_query(r) for r in range(1, 21)], max_workers=4)
+        assert [res[0]["r"] for res in results] == list(range(1, 21))
+        assert len(VizierStandIn.connections) <= 8
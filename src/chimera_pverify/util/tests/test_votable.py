@@ -0,0 +1,86 @@
+import base64
+import io
+import struct
+
+import numpy as np
+
+from chimera_pverify.util import votable
+from chimera_pverify.util.votable import parse_table
+
+HEADER = """<?xml version="1.0"?>
+<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">
+<RESOURCE><TABLE>
+<FIELD name="ID" datatype="char" arraysize="*"/>
+<FIELD name="RAJ2000" datatype="double"/>
+<FIELD name="Vmag" datatype="float"/>
+<FIELD name="N" datatype="int"><VALUES null="-1"/></FIELD>
+<DATA>
+"""
+FOOTER = """</DATA></TABLE></RESOURCE></VOTABLE>"""
+
+
+def tabledata(rows):
+    body = "".join(
+        "<TR>" + "".join(f"<TD>{v}</TD>" for v in row) + "</TR>\n" for row in rows
+    )
+    return HEADER + "<TABLEDATA>\n" + body + "</TABLEDATA>" + FOOTER
+
+
+def binary(rows, binary2=False):
+    data = b""
+    for row in rows:
+        if binary2:
+            mask = 0
+            for i, v in enumerate(row):
+                if v is None:
+                    mask |= 0x80 >> i
+            data += bytes([mask])
+        name, ra, vmag, n = row
+        name = (name or "").encode()
+        data += struct.pack(">i", len(name)) + name
+        data += struct.pack(">dfi", ra or 0.0, vmag or 0.0, n if n is not None else -1)
+    tag = "BINARY2" if binary2 else "BINARY"
+    stream = base64.b64encode(data).decode()
+    return HEADER + f"<{tag}><STREAM encoding='base64'>{stream}</STREAM></{tag}>" + FOOTER
+
+
+class TestParseTable(object):
+
+    def test_tabledata(self):
+        table = parse_table(io.StringIO(tabledata([("SA 92 245", 13.5, 9.25, 3), ("SA 104 334", 180.25, "", -1)])))
+        assert table.dtype.names == ("ID", "RAJ2000", "Vmag", "N")
+        assert list(table["ID"]) == ["SA 92 245", "SA 104 334"]
+        assert table["RAJ2000"].dtype == np.float64
+        assert table["Vmag"][0] == np.float32(9.25)
+        assert np.isnan(table["Vmag"][1])
+        assert list(table["N"]) == [3, None]
+
+    def test_tabledata_chunks(self, monkeypatch):
+        monkeypatch.setattr(votable, "CHUNK_ROWS", 3)
+        rows = [("x" * (i + 1), float(i), float(i), i) for i in range(10)]
+        table = parse_table(io.StringIO(tabledata(rows)))
+        assert len(table) == 10
+        assert table["ID"][9] == "x" * 10
+        assert list(table["N"]) == list(range(10))
+
+    def test_binary(self):
+        rows = [("SA 92 245", 13.5, 9.25, 3), ("SA 104 334", 180.25, 10.5, 7)]
+        table = parse_table(io.BytesIO(binary(rows).encode()))
+        assert list(table["ID"]) == ["SA 92 245", "SA 104 334"]
+        assert list(table["RAJ2000"]) == [13.5, 180.25]
+        assert list(table["N"]) == [3, 7]
+        assert table["N"].dtype.kind == "i"
+
+    def test_binary_null_sentinel(self):
+        rows = [("A", 1.0, 9.0, 3), ("B", 2.0, 10.5, -1)]
+        table = parse_table(io.BytesIO(binary(rows).encode()))
+        assert list(table["N"]) == [3, None]
+        assert table.tolist()[1] == ("B", 2.0, 10.5, None)
+
+    def test_binary2_nulls(self):
+        rows = [("A", 1.0, None, 3), ("B", 2.0, 10.5, None)]
+        cols = parse_table(io.BytesIO(binary(rows, binary2=True).encode()), columnar=True)
+        assert np.isnan(cols["Vmag"][0])
+        assert cols["Vmag"][1] == 10.5
+        assert list(cols["ID"]) == ["A", "B"]
+        assert list(cols["N"]) == [3, None]
@@ -0,0 +1,36 @@
+import os
+
+from chimera_pverify.util.workspace import SolveWorkspace
+
+
+class TestSolveWorkspace(object):
+
+    def test_unique_and_removed(self, tmp_path):
+        with SolveWorkspace(str(tmp_path)) as a, SolveWorkspace(str(tmp_path)) as b:
+            assert a.directory != b.directory
+            # the same output name in both never collides
+            for workspace, text in ((a, "a"), (b, "b")):
+                with open(workspace.path("image-out.solved"), "w") as f:
+                    f.write(text)
+            assert open(a.path("image-out.solved")).read() == "a"
+            directories = (a.directory, b.directory)
+        assert not any(os.path.exists(d) for d in directories)
+
+    def test_collect(self, tmp_path):
+        with SolveWorkspace(str(tmp_path)) as workspace:
+            with open(workspace.path("image-out.wcs"), "w") as f:
+                f.write("wcs")
+            destination = workspace.collect("image-out.wcs", str(tmp_path / "image-out.wcs"))
+        assert open(destination).read() == "wcs"
+        assert os.listdir(tmp_path) == ["image-out.wcs"]
+
+    def test_solve_field_args(self, tmp_path):
+        with SolveWorkspace(str(tmp_path), keep=True) as workspace:
+            args = workspace.solve_field_args("image-out", corr=False).split()
+        assert os.path.isdir(workspace.directory)
+        assert args[args.index("--dir") + 1] == workspace.directory
+        assert args[args.index("--new-fits") + 1] == "none"
+        assert args[args.index("--corr") + 1] == "none"
+        assert "--corr" not in workspace.solve_field_args("image-out")
+        workspace.cleanup()
+        assert workspace.directory is None
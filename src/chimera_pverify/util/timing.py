@@ -0,0 +1,190 @@
+"""
+Per-phase timing of pointing verifications.
+
+A VerificationTimer records one span per phase (filter change, exposure,
+readout, download, source extraction, solve or star match, WCS read, mount
+offset, rotator move) of each trial of a verification. TimingRecorder keeps the
+last verifications and exports them as JSON lines or in the Prometheus
+text format.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+PHASES = (
+    "filter_change",
+    "exposure",
+    "readout",
+    "download",
+    "star_count",
+    "source_extraction",
+    "solve",
+    "star_match",
+    "wcs_read",
+    "mount_offset",
+    "rotator_move",
+)
+
+
+class NullTimer:
+    """
+    Timer that records nothing, used when no timer is given.
+    """
+
+    def span(self, phase, **attrs):
+        return nullcontext()
+
+    def add(self, phase, start, duration, **attrs):
+        pass
+
+
+class VerificationTimer:
+    """
+    Spans of a single verification, grouped by trial. Spans recorded before
+    the first trial (e.g. the filter change) belong to the verification.
+    Spans can be recorded from several threads. Phases must be in PHASES,
+    so a typo does not go unnoticed as a phase of its own in the exports.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.end = None
+        self.success = None
+        self.spans = []
+        self.trials = []
+        self._lock = threading.Lock()
+
+    def new_trial(self):
+        with self._lock:
+            self.trials.append([])
+
+    @staticmethod
+    def _check(phase):
+        if phase not in PHASES:
+            raise ValueError(f"Unknown verification phase {phase}, known phases: {' '.join(PHASES)}")
+
+    def add(self, phase, start, duration, **attrs):
+        self._check(phase)
+        span = dict(phase=phase, start=start, duration=duration, **attrs)
+        with self._lock:
+            (self.trials[-1] if self.trials else self.spans).append(span)
+
+    @contextmanager
+    def span(self, phase, **attrs):
+        # before the block runs, not on the way out of it
+        self._check(phase)
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, t0, time.time() - t0, **attrs)
+
+    def finish(self, success):
+        self.end = time.time()
+        self.success = success
+
+    def to_dict(self):
+        with self._lock:
+            return dict(
+                start=self.start,
+                duration=(self.end or time.time()) - self.start,
+                success=self.success,
+                spans=list(self.spans),
+                trials=[dict(trial=i, spans=list(spans)) for i, spans in enumerate(self.trials)],
+            )
+
+
+class TimingRecorder:
+    """
+    Keeps the last verifications and exports them.
+
+    @param maxlen: number of verifications to keep
+    @type maxlen: int
+
+    @param jsonl_filename: each finished verification is appended to this file
+    @type jsonl_filename: str
+
+    @param prometheus_filename: rewritten with the phase totals after each
+                                verification, e.g. for node_exporter's textfile collector
+    @type prometheus_filename: str
+    """
+
+    def __init__(self, maxlen=100, jsonl_filename=None, prometheus_filename=None, labels=None):
+        self.verifications = deque(maxlen=maxlen)
+        self.jsonl_filename = os.path.expanduser(jsonl_filename) if jsonl_filename else None
+        self.prometheus_filename = os.path.expanduser(prometheus_filename) if prometheus_filename else None
+        self.labels = labels or {}
+        self._lock = threading.Lock()
+        # totals since start, for the Prometheus counters
+        self._phase_sum = {}
+        self._phase_count = {}
+        self._verifications = {True: 0, False: 0}
+        self._last = None
+
+    def record(self, timer):
+        verification = timer.to_dict()
+        with self._lock:
+            self.verifications.append(verification)
+            self._last = verification
+            self._verifications[bool(verification["success"])] += 1
+            spans = verification["spans"] + [s for t in verification["trials"] for s in t["spans"]]
+            for span in spans:
+                phase = span["phase"]
+                self._phase_sum[phase] = self._phase_sum.get(phase, 0.0) + span["duration"]
+                self._phase_count[phase] = self._phase_count.get(phase, 0) + 1
+        if self.jsonl_filename is not None:
+            with open(self.jsonl_filename, "a") as f:
+                f.write(json.dumps(dict(verification, **self.labels)) + "\n")
+        if self.prometheus_filename is not None:
+            self._write_atomic(self.prometheus_filename, self.prometheus())
+
+    def last(self, n=None):
+        with self._lock:
+            verifications = list(self.verifications)
+        return verifications if n is None else verifications[-n:]
+
+    def _label_str(self, **extra):
+        labels = dict(self.labels, **extra)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}" if labels else ""
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            lines = [
+                "# HELP pverify_phase_seconds Time spent in each verification phase.",
+                "# TYPE pverify_phase_seconds summary",
+            ]
+            for phase in sorted(self._phase_sum):
+                lines.append(f"pverify_phase_seconds_sum{self._label_str(phase=phase)} {self._phase_sum[phase]:.6f}")
+                lines.append(f"pverify_phase_seconds_count{self._label_str(phase=phase)} {self._phase_count[phase]:d}")
+            lines += [
+                "# HELP pverify_verifications_total Finished verifications.",
+                "# TYPE pverify_verifications_total counter",
+            ]
+            for success, count in sorted(self._verifications.items()):
+                lines.append(f"pverify_verifications_total{self._label_str(success=str(success).lower())} {count:d}")
+            if self._last is not None:
+                lines += [
+                    "# HELP pverify_last_verification_seconds Duration of the last verification.",
+                    "# TYPE pverify_last_verification_seconds gauge",
+                    f"pverify_last_verification_seconds{self._label_str()} {self._last['duration']:.6f}",
+                    "# HELP pverify_last_verification_trials Trials of the last verification.",
+                    "# TYPE pverify_last_verification_trials gauge",
+                    f"pverify_last_verification_trials{self._label_str()} {len(self._last['trials']):d}",
+                ]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_atomic(filename, text):
+        directory = os.path.dirname(filename) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp, filename)
@@ -0,0 +1,151 @@
+"""
+Streaming transfer of FITS images from remote camera servers.
+
+The image is read over HTTP in chunks straight into one memory buffer. The
+pixels are exposed as a numpy view of that buffer, and the image is written
+to a tmpfs scratch file only when an external tool needs a path.
+"""
+
+import logging
+import os
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+from astropy.io import fits
+
+log = logging.getLogger(__name__)
+
+FITS_BLOCK = 2880
+BITPIX_DTYPES = {8: ">u1", 16: ">i2", 32: ">i4", 64: ">i8", -32: ">f4", -64: ">f8"}
+
+
+def scratch_directory():
+    """
+    Returns a directory in memory (tmpfs) for scratch files, when available.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def scale_pixels(raw, header):
+    """
+    Returns raw FITS pixels with BZERO/BSCALE of header applied. Only copies
+    when the scaling is not trivial.
+    """
+    bscale = header.get("BSCALE", 1)
+    bzero = header.get("BZERO", 0)
+    if bscale == 1 and bzero == 0:
+        return raw
+    if bscale == 1 and raw.dtype.kind == "i" and bzero == 2 ** (8 * raw.dtype.itemsize - 1):
+        # unsigned integers stored as signed, flipping the sign bit is exact
+        unsigned = raw.view(raw.dtype.str.replace("i", "u"))
+        return unsigned ^ unsigned.dtype.type(bzero)
+    return raw * bscale + bzero
+
+
+class TransferredImage:
+    """
+    A FITS image held in memory.
+
+    @param buffer: the FITS file contents
+    @type buffer: bytearray
+    """
+
+    def __init__(self, buffer, filename, elapsed=None):
+        self.buffer = buffer
+        self.filename = filename
+        self.elapsed = elapsed
+        self.header, self.data_offset = self._parse_header()
+
+    def _parse_header(self):
+        view = memoryview(self.buffer)
+        offset = 0
+        while offset < len(view):
+            block = bytes(view[offset : offset + FITS_BLOCK])
+            offset += FITS_BLOCK
+            for card in range(0, FITS_BLOCK, 80):
+                if block[card : card + 8] == b"END     ":
+                    header = fits.Header.fromstring(bytes(view[:offset]).decode("ascii"))
+                    return header, offset
+        raise ValueError(f"No END card in FITS header of {self.filename}")
+
+    @property
+    def throughput(self):
+        """
+        Transfer rate in MB/s.
+        """
+        if not self.elapsed:
+            return None
+        return len(self.buffer) / self.elapsed / 1e6
+
+    def raw_data(self):
+        """
+        Returns a zero-copy, read-only numpy view of the primary HDU pixels,
+        in the file's (big-endian) byte order and without BZERO/BSCALE.
+        """
+        h = self.header
+        shape = tuple(h[f"NAXIS{i}"] for i in range(h["NAXIS"], 0, -1))
+        dtype = np.dtype(BITPIX_DTYPES[h["BITPIX"]])
+        count = int(np.prod(shape)) if shape else 0
+        view = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.data_offset)
+        view.flags.writeable = False
+        return view.reshape(shape)
+
+    def data(self):
+        """
+        Returns the pixels with BZERO/BSCALE applied. Only copies when the
+        scaling is not trivial.
+        """
+        return scale_pixels(self.raw_data(), self.header)
+
+    def to_file(self, directory=None):
+        """
+        Writes the image to a new file in directory (tmpfs by default) and
+        returns its path. The name is unique, so frames with the same name
+        never overwrite each other.
+        """
+        root, ext = os.path.splitext(os.path.basename(self.filename))
+        fd, path = tempfile.mkstemp(prefix=root + "-", suffix=ext or ".fits", dir=directory or scratch_directory())
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.buffer)
+        return path
+
+
+def fetch_image(url, filename=None, chunk_size=1 << 20, timeout=60.0):
+    """
+    @param url: http address of the FITS image
+    @type url: str
+
+    @param filename: name to give the image, defaults to the url basename
+    @type filename: str
+
+    Streams url into memory and returns a TransferredImage.
+    """
+    filename = filename or os.path.basename(urllib.parse.urlparse(url).path)
+    t0 = time.time()
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        length = resp.getheader("Content-Length")
+        if length is not None:
+            # read straight into the final buffer, no intermediate copies
+            buffer = bytearray(int(length))
+            view = memoryview(buffer)
+            offset = 0
+            while offset < len(buffer):
+                n = resp.readinto(view[offset : offset + chunk_size])
+                if not n:
+                    raise OSError(f"Transfer of {url} ended after {offset} of {len(buffer)} bytes")
+                offset += n
+        else:
+            buffer = bytearray()
+            while True:
+                chunk = resp.read(chunk_size)
+                if not chunk:
+                    break
+                buffer += chunk
+    image = TransferredImage(buffer, filename, elapsed=time.time() - t0)
+    log.debug(f"Transferred {len(buffer) / 1e6:.1f} MB from {url} in {image.elapsed:.2f} s ({image.throughput:.1f} MB/s)")
+    return image
@@ -1,8 +1,100 @@
-from http.client import HTTPConnection
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+import gzip
+import io
+import logging
+import queue
+import threading
 import urllib.request, urllib.parse, urllib.error
 
-from chimera_pverify.util.votable import VOTable
+from chimera.core.exceptions import ChimeraException
+
+from chimera_pverify.util.querycache import DEC_COLUMN, RA_COLUMN
+from chimera_pverify.util.votable import parse_table
+
+log = logging.getLogger(__name__)
+
+
+class VizQueryException(ChimeraException):
+    pass
+
+
+class VizierClient:
+
+    """
+    HTTP client for Vizier's votable service.
+    Keeps a pool of keep-alive connections, so it can be shared by
+    concurrent queries, asks for gzip responses and parses them in memory.
+    """
+
+    def __init__(self, host="webviz.u-strasbg.fr", port=None, path="/viz-bin/votable",
+                 timeout=30.0, pool_size=8):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _get_connection(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _put_connection(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _post(self, body):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
+        # a pooled connection may have been closed by the server meanwhile,
+        # so retry once on a fresh one
+        for attempt in range(2):
+            conn = self._get_connection()
+            try:
+                conn.request("POST", self.path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (HTTPException, ConnectionError) as e:
+                conn.close()
+                if attempt == 1:
+                    raise VizQueryException(f"Error querying Vizier at {self.host}: {e}")
+                continue
+            except OSError as e:  # timeouts, DNS errors
+                conn.close()
+                raise VizQueryException(f"Error querying Vizier at {self.host}: {e}")
+            if resp.will_close:
+                conn.close()
+            else:
+                self._put_connection(conn)
+            if resp.status != 200:
+                raise VizQueryException(f"Vizier returned HTTP {resp.status} {resp.reason}")
+            if resp.getheader("Content-Encoding", "") == "gzip":
+                data = gzip.decompress(data)
+            return data
+
+    def query(self, args):
+        """
+        @param args: Vizier query arguments
+        @type args: dict
+
+        Returns the result table as a numpy structured array.
+        """
+        data = self._post(urllib.parse.urlencode(args))
+        return parse_table(io.BytesIO(data))
 
 
 class VizQuery(object):
@@ -12,10 +104,53 @@ class VizQuery(object):
     within a given radius or box of the zenith
     """
 
+    # shared by all queries, so connections are reused
+    _client = None
+    _client_lock = threading.Lock()
+    # QueryCache shared by all queries, None disables caching
+    _cache = None
+
+    @classmethod
+    def get_client(cls):
+        with VizQuery._client_lock:
+            if VizQuery._client is None:
+                VizQuery._client = VizierClient()
+            return VizQuery._client
+
+    @classmethod
+    def set_client(cls, client):
+        """
+        Replaces the client used by all queries (e.g. to change the Vizier
+        mirror or timeout).
+        """
+        VizQuery._client = client
+
+    @classmethod
+    def set_cache(cls, cache):
+        """
+        @param cache: cache used by all queries, None to disable it
+        @type cache: L{QueryCache}
+        """
+        VizQuery._cache = cache
+
+    @staticmethod
+    def find_many(queries, limit=9999, max_workers=8):
+        """
+        @param queries: VizQuery (or subclass) objects with their targets set
+        @type queries: list
+
+        Runs the queries concurrently and returns their results in the same
+        order as queries.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda q: q.find(limit=limit), queries))
+
     def __init__(self):
         self.args = {}
         self.args["-mime"] = "xml"
         self.columns = None
+        self.center = None
+        self.radius = None
 
     def use_cat(self, cat_name):
         """
@@ -78,6 +213,8 @@ class VizQuery(object):
         @type box: int | tuple
         """
 
+        self.center = center
+        self.radius = radius
         self.args["-c"] = str(center)
         self.args["-c.eq"] = "J2000"
 
@@ -102,29 +239,32 @@ class VizQuery(object):
 
         self.args["-out.max"] = limit
 
-        results = tempfile.NamedTemporaryFile(mode='w+',
-                                              prefix="chimera.vizquery",
-                                              dir=tempfile.gettempdir())
-
-        # query the catalog in Vizier's database
-        conn = HTTPConnection("webviz.u-strasbg.fr")
-
-        s = urllib.parse.urlencode(self.args)
-
-        conn.request("POST", "/viz-bin/votable", s)
-        resp = conn.getresponse()
-        ret = resp.read()
-
-        f = open(results.name, "wb")
-        f.write(ret)
-        f.close()
-
-        obj = []
-
-        votable = VOTable(results.name)
-
-        for linha in votable.getDataRows():
-            v = [c.getContent() for c in linha.getNodeList()]
-            obj.append(dict(list(zip(self.columns, v))))
-
-        return obj
+        target = self._cone_target()
+        if VizQuery._cache is None or target is None:
+            table = self.get_client().query(self.args)
+            return [dict(zip(self.columns, row)) for row in table.tolist()]
+
+        ra, dec, radius = target
+        table = VizQuery._cache.lookup(self.args, ra, dec, radius, limit)
+        if table is None:
+            # positions in degrees let the cache answer smaller cones later
+            args = dict(self.args)
+            args["-out.add"] = f"{RA_COLUMN},{DEC_COLUMN}"
+            table = self.get_client().query(args)
+            VizQuery._cache.store(self.args, ra, dec, radius, limit, table)
+
+        added = [c for c in (RA_COLUMN, DEC_COLUMN) if c not in (self.columns or [])]
+        names = [n for n in table.dtype.names if n not in added]
+        return [dict(zip(self.columns, row)) for row in table[names].tolist()]
+
+    def _cone_target(self):
+        """
+        Returns (ra, dec, radius) in degrees of a cone search, None for box
+        searches or targets without a position.
+        """
+        if "-c.rd" not in self.args:
+            return None
+        try:
+            return self.center.ra.deg, self.center.dec.deg, float(self.args["-c.rd"])
+        except (AttributeError, TypeError, ValueError):
+            return None
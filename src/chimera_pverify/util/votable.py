@@ -2,13 +2,20 @@
     Created: 2005-05-31 by Shui Hung Kwok, shkwok at computer.org
 
     See http://www.ivoa.net/Documents/latest/VOT.html .
+
+    parse_table is a streaming alternative to the VOTable DOM that reads
+    the first TABLE directly into a numpy structured array.
 """
 
+import base64
+import struct
 import sys
-from types import *
+import xml.etree.ElementTree as ElementTree
 import xml.sax
 import xml.sax.handler
 
+import numpy as np
+
 
 class VONode(object):
 
@@ -23,11 +30,11 @@ class VONode(object):
 
     def addNode(self, node):
         self._nodeList.append(node)
-        if not isinstance(node, (StringType, UnicodeType)):
+        if not isinstance(node, str):
             name = node.getNamePart()
             try:
                 val = self.__dict__[name]
-                if isinstance(val, ListType):
+                if isinstance(val, list):
                     val.append(node)
                 else:
                     self.__dict__[name] = [val, node]
@@ -196,7 +203,7 @@ class VONode(object):
 
         last = 0
         for n in self._nodeList:
-            if isinstance(n, (StringType, UnicodeType)):
+            if isinstance(n, str):
                 if last == 2:
                     func(f"\n{prefix}")
                 func(f"{n}")
@@ -396,6 +403,305 @@ class VOTable(object):
             if node2:
                 self.root.VOTABLE.RESOURCE.TABLE.DATA.TABLEDATA = node2
 
+# VOTable datatype -> (numpy type, size in bytes of the BINARY serialization)
+DATATYPES = {
+    "boolean": ("?", 1),
+    "bit": ("u1", 1),
+    "unsignedByte": ("u1", 1),
+    "short": ("i2", 2),
+    "int": ("i4", 4),
+    "long": ("i8", 8),
+    "char": ("U", 1),
+    "unicodeChar": ("U", 2),
+    "float": ("f4", 4),
+    "double": ("f8", 8),
+    "floatComplex": ("c8", 8),
+    "doubleComplex": ("c16", 16),
+}
+
+# rows converted to numpy arrays at a time while reading TABLEDATA
+CHUNK_ROWS = 4096
+
+
+class VOField:
+
+    """
+    Description of a table column, from its FIELD element.
+    """
+
+    def __init__(self, attrib, name):
+        self.name = name
+        self.datatype = attrib.get("datatype", "char")
+        if self.datatype not in DATATYPES:
+            raise ValueError(f"Unknown VOTable datatype {self.datatype}")
+        self.null = None
+        arraysize = attrib.get("arraysize")
+        self.variable = arraysize is not None and arraysize.endswith("*")
+        if arraysize is None or arraysize == "*":
+            self.count = 1
+        else:
+            # multidimensional arrays are read flat
+            self.count = int(np.prod([int(n) for n in arraysize.rstrip("*").split("x") if n]))
+        self.is_string = self.datatype in ("char", "unicodeChar")
+
+    def dtype(self, width=1):
+        """
+        Returns the numpy dtype of this column. width is the string length
+        for char columns.
+        """
+        kind = DATATYPES[self.datatype][0]
+        if self.is_string:
+            return np.dtype(f"U{max(width, 1)}")
+        if self.variable:
+            return np.dtype(object)
+        if self.count > 1:
+            return np.dtype((kind, (self.count,)))
+        return np.dtype(kind)
+
+    def missing(self):
+        """
+        Returns the value used for null cells.
+        """
+        if self.is_string:
+            return ""
+        kind = np.dtype(DATATYPES[self.datatype][0]).kind
+        if kind in "fc":
+            return np.nan
+        if self.null is not None:
+            return int(self.null)
+        return 0 if kind in "iu" else False
+
+    def from_text(self, text):
+        """
+        Converts a TABLEDATA cell.
+        """
+        if text is None or text == "" or (self.null is not None and text == self.null):
+            return self.missing()
+        if self.is_string:
+            return text
+        if self.datatype == "boolean":
+            return text.strip()[:1] in ("T", "t", "1")
+        if self.count > 1 or self.variable:
+            return np.array(text.split(), dtype=DATATYPES[self.datatype][0])
+        if self.datatype in ("floatComplex", "doubleComplex"):
+            re, im = text.split()
+            return complex(float(re), float(im))
+        return text
+
+
+def _tag(elem):
+    return elem.tag.rsplit("}", 1)[-1]
+
+
+def _unique_name(names, name):
+    candidate = name
+    n = 1
+    while candidate in names:
+        candidate = f"{name}_{n}"
+        n += 1
+    names.add(candidate)
+    return candidate
+
+
+def _columns_to_array(fields, columns, nrows):
+    widths = [max((len(v) for v in col), default=1) if f.is_string else 1 for f, col in zip(fields, columns)]
+    dtype = np.dtype([(f.name, f.dtype(w)) for f, w in zip(fields, widths)])
+    table = np.empty(nrows, dtype=dtype)
+    for f, col in zip(fields, columns):
+        if f.variable and not f.is_string:
+            column = np.empty(nrows, dtype=object)
+            column[:] = col
+            table[f.name] = column
+        else:
+            table[f.name] = col
+    return table
+
+
+def _parse_tabledata(fields, context):
+    chunks = []
+    columns = [[] for _ in fields]
+    nrows = 0
+    cells = []
+    for event, elem in context:
+        tag = _tag(elem)
+        if event != "end":
+            continue
+        if tag == "TD":
+            cells.append(elem.text)
+        elif tag == "TR":
+            for i, f in enumerate(fields):
+                columns[i].append(f.from_text(cells[i] if i < len(cells) else None))
+            cells = []
+            nrows += 1
+            elem.clear()
+            if nrows == CHUNK_ROWS:
+                chunks.append(_columns_to_array(fields, columns, nrows))
+                columns = [[] for _ in fields]
+                nrows = 0
+        elif tag == "TABLEDATA":
+            break
+    chunks.append(_columns_to_array(fields, columns, nrows))
+    if len(chunks) == 1:
+        return _null_integers(fields, chunks[0])
+    # string widths may differ between chunks, promote to a common dtype
+    dtype = np.result_type(*[c.dtype for c in chunks]) if len({c.dtype for c in chunks}) > 1 else chunks[0].dtype
+    return _null_integers(fields, np.concatenate([c.astype(dtype) for c in chunks]))
+
+
+def _null_integers(fields, table, nulls=None):
+    """
+    Turns the null cells of scalar integer columns into None. Those can't
+    be NaN, so a column with nulls becomes an object column. nulls is the
+    BINARY2 per-cell null mask, if any.
+    """
+    masks = {}
+    for i, f in enumerate(fields):
+        column = table[f.name]
+        if f.variable or column.dtype.kind not in "iu" or column.ndim != 1:
+            continue
+        mask = np.zeros(len(table), dtype=bool)
+        if f.null is not None:
+            mask |= column == int(f.null)
+        if nulls is not None:
+            mask |= nulls[:, i]
+        if mask.any():
+            masks[f.name] = mask
+    if not masks:
+        return table
+    dtype = [(name, object if name in masks else table.dtype[name]) for name in table.dtype.names]
+    result = np.empty(len(table), dtype=dtype)
+    for name in table.dtype.names:
+        if name in masks:
+            column = table[name].astype(object)
+            column[masks[name]] = None
+            result[name] = column
+        else:
+            result[name] = table[name]
+    return result
+
+
+def _binary_struct_dtype(fields, binary2):
+    """
+    Returns the big-endian numpy dtype of a BINARY row, or None if the
+    rows have variable length.
+    """
+    desc = []
+    if binary2:
+        desc.append(("_nulls", "u1", ((len(fields) + 7) // 8,)))
+    for f in fields:
+        if f.variable or f.datatype == "unicodeChar":
+            return None
+        if f.datatype == "char":
+            desc.append((f.name, f"S{f.count}"))
+        elif f.count > 1:
+            desc.append((f.name, ">" + DATATYPES[f.datatype][0], (f.count,)))
+        else:
+            desc.append((f.name, ">" + DATATYPES[f.datatype][0]))
+    return np.dtype(desc)
+
+
+def _read_binary_cell(f, data, offset):
+    count = f.count
+    if f.variable:
+        (count,) = struct.unpack_from(">i", data, offset)
+        offset += 4
+    size = DATATYPES[f.datatype][1] * count
+    raw = data[offset : offset + size]
+    offset += size
+    if f.datatype == "char":
+        value = raw.split(b"\0", 1)[0].decode("ascii", "replace")
+    elif f.datatype == "unicodeChar":
+        value = raw.decode("utf-16-be", "replace").split("\0", 1)[0]
+    else:
+        value = np.frombuffer(raw, dtype=">" + DATATYPES[f.datatype][0])
+        if count == 1 and not f.variable:
+            value = value[0]
+    return value, offset
+
+
+def _parse_binary(fields, stream, binary2):
+    data = base64.b64decode(stream)
+    nulls = None
+    dtype = _binary_struct_dtype(fields, binary2)
+    if dtype is not None:
+        # fixed length rows: decode all of them at once
+        raw = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+        table = np.empty(len(raw), dtype=[(f.name, f.dtype(f.count)) for f in fields])
+        for f in fields:
+            if f.datatype == "char":
+                table[f.name] = np.char.decode(raw[f.name], "ascii", "replace")
+            else:
+                table[f.name] = raw[f.name]
+        if binary2:
+            nulls = np.unpackbits(raw["_nulls"], axis=1)[:, : len(fields)].astype(bool)
+    else:
+        columns = [[] for _ in fields]
+        null_rows = []
+        offset = 0
+        nbytes = (len(fields) + 7) // 8
+        while offset < len(data):
+            if binary2:
+                null_rows.append(np.unpackbits(np.frombuffer(data, "u1", nbytes, offset))[: len(fields)])
+                offset += nbytes
+            for i, f in enumerate(fields):
+                value, offset = _read_binary_cell(f, data, offset)
+                columns[i].append(value)
+        table = _columns_to_array(fields, columns, len(columns[0]) if fields else 0)
+        if binary2:
+            nulls = np.array(null_rows, dtype=bool).reshape(-1, len(fields))
+
+    for i, f in enumerate(fields):
+        column = table[f.name]
+        if f.variable or column.dtype.kind not in "fc":
+            continue
+        if nulls is not None:
+            column[nulls[:, i]] = np.nan
+    return _null_integers(fields, table, nulls)
+
+
+def parse_table(source, columnar=False):
+    """
+    Streams the first TABLE of a VOTable into a numpy structured array,
+    typed from the FIELD datatypes. Handles TABLEDATA, BINARY and BINARY2
+    serializations. Rows are not kept as XML nodes, so memory stays close
+    to the size of the resulting array.
+
+    @param source: file name or file-like object
+    @param columnar: return a dict of column name -> array instead
+    @type columnar: bool
+    """
+    fields = []
+    names = set()
+    table = None
+    serialization = None
+    context = ElementTree.iterparse(source, events=("start", "end"))
+    for event, elem in context:
+        tag = _tag(elem)
+        if event == "start":
+            if tag == "TABLEDATA":
+                table = _parse_tabledata(fields, context)
+                break
+            if tag in ("BINARY", "BINARY2"):
+                serialization = tag
+            continue
+        if tag == "FIELD":
+            name = elem.get("name") or elem.get("ID") or f"col{len(fields)}"
+            field = VOField(elem.attrib, _unique_name(names, name))
+            for child in elem:
+                if _tag(child) == "VALUES" and child.get("null") is not None:
+                    field.null = child.get("null")
+            fields.append(field)
+            elem.clear()
+        elif tag == "STREAM" and serialization is not None:
+            table = _parse_binary(fields, elem.text or "", binary2=(serialization == "BINARY2"))
+            break
+    if table is None:
+        table = _columns_to_array(fields, [[] for _ in fields], 0)
+    if columnar:
+        return {name: table[name] for name in table.dtype.names}
+    return table
+
+
 if __name__ == '__main__':
     votable = VOTable()
     votable.parse(sys.argv[1])
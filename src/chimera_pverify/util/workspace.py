@@ -0,0 +1,90 @@
+"""
+Private scratch directories for plate solves.
+
+solve-field names its outputs after the input file and writes them next to
+it, so two solves of frames with the same name (the same pattern on two
+cameras, say) overwrite each other's .solved markers and WCS. Each solve
+gets its own directory instead, on tmpfs when there is one, and solve-field
+is told not to write the outputs nobody reads.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from chimera_pverify.util.transfer import scratch_directory
+
+log = logging.getLogger(__name__)
+
+# solve-field outputs we never read
+SKIPPED_OUTPUTS = ("--new-fits", "--index-xyls", "--rdls", "--match")
+
+
+class SolveWorkspace:
+    """
+    A directory of its own for the outputs of one solve, removed on exit.
+
+        with SolveWorkspace() as workspace:
+            line = f"solve-field {image} {workspace.solve_field_args('image-out')}"
+
+    @param root: where the directory is created, tmpfs by default
+    @type root: str
+
+    @param keep: leave the directory behind, to debug a solve
+    @type keep: bool
+    """
+
+    def __init__(self, root=None, prefix="solve-", keep=False):
+        self.root = root
+        self.prefix = prefix
+        self.keep = keep
+        self.directory = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix=self.prefix, dir=self.root or scratch_directory())
+        return self
+
+    def __exit__(self, *exc):
+        if self.keep:
+            log.debug(f"Keeping solve workspace {self.directory}")
+        else:
+            self.cleanup()
+        return False
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def solve_field_args(self, outbase, corr=True):
+        """
+        Returns the solve-field options that write the outputs of outbase
+        in this directory and skip those nobody reads. corr keeps the .corr
+        file, needed to count the matched stars.
+        """
+        args = [f"--dir {self.directory}", f"--temp-dir {self.directory}", "--temp-axy", "--no-plots"]
+        args += [f"{option} none" for option in SKIPPED_OUTPUTS]
+        if not corr:
+            args.append("--corr none")
+        return " ".join(args)
+
+    def collect(self, name, destination):
+        """
+        Moves name out of the workspace to destination, atomically when both
+        are on the same file system, and returns destination.
+        """
+        source = self.path(name)
+        try:
+            os.replace(source, destination)
+        except OSError:
+            # across file systems, copy to a temporary name next to destination and rename
+            directory, filename = os.path.split(destination)
+            fd, partial = tempfile.mkstemp(prefix=f".{filename}-", dir=directory or ".")
+            os.close(fd)
+            shutil.copyfile(source, partial)
+            os.replace(partial, destination)
+        return destination
+
+    def cleanup(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None